@@ -0,0 +1,2 @@
+"""Offline benchmark suite for FIKL."""
+# benchmarks/__init__.py
@@ -0,0 +1,59 @@
+"""
+Runs the benchmark suite.
+
+    python -m benchmarks --sizes 10000,100000 --save bench.json
+    python -m benchmarks --compare bench.json
+"""
+# benchmarks/__main__.py
+import json
+
+import typer
+from typing_extensions import Annotated
+from rich import print as rprint
+
+from benchmarks.suite import run_suite, compare, BenchResult
+
+app = typer.Typer(rich_markup_mode="rich")
+
+
+def report(result: BenchResult):
+    """Prints a single result as soon as it is available."""
+    size = "" if result["size"] is None else f"[{result['size']}]"
+    rprint(f"{result['case']}{size}: median {result['median'] * 1000:.2f}ms "
+           f"(min {result['min'] * 1000:.2f}ms, stdev {result['stdev'] * 1000:.2f}ms)")
+
+
+@app.command()
+def bench(*, sizes: Annotated[str, typer.Option(help="Comma separated document counts.")] = "10000",
+            repeat: Annotated[int, typer.Option(help="Timed runs per case.")] = 5,
+            only: Annotated[str, typer.Option(help="Comma separated case names.")] = None,
+            save: Annotated[str, typer.Option(help="Write the results to this file.")] = None,
+            baseline: Annotated[str, typer.Option(
+                "--compare", help="Compare against a saved run.")] = None,
+            threshold: Annotated[float, typer.Option(
+                help="Slowdown ratio that counts as a regression.")] = 1.10):
+    """
+    Times query execution against an in-memory Firestore stand-in.
+    """
+    results = run_suite([int(size) for size in sizes.split(",")], repeat,
+                        only.split(",") if only else None, report)
+
+    if save:
+        with open(save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as file:
+            comparisons = compare(results, json.load(file), threshold)
+
+        for comparison in comparisons:
+            colour = "red" if comparison["regression"] else "green"
+            size = "" if comparison["size"] is None else f"[{comparison['size']}]"
+            rprint(f"[{colour}]{comparison['case']}{size}: {comparison['ratio']:.2f}x[/{colour}]")
+
+        if any(comparison["regression"] for comparison in comparisons):
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,60 @@
+"""Deterministic document generators for the benchmark suite."""
+# benchmarks/data.py
+import datetime
+import random
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+
+FIRST_NAMES = ["Armand", "Bob", "Carla", "Dina", "Eli", "Farah", "Gus", "Hana", "Ivo", "Jude"]
+LAST_NAMES = [f"{prefix}{suffix}" for prefix in ("Al", "Ber", "Cor", "Dia", "Ek", "Fol")
+              for suffix in ("mond", "ton", "vale", "stein", "ridge", "ford")]
+TAGS = ["fiction", "history", "science", "poetry", "travel", "cooking", "biography", "art"]
+
+
+def generate_books(count: int, seed: int = 42) -> dict[str, dict]:
+    """
+    Generates a collection of book documents.
+
+    Returns:
+        dict: The generated documents keyed by document id.
+    """
+    rng = random.Random(seed)
+    books = {}
+    for index in range(count):
+        books[f"book{index:08d}"] = {
+            "title": f"Title {rng.randrange(count * 10):09d}",
+            "year": rng.randrange(1900, 2024),
+            "pages": rng.randrange(50, 1500),
+            "rating": round(rng.random() * 5, 2),
+            "published": rng.random() > 0.1,
+            "tags": rng.sample(TAGS, rng.randrange(0, 4)),
+            "author": {
+                "firstName": rng.choice(FIRST_NAMES),
+                "lastName": rng.choice(LAST_NAMES),
+            },
+        }
+    return books
+
+
+def with_firestore_types(documents: dict[str, dict], seed: int = 42) -> dict[str, dict]:
+    """
+    Adds timestamp, geopoint and bytes fields to the provided documents, the way that they
+    are returned by the Firestore client.
+
+    Returns:
+        dict: The documents with the additional fields.
+    """
+    rng = random.Random(seed)
+    epoch = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    typed = {}
+    for document_id, document in documents.items():
+        created = epoch + datetime.timedelta(seconds=rng.randrange(10 ** 9))
+        typed[document_id] = {
+            **document,
+            "created": DatetimeWithNanoseconds.from_rfc3339(
+                f"{created:%Y-%m-%dT%H:%M:%S}.{rng.randrange(10 ** 9):09d}Z"),
+            "location": GeoPoint(rng.uniform(-90, 90), rng.uniform(-180, 180)),
+            "checksum": rng.randbytes(8),
+        }
+    return typed
@@ -0,0 +1,564 @@
+"""
+An in-memory stand-in for the Firestore client that is used by the benchmark suite.
+
+Only the parts of the google-cloud-firestore surface that FIKL touches are implemented.
+Every round trip to the "server" can be slowed down with an injectable latency so that
+paged scans and writes can be measured without a network.
+"""
+# benchmarks/fake_firestore.py
+import copy
+import datetime
+import time
+import uuid
+from collections import deque
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import (DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion,
+                                       Increment)
+
+from lang.backend import (NAME_FIELD, Descending, FieldTransform, assign as _assign, compare,
+                          lookup as _lookup, resolve_transforms, sort_value, unassign)
+
+EQUALITY_FILTERS = frozenset({"==", "in", "array_contains", "array_contains_any"})
+# how far in the past reads can be pinned, as in Firestore without point-in-time recovery
+HISTORY_RETENTION = datetime.timedelta(hours=1)
+
+
+def _transforms(value):
+    """Converts the Firestore sentinels, at any depth, to field transforms."""
+    match value:
+        case Increment():
+            return FieldTransform("increment", value.value)
+        case ArrayUnion():
+            return FieldTransform("array_union", list(value.values))
+        case ArrayRemove():
+            return FieldTransform("array_remove", list(value.values))
+        case dict():
+            return {key: _transforms(item) for key, item in value.items()}
+    if value is SERVER_TIMESTAMP:
+        return FieldTransform("server_timestamp")
+    if value is DELETE_FIELD:
+        return FieldTransform("delete")
+    return copy.deepcopy(value)
+
+
+def _matches(data: dict, field_path: str, operator: str, expected) -> bool:
+    """Evaluates a single Firestore filter against the provided document data."""
+    found, value = _lookup(data, field_path)
+    return found and compare(value, "not_in" if operator == "not-in" else operator, expected)
+
+
+class FakeDocumentSnapshot:
+    """A snapshot of a document in the fake store."""
+
+    def __init__(self, reference, data: dict | None, fields: list[str] | None = None):
+        self.reference = reference
+        self.id = reference.id  # pylint: disable=invalid-name
+        self._data = data
+        self._fields = fields
+        self.exists = data is not None
+
+    def to_dict(self) -> dict | None:
+        """
+        Returns a fresh copy of the document data. The copy approximates the cost of
+        deserializing the protobuf map that the real client pays on every call.
+        """
+        if self._data is None:
+            return None
+
+        if self._fields is None:
+            return copy.deepcopy(self._data)
+
+        projected = {}
+        for field in self._fields:
+            found, value = _lookup(self._data, field)
+            if found:
+                _assign(projected, field, copy.deepcopy(value))
+        return projected
+
+    def get(self, field_path: str):
+        """Returns the value at the provided field path."""
+        return _lookup(self._data, field_path)[1]
+
+
+class FakeDocumentReference:
+    """A reference to a single document within the fake store."""
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]  # pylint: disable=invalid-name
+        self.parent_path = path.rsplit("/", 1)[0]
+
+    def get(self, field_paths: list[str] | None = None, read_time=None,
+            **_kwargs) -> FakeDocumentSnapshot:
+        """Fetches the document, as it was at the read time when one is provided."""
+        self._client.round_trip()
+        data = self._client.read(self.path, read_time)
+        return FakeDocumentSnapshot(self, data, field_paths)
+
+    def set(self, document_data: dict, merge: bool = False):
+        """Replaces (or merges into) the document."""
+        self._client.round_trip()
+        self._client.write("set", self.path, document_data, merge=merge)
+
+    def create(self, document_data: dict):
+        """Creates the document, failing if it already exists."""
+        self._client.round_trip()
+        self._client.write("create", self.path, document_data)
+
+    def update(self, field_updates: dict):
+        """Updates fields on an existing document."""
+        self._client.round_trip()
+        self._client.write("update", self.path, field_updates)
+
+    def delete(self):
+        """Deletes the document."""
+        self._client.round_trip()
+        self._client.write("delete", self.path, None)
+
+    def collection(self, collection_id: str):
+        """Returns a reference to a subcollection of this document."""
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def collections(self, read_time=None):
+        """Lists the subcollections of this document."""
+        self._client.round_trip()
+        return self._client.child_collections(self.path, read_time)
+
+
+class FakeQuery:
+    """An immutable query over one collection or a collection group."""
+
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, path: str, all_descendants: bool = False):
+        self._client = client
+        self._path = path
+        self._all_descendants = all_descendants
+        self._filters: list[tuple[str, str, object]] = []
+        self._orders: list[tuple[str, str]] = []
+        self._limit: int | None = None
+        self._start_after = None
+        self._start_at = None
+        self._fields: list[str] | None = None
+        self._partition: tuple[str, str | None] | None = None
+
+    def _copy(self, **changes):
+        """Copies the query, applying the provided changes to the copy."""
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field_path: str | None = None, op_string: str | None = None,
+              value=None, *, filter=None):  # pylint: disable=redefined-builtin
+        """Adds a field filter to the query."""
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = ASCENDING):
+        """Adds an ordering to the query."""
+        query = self._copy()
+        query._orders.append((field_path, direction))
+        return query
+
+    def limit(self, count: int):
+        """Limits the number of returned documents."""
+        return self._copy(_limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        """Starts the query after the provided snapshot (or dict of order values)."""
+        return self._copy(_start_after=document_fields_or_snapshot)
+
+    def start_at(self, document_fields_or_snapshot):
+        """Starts the query at the provided snapshot (or dict of order values)."""
+        return self._copy(_start_at=document_fields_or_snapshot)
+
+    def select(self, field_paths: list[str]):
+        """Projects the returned documents to the provided field paths."""
+        return self._copy(_fields=list(field_paths))
+
+    def get_partitions(self, partition_count: int, read_time=None):
+        """Splits the query into partitions of roughly equal numbers of documents."""
+        self._client.round_trip()
+        paths = sorted(path for path, _ in self._candidates(read_time))
+        size = max(1, -(-len(paths) // max(1, partition_count)))
+        bounds = paths[::size] or [""]
+        for index, start in enumerate(bounds):
+            end = bounds[index + 1] if index + 1 < len(bounds) else None
+            yield FakeQueryPartition(self, start, end)
+
+    def _candidates(self, read_time=None):
+        """Yields the (path, data) pairs that the query reads from."""
+        if self._all_descendants:
+            candidates = self._client.documents_in_group(self._path, read_time)
+        else:
+            candidates = self._client.documents_in_collection(self._path, read_time)
+
+        if self._partition is None:
+            return candidates
+
+        start, end = self._partition  # pylint: disable=unpacking-non-sequence
+        return ((path, data) for path, data in candidates
+                if path >= start and (end is None or path < end))
+
+    def _key(self, path: str, data: dict) -> tuple:
+        """Creates the key that orders a document within the query results."""
+        key = []
+        for field, direction in self._orders:
+            value = path if field == NAME_FIELD else sort_value(_lookup(data, field)[1])
+            key.append(Descending(value) if direction == self.DESCENDING else value)
+        key.append(path)
+        return tuple(key)
+
+    def _cursor_key(self, cursor):
+        """Creates the ordering key of a start_after or start_at cursor."""
+        if isinstance(cursor, FakeDocumentSnapshot):
+            return self._key(cursor.reference.path, cursor._data or {})
+        if NAME_FIELD in cursor:
+            return self._key(cursor[NAME_FIELD].path, cursor)
+        return self._key("", cursor)
+
+    def _composite_index(self) -> tuple | None:
+        """
+        Works out the composite index that the query needs: any query that filters or orders
+        on more than one field, except for equality filters alone, which are served by
+        merging single-field indexes.
+
+        Returns:
+            tuple: The collection id, whether the index spans the collection group and the
+            indexed fields, or None when single-field indexes serve the query.
+        """
+        fields = list(dict.fromkeys(
+            [field for field, operator, _ in self._filters if operator in EQUALITY_FILTERS]
+            + [field for field, operator, _ in self._filters if operator not in EQUALITY_FILTERS]
+            + [field for field, _ in self._orders if field != NAME_FIELD]))
+        equality_only = not self._orders and all(operator in EQUALITY_FILTERS
+                                                 for _, operator, _ in self._filters)
+        if len(fields) <= 1 or equality_only:
+            return None
+        return (self._path.rsplit("/", 1)[-1], self._all_descendants, tuple(fields))
+
+    def _has_index(self, index: tuple) -> bool:
+        """
+        Indicates if the composite index exists. Equality filters along with an order by are
+        also served by merging the indexes of every filtered field and the ordered fields.
+        """
+        indexes = self._client.indexes
+        if indexes is None or index in indexes:
+            return True
+
+        ordered = tuple(dict.fromkeys(field for field, _ in self._orders))
+        if not ordered or any(operator not in EQUALITY_FILTERS for _, operator, _ in self._filters):
+            return False
+        filtered = [field for field, _, _ in self._filters if field not in ordered]
+        return all((index[0], index[1], (field,) + ordered) in indexes for field in filtered)
+
+    def stream(self, read_time=None, **_kwargs):
+        """Streams the snapshots that match the query, as of the read time if one is provided."""
+        self._client.round_trip()
+
+        index = self._composite_index()
+        if index is not None and not self._has_index(index):
+            raise exceptions.FailedPrecondition(
+                "The query requires an index. You can create it here: "
+                f"https://console.firebase.google.com/project/{self._client.project}"
+                f"/firestore/indexes?create_composite={'/'.join(index[2])}")
+
+        matched = [
+            (path, data) for path, data in self._candidates(read_time)
+            if all(_matches(data, *flt) for flt in self._filters)
+            and all(field == NAME_FIELD or _lookup(data, field)[0] for field, _ in self._orders)
+        ]
+        matched.sort(key=lambda item: self._key(*item))
+
+        if self._start_at is not None:
+            cursor_key = self._cursor_key(self._start_at)
+            matched = [item for item in matched if self._key(*item) >= cursor_key]
+
+        if self._start_after is not None:
+            cursor_key = self._cursor_key(self._start_after)
+            if isinstance(self._start_after, dict):
+                cursor_key = cursor_key[:-1]
+                matched = [item for item in matched
+                           if self._key(*item)[:-1] > cursor_key]
+            else:
+                matched = [item for item in matched if self._key(*item) > cursor_key]
+
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        for path, data in matched:
+            self._client.document_latency()
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._client, path),
+                                       data, self._fields)
+
+    def get(self, **kwargs) -> list[FakeDocumentSnapshot]:
+        """Returns all of the snapshots that match the query."""
+        return list(self.stream(**kwargs))
+
+    def count(self, alias: str | None = None):
+        """Creates an aggregation query that counts the matching documents."""
+        return FakeAggregationQuery(self, alias)
+
+
+class FakeAggregationResult:
+    """The result of a single aggregation."""
+
+    def __init__(self, alias: str | None, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeAggregationQuery:
+    """Counts the documents of a query with a single round trip."""
+
+    def __init__(self, query: FakeQuery, alias: str | None):
+        self._query = query
+        self._alias = alias
+
+    def get(self, read_time=None, **_kwargs) -> list[list[FakeAggregationResult]]:
+        """Runs the aggregation without paying the latency of streaming the documents."""
+        client = self._query._client
+        latency, client.doc_latency = client.doc_latency, 0.0
+        try:
+            value = sum(1 for _ in self._query.stream(read_time=read_time))
+        finally:
+            client.doc_latency = latency
+        return [[FakeAggregationResult(self._alias, value)]]
+
+
+class FakeQueryPartition:
+    """A range of the documents of a collection group query."""
+
+    def __init__(self, parent: FakeQuery, start: str, end: str | None):
+        self._parent = parent
+        self.start_at = start
+        self.end_at = end
+
+    def query(self) -> FakeQuery:
+        """Creates the query that reads the documents of the partition."""
+        return self._parent._copy(_partition=(self.start_at, self.end_at))
+
+
+class FakeCollectionReference(FakeQuery):
+    """A reference to a collection in the fake store."""
+
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]  # pylint: disable=invalid-name
+
+    def document(self, document_id: str | None = None) -> FakeDocumentReference:
+        """Returns a reference to a document within the collection."""
+        document_id = document_id or uuid.uuid4().hex[:20]
+        return FakeDocumentReference(self._client, f"{self._path}/{document_id}")
+
+    def add(self, document_data: dict, document_id: str | None = None):
+        """Adds a new document to the collection."""
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return (None, reference)
+
+
+class FakeWriteBatch:
+    """Accumulates writes and applies them with a single round trip."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data: dict):
+        """Queues a create."""
+        self._writes.append(("create", reference.path, document_data, False))
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        """Queues a set."""
+        self._writes.append(("set", reference.path, document_data, merge))
+
+    def update(self, reference, field_updates: dict):
+        """Queues an update."""
+        self._writes.append(("update", reference.path, field_updates, False))
+
+    def delete(self, reference):
+        """Queues a delete."""
+        self._writes.append(("delete", reference.path, None, False))
+
+    def commit(self):
+        """
+        Applies all queued writes, or none of them when the precondition of any write fails.
+        """
+        self._client.round_trip()
+        exists: dict[str, bool] = {}
+        for operation, path, _, _ in self._writes:
+            if path not in exists:
+                exists[path] = self._client.read(path) is not None
+            if operation == "create" and exists[path]:
+                raise ValueError(f"Document already exists: {path}")
+            if operation == "update" and not exists[path]:
+                raise ValueError(f"No document to update: {path}")
+            exists[path] = operation != "delete"
+
+        for operation, path, data, merge in self._writes:
+            self._client.write(operation, path, data, merge=merge)
+        writes, self._writes = self._writes, []
+        return writes
+
+
+class FakeClient:
+    """
+    An in-memory replacement for firestore.Client.
+
+    Attributes:
+        rpc_latency -- seconds to sleep for every round trip
+        document_latency -- seconds to sleep for every streamed document
+        indexes -- the composite indexes that exist, as (collection id, collection group,
+                   fields), or None when every index exists
+    """
+
+    def __init__(self, rpc_latency: float = 0.0, doc_latency: float = 0.0):
+        self.rpc_latency = rpc_latency
+        self.doc_latency = doc_latency
+        self.round_trips = 0
+        self.project = "fake-project"
+        self.indexes: set[tuple] | None = None
+        self._collections: dict[str, dict[str, dict]] = {}
+        # the writes of the last HISTORY_RETENTION, with the time that they were applied and
+        # the document as it was before. Writes replace stored documents rather than change
+        # them, so the previous documents are kept without copying them.
+        self._history: deque[tuple[datetime.datetime, str, dict | None]] = deque()
+
+    def round_trip(self):
+        """Records (and optionally delays) a round trip to the server."""
+        self.round_trips += 1
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+
+    def document_latency(self):
+        """Delays the delivery of a single streamed document."""
+        if self.doc_latency:
+            time.sleep(self.doc_latency)
+
+    def load(self, collection_path: str, documents: dict[str, dict]):
+        """Seeds a collection without paying any latency."""
+        self._collections.setdefault(collection_path, {}).update(copy.deepcopy(documents))
+
+    def read(self, path: str, read_time=None) -> dict | None:
+        """Reads the raw data of a document, as it was at the read time if one is provided."""
+        collection_path, document_id = path.rsplit("/", 1)
+        return self.collections_at(read_time).get(collection_path, {}).get(document_id)
+
+    def collections_at(self, read_time=None) -> dict[str, dict[str, dict]]:
+        """Returns the collections as they were at the read time, undoing the later writes."""
+        if read_time is None:
+            return self._collections
+        if read_time < datetime.datetime.now(datetime.timezone.utc) - HISTORY_RETENTION:
+            raise exceptions.InvalidArgument(f"The read time {read_time} is too old")
+
+        collections = {path: dict(documents) for path, documents in self._collections.items()}
+        for written, path, previous in reversed(self._history):
+            if written <= read_time:
+                break
+            collection_path, document_id = path.rsplit("/", 1)
+            if previous is None:
+                collections.setdefault(collection_path, {}).pop(document_id, None)
+            else:
+                collections.setdefault(collection_path, {})[document_id] = previous
+        return collections
+
+    def write(self, operation: str, path: str, data: dict | None, merge: bool = False):
+        """Applies a single write to the store, remembering the document as it was."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        while self._history and now - self._history[0][0] > HISTORY_RETENTION:
+            self._history.popleft()
+        collection_path, document_id = path.rsplit("/", 1)
+        collection = self._collections.setdefault(collection_path, {})
+        self._history.append((now, path, collection.get(document_id)))
+        data = _transforms(data)
+        match operation:
+            case "create":
+                if document_id in collection:
+                    raise ValueError(f"Document already exists: {path}")
+                collection[document_id] = resolve_transforms(data)
+            case "set":
+                if merge and document_id in collection:
+                    collection[document_id] = self._update_fields(collection[document_id], data)
+                else:
+                    collection[document_id] = resolve_transforms(data)
+            case "update":
+                if document_id not in collection:
+                    raise ValueError(f"No document to update: {path}")
+                collection[document_id] = self._update_fields(collection[document_id], data)
+            case "delete":
+                collection.pop(document_id, None)
+
+    @staticmethod
+    def _update_fields(document: dict, data: dict) -> dict:
+        """Applies field updates, keyed by dotted field paths, to a copy of a stored document."""
+        document = copy.deepcopy(document)
+        for key, value in data.items():
+            if isinstance(value, FieldTransform) and value.kind == "delete":
+                unassign(document, key)
+            elif isinstance(value, FieldTransform):
+                _assign(document, key, value.apply(*_lookup(document, key)))
+            else:
+                _assign(document, key, value)
+        return document
+
+    def documents_in_collection(self, collection_path: str, read_time=None):
+        """Yields (path, data) for each document in a collection."""
+        for document_id, data in self.collections_at(read_time).get(collection_path, {}).items():
+            yield (f"{collection_path}/{document_id}", data)
+
+    def documents_in_group(self, collection_id: str, read_time=None):
+        """Yields (path, data) for each document in every collection with the provided id."""
+        collections = self.collections_at(read_time)
+        for collection_path in list(collections):
+            if collection_path.rsplit("/", 1)[-1] == collection_id:
+                for document_id, data in collections[collection_path].items():
+                    yield (f"{collection_path}/{document_id}", data)
+
+    def child_collections(self, parent_path: str | None, read_time=None):
+        """Lists the collections directly beneath a document (or the root)."""
+        depth = 0 if parent_path is None else parent_path.count("/") + 1
+        prefix = "" if parent_path is None else f"{parent_path}/"
+        names = sorted({path for path, documents in self.collections_at(read_time).items()
+                        if path.startswith(prefix) and path.count("/") == depth and documents})
+        return [FakeCollectionReference(self, path) for path in names]
+
+    def collection(self, path: str) -> FakeCollectionReference:
+        """Returns a reference to a collection."""
+        return FakeCollectionReference(self, path)
+
+    def collection_group(self, collection_id: str) -> FakeQuery:
+        """Returns a query over every collection with the provided id."""
+        return FakeQuery(self, collection_id, all_descendants=True)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        """Returns a reference to a document."""
+        return FakeDocumentReference(self, path)
+
+    def collections(self, read_time=None):
+        """Lists the root level collections."""
+        self.round_trip()
+        return self.child_collections(None, read_time)
+
+    def get_all(self, references, field_paths: list[str] | None = None, read_time=None,
+                **_kwargs):
+        """Fetches many documents with a single round trip."""
+        self.round_trip()
+        collections = self.collections_at(read_time)
+        for reference in references:
+            collection_path, document_id = reference.path.rsplit("/", 1)
+            yield FakeDocumentSnapshot(reference, collections.get(collection_path, {})
+                                       .get(document_id), field_paths)
+
+    def batch(self) -> FakeWriteBatch:
+        """Creates a new write batch."""
+        return FakeWriteBatch(self)
@@ -0,0 +1,333 @@
+"""
+The benchmark cases and the machinery that times them.
+
+Each case is registered with the @case decorator. The decorated function receives the
+document count and returns the callable that is timed, so that any setup work is excluded
+from the measurement.
+"""
+# benchmarks/suite.py
+import contextlib
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from typing import TypedDict
+
+from lang import ql
+from lang.backend import Backend, FirestoreBackend, MemoryBackend, use_backend
+from lang.transformer import parse, FIKLFormatType
+
+from benchmarks.data import generate_books, with_firestore_types
+from benchmarks.fake_firestore import FakeClient
+
+SEED = 42
+
+
+class BenchCase(TypedDict):
+    """The definition of a benchmark case."""
+    name: str
+    sized: bool
+    setup: Callable[[int], Callable[[], object]]
+
+
+class BenchResult(TypedDict):
+    """The timings that were recorded for a single case at a single size."""
+    case: str
+    size: int | None
+    repeat: int
+    min: float
+    median: float
+    mean: float
+    stdev: float
+
+
+CASES: list[BenchCase] = []
+
+PARSE_QUERIES = [
+    'select * from books',
+    'select title, "author.lastName" from books where year >= 2000 and pages < 300 limit 10',
+    'select * from books where "author.lastName"^ like "Al%" order by year^ desc, title',
+    'select count * within books where tags array_contains "poetry"',
+    'update from books set published = true, "author.firstName" = "Bob" where year == 2001',
+    'insert into books set title = "Mutants", year = 2005 identified by "mutants"',
+    'select * from books order by year page 500 format csv output "~/books.csv"',
+]
+
+
+def case(name: str, sized: bool = True):
+    """Registers a benchmark case."""
+    def register(setup: Callable[[int], Callable[[], object]]):
+        CASES.append({"name": name, "sized": sized, "setup": setup})
+        return setup
+    return register
+
+
+@contextlib.contextmanager
+def using_backend(backend: Backend):
+    """Points the query executor at the provided backend."""
+    previous = use_backend(backend)
+    try:
+        yield backend
+    finally:
+        use_backend(previous)
+
+
+def books_backend(size: int, rpc_latency: float = 0.0, memory: bool = False) -> Backend:
+    """
+    Creates a backend that holds the generated books collection. Unless the memory backend
+    is requested, the Firestore backend is used on top of the fake client.
+    """
+    if memory:
+        return MemoryBackend({"books": generate_books(size, SEED)})
+
+    client = FakeClient(rpc_latency=rpc_latency)
+    client.load("books", generate_books(size, SEED))
+    return FirestoreBackend(client)
+
+
+def query_runner(query: str, size: int, rpc_latency: float = 0.0,
+                 memory: bool = False) -> Callable[[], object]:
+    """Creates a callable that runs a query against a seeded backend."""
+    backend = books_backend(size, rpc_latency, memory)
+
+    def run():
+        with using_backend(backend):
+            return ql.run_query(query)
+    return run
+
+
+@case("parse", sized=False)
+def bench_parse(_size: int):
+    """Parses a representative mix of statements."""
+    return lambda: [parse(query) for query in PARSE_QUERIES]
+
+
+@case("filter_local")
+def bench_filter_local(size: int):
+    """Filters every document locally."""
+    return query_runner(
+        'select * from books where year^ >= 1990 and "author.lastName"^ like "Al%"', size)
+
+
+@case("sort_local")
+def bench_sort_local(size: int):
+    """Sorts every document locally on two columns."""
+    return query_runner('select title, year from books order by year^ desc, title^', size)
+
+
+@case("group_local")
+def bench_group_local(size: int):
+    """Groups every document locally."""
+    return query_runner('select * from books group by "author.lastName"', size)
+
+
+@case("distinct_local")
+def bench_distinct_local(size: int):
+    """Computes distinct values locally."""
+    return query_runner('select distinct "author.lastName", year from books', size)
+
+
+@case("server_filter")
+def bench_server_filter(size: int):
+    """Filters on the server with an equality clause."""
+    return query_runner('select title from books where "author.lastName" == "Almond"', size)
+
+
+@case("server_filter_memory")
+def bench_server_filter_memory(size: int):
+    """Filters with an equality clause that the memory backend serves from an index."""
+    return query_runner('select title from books where "author.lastName" == "Almond"', size,
+                        memory=True)
+
+
+@case("range_filter_memory")
+def bench_range_filter_memory(size: int):
+    """Filters with a range clause that the memory backend serves from a sorted index."""
+    return query_runner('select title from books where year >= 2020 and pages^ > 1000', size,
+                        memory=True)
+
+
+@case("serialize_json")
+def bench_serialize_json(size: int):
+    """Serializes documents as JSON."""
+    documents = list(generate_books(size, SEED).values())
+    return lambda: ql.output_as(documents, FIKLFormatType.JSON)
+
+
+@case("serialize_json_compact")
+def bench_serialize_json_compact(size: int):
+    """Serializes documents as compact JSON."""
+    documents = list(generate_books(size, SEED).values())
+    return lambda: ql.output_as(documents, FIKLFormatType.JSON_COMPACT)
+
+
+@case("serialize_json_typed")
+def bench_serialize_json_typed(size: int):
+    """Serializes documents that hold timestamps, geopoints and bytes as JSON."""
+    documents = list(with_firestore_types(generate_books(size, SEED)).values())
+    return lambda: ql.output_as(documents, FIKLFormatType.JSON)
+
+
+@case("serialize_csv")
+def bench_serialize_csv(size: int):
+    """Serializes documents as CSV."""
+    documents = list(generate_books(size, SEED).values())
+    return lambda: ql.output_as(documents, FIKLFormatType.CSV)
+
+
+@case("paged_scan")
+def bench_paged_scan(size: int):
+    """Scans the whole collection in pages, paying 1ms for every round trip."""
+    return query_runner('select * from books order by year page 500', size, rpc_latency=0.001)
+
+
+@case("paged_scan_memory")
+def bench_paged_scan_memory(size: int):
+    """Scans the whole collection in pages from the memory backend."""
+    return query_runner('select * from books order by year page 500', size, memory=True)
+
+
+@case("bulk_update")
+def bench_bulk_update(size: int):
+    """Updates a tenth of the collection."""
+    return query_runner('update from books set published = true where pages < 195', size)
+
+
+@case("bulk_update_latency")
+def bench_bulk_update_latency(size: int):
+    """Updates a tenth of the collection, paying 5ms for every round trip."""
+    return query_runner('update from books set published = true where pages < 195', size,
+                        rpc_latency=0.005)
+
+
+@case("bulk_insert")
+def bench_bulk_insert(size: int):
+    """Inserts one document for every hundred in the collection."""
+    backend = FirestoreBackend(FakeClient())
+    queries = [f'insert into books set title = "Inserted", year = {index}, '
+               f'"author.lastName" = "Diamond"' for index in range(max(1, size // 100))]
+
+    def run():
+        with using_backend(backend):
+            for query in queries:
+                ql.run_query(query)
+    return run
+
+
+@case("bulk_insert_rows")
+def bench_bulk_insert_rows(size: int):
+    """Inserts one document for every hundred in the collection with a single statement."""
+    backend = FirestoreBackend(FakeClient())
+    rows = ", ".join(f'("Inserted", {index}, "Diamond")' for index in range(max(1, size // 100)))
+    query = f'insert into books (title, year, "author.lastName") values {rows}'
+
+    def run():
+        with using_backend(backend):
+            return ql.run_query(query)
+    return run
+
+
+@case("bulk_import")
+def bench_bulk_import(size: int):
+    """Imports every document from an NDJSON file, paying 1ms for every round trip."""
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, "books.ndjson")
+    with open(source, "w", encoding="utf-8") as file:
+        for document_id, book in generate_books(size, SEED).items():
+            file.write(json.dumps({"id": document_id, **book}) + "\n")
+    backend = FirestoreBackend(FakeClient(rpc_latency=0.001))
+
+    def run():
+        with using_backend(backend):
+            return ql.run_query(f'import into books from "{source}" identified by id')
+    return run
+
+
+@case("export_recursive")
+def bench_export_recursive(size: int):
+    """
+    Exports the collection and the reviews of every hundredth book, paying 1ms for every
+    round trip.
+    """
+    client = FakeClient(rpc_latency=0.001)
+    books = generate_books(size, SEED)
+    client.load("books", books)
+    for document_id in list(books)[::100]:
+        client.load(f"books/{document_id}/reviews", {"r1": {"stars": 5}, "r2": {"stars": 3}})
+    backend = FirestoreBackend(client)
+
+    def run():
+        with using_backend(backend), tempfile.TemporaryDirectory() as directory:
+            return ql.run_query(f'export from books recursive to "{directory}" gzip')
+    return run
+
+
+def time_case(bench: BenchCase, size: int | None, repeat: int) -> BenchResult:
+    """Times a single case, returning summary statistics of the wall clock durations."""
+    run = bench["setup"](size or 0)
+    run()  # warm up
+
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - started)
+
+    return {
+        "case": bench["name"],
+        "size": size,
+        "repeat": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.fmean(durations),
+        "stdev": statistics.stdev(durations) if repeat > 1 else 0.0,
+    }
+
+
+def run_suite(sizes: list[int], repeat: int, only: list[str] | None = None,
+              report: Callable[[BenchResult], None] = lambda result: None) -> dict:
+    """
+    Runs every selected case at every requested size.
+
+    Returns:
+        dict: The environment details and the results of every case.
+    """
+    results = []
+    for bench in CASES:
+        if only and not any(name in bench["name"] for name in only):
+            continue
+        for size in (sizes if bench["sized"] else [None]):
+            result = time_case(bench, size, repeat)
+            report(result)
+            results.append(result)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "seed": SEED,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[dict]:
+    """
+    Compares the median timings of two runs.
+
+    Returns:
+        list: One entry per case/size present in both runs with the ratio of the medians.
+    """
+    previous = {(result["case"], result["size"]): result for result in baseline["results"]}
+    comparisons = []
+    for result in current["results"]:
+        if (key := (result["case"], result["size"])) not in previous:
+            continue
+        ratio = result["median"] / previous[key]["median"]
+        comparisons.append({"case": result["case"], "size": result["size"],
+                            "ratio": ratio, "regression": ratio > threshold})
+    return comparisons
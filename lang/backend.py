@@ -0,0 +1,977 @@
+"""This module provides the storage backends that fikl queries are executed against."""
+# lang/backend.py
+# pylint: disable=too-many-return-statements
+import contextlib
+import copy
+import datetime
+import json
+import re
+import threading
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterator
+from enum import Flag, auto
+from typing import TypedDict
+
+from firebase_admin import firestore as fs
+
+from google.cloud.firestore_v1 import (DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion,
+                                       GeoPoint, Increment)
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from lang.transformer import FIKLWhere, FIKLOrderBy, FIKLSubjectType
+
+DISJUNCTIVE_OPERATORS = frozenset({"in", "not_in", "array_contains_any"})
+ALL_OPERATORS = frozenset({"<", "<=", "==", "!=", ">=", ">", "in", "not_in",
+                           "array_contains", "array_contains_any", "like"})
+FIRESTORE_OPERATORS = ALL_OPERATORS - {"like"}
+INDEXED_OPERATORS = frozenset({"<", "<=", "==", ">=", ">", "in",
+                               "array_contains", "array_contains_any"})
+HINTED_OPERATORS = frozenset({"<", "<=", "==", ">=", ">", "in"})
+NAME_FIELD = "__name__"
+DEFAULT_DATABASE = "(default)"
+SORTED_CACHE_SIZE = 8
+
+
+class Capability(Flag):
+    """The optional features that a backend is able to execute on the server."""
+    NONE = 0
+    PROJECTION = auto()
+    AGGREGATION = auto()
+    OR_FILTERS = auto()
+    PARTITIONING = auto()
+    BULK_WRITES = auto()
+    LOCAL_INDEXES = auto()
+    SNAPSHOTS = auto()
+
+
+class FIKLScan(TypedDict, total=False):
+    """
+    The definition of the part of a query that is pushed down to a backend. The local clauses
+    are evaluated by the caller, a backend may use them to narrow the documents that it reads.
+    """
+    subject: str
+    subject_type: FIKLSubjectType
+    where: list[FIKLWhere]
+    order: list[FIKLOrderBy]
+    limit: int | None
+    fields: list[str] | None
+    # a snapshot, or the order by values of a document with its path under NAME_FIELD
+    start_after: object | None
+    start_at: str | None
+    partition: object | None
+    local_where: list[FIKLWhere]
+    local_order: list[FIKLOrderBy]
+
+
+class FIKLWrite(TypedDict):
+    """The definition of a single write within a batch of writes."""
+    operation: str
+    path: str
+    data: dict | None
+
+
+class FieldTransform:
+    """
+    A value that the backend computes from the current value of a field as it is written, so
+    that the document does not have to be read first.
+
+    Attributes:
+        kind -- increment, array_union, array_remove, server_timestamp or delete
+        operand -- the amount to increment by or the elements to add or remove
+    """
+    __slots__ = ("kind", "operand")
+
+    def __init__(self, kind: str, operand=None):
+        self.kind = kind
+        self.operand = operand
+
+    def __repr__(self):
+        return f"FieldTransform({self.kind!r}, {self.operand!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, FieldTransform) and \
+            (self.kind, self.operand) == (other.kind, other.operand)
+
+    def __hash__(self):
+        return hash((self.kind, repr(self.operand)))
+
+    def apply(self, found: bool, current):
+        """Computes the new value of a field the way that Firestore does."""
+        match self.kind:
+            case "increment":
+                is_number = found and isinstance(current, (int, float)) \
+                    and not isinstance(current, bool)
+                return current + self.operand if is_number else self.operand
+            case "array_union":
+                result = list(current) if found and isinstance(current, list) else []
+                for item in self.operand:
+                    if item not in result:
+                        result.append(item)
+                return result
+            case "array_remove":
+                if not found or not isinstance(current, list):
+                    return []
+                return [item for item in current if item not in self.operand]
+            case "server_timestamp":
+                return datetime.datetime.now(datetime.timezone.utc)
+        raise ValueError(f"Unknown transform: {self.kind}")
+
+    def to_firestore(self):
+        """Converts the transform to the equivalent Firestore sentinel."""
+        match self.kind:
+            case "increment":
+                return Increment(self.operand)
+            case "array_union":
+                return ArrayUnion(self.operand)
+            case "array_remove":
+                return ArrayRemove(self.operand)
+            case "server_timestamp":
+                return SERVER_TIMESTAMP
+        return DELETE_FIELD
+
+
+class Backend:
+    """
+    The base class for all storage backends.
+
+    Attributes:
+        name -- the name that is shown to users
+        capabilities -- the optional features that the backend executes itself
+        operators -- the where operators that the backend can evaluate
+        throttled -- whether mass writes must ramp up gradually and back off when the
+                     backend pushes back
+    """
+    name = "backend"
+    capabilities = Capability.NONE
+    operators = FIRESTORE_OPERATORS
+    throttled = False
+    read_time: datetime.datetime | None = None
+
+    def supports(self, capability: Capability) -> bool:
+        """Indicates if the backend executes the provided capability itself."""
+        return capability in self.capabilities
+
+    @contextlib.contextmanager
+    def pinned(self, read_time: datetime.datetime | None) -> Iterator[None]:
+        """
+        Pins every read of the backend, from any thread, to the provided time while the
+        context is open (requires SNAPSHOTS). Without a time the reads are left as they are.
+        """
+        if read_time is None:
+            yield
+            return
+
+        if not self.supports(Capability.SNAPSHOTS):
+            raise ValueError(f"Reads as of a point in time are not supported by the {self.name} "
+                             "backend")
+        previous, self.read_time = self.read_time, read_time
+        try:
+            yield
+        finally:
+            self.read_time = previous
+
+    def stream(self, scan: FIKLScan) -> Iterator:
+        """Streams the document snapshots that match the scan."""
+        raise NotImplementedError
+
+    def count(self, scan: FIKLScan) -> int:
+        """Counts the documents that match the scan (requires AGGREGATION)."""
+        raise NotImplementedError
+
+    def partitions(self, scan: FIKLScan, count: int) -> list[FIKLScan]:
+        """Splits an unfiltered scan into disjoint scans (requires PARTITIONING)."""
+        raise NotImplementedError
+
+    def get(self, path: str, fields: list[str] | None = None):
+        """Fetches a single document snapshot."""
+        raise NotImplementedError
+
+    def get_all(self, paths: list[str], fields: list[str] | None = None) -> Iterator:
+        """Fetches many document snapshots, in any order."""
+        for path in paths:
+            yield self.get(path, fields)
+
+    def collections(self, path: str | None = None) -> list[str]:
+        """Lists the collection ids beneath a document, or at the root."""
+        raise NotImplementedError
+
+    def add(self, collection: str, data: dict, document_id: str | None = None) -> str:
+        """Adds a new document to a collection and returns its path."""
+        raise NotImplementedError
+
+    def document_path(self, collection: str, document_id: str | None = None) -> str:
+        """Creates the path of a document, generating an id when one is not provided."""
+        raise NotImplementedError
+
+    def update(self, path: str, data: dict):
+        """Updates fields on an existing document."""
+        raise NotImplementedError
+
+    def delete(self, path: str):
+        """Deletes a document."""
+        raise NotImplementedError
+
+    def commit(self, writes: list[FIKLWrite]):
+        """Applies a list of writes atomically (requires BULK_WRITES)."""
+        raise NotImplementedError
+
+    def create_index(self, collection: str, field: str) -> int:
+        """Builds the local indexes of a field of a collection (requires LOCAL_INDEXES)."""
+        raise ValueError(f"Local indexes are not supported by the {self.name} backend")
+
+    def scope(self) -> str | None:
+        """Identifies the database that the backend reads, None when it is not persistent."""
+        return None
+
+
+class FirestoreBackend(Backend):
+    """Executes queries against Cloud Firestore."""
+    name = "Firestore"
+    capabilities = (Capability.PROJECTION | Capability.AGGREGATION | Capability.OR_FILTERS
+                    | Capability.PARTITIONING | Capability.BULK_WRITES | Capability.SNAPSHOTS)
+    throttled = True
+
+    def __init__(self, client=None, database: str | None = None):
+        self._client = client
+        self.database = database
+
+    @property
+    def client(self):
+        """The Firestore client, resolved the first time that it is needed."""
+        if self._client is None:
+            self._client = firestore_client(None, self.database)
+        return self._client
+
+    def scope(self) -> str | None:
+        if self.database in (None, DEFAULT_DATABASE):
+            return f"firestore:{self.client.project}"
+        return f"firestore:{self.client.project}/{self.database}"
+
+    def _query(self, scan: FIKLScan):
+        """Builds the Firestore query for the provided scan."""
+        if scan.get("partition") is not None:
+            query = scan["partition"].query()
+        elif scan["subject_type"] == FIKLSubjectType.COLLECTION_GROUP:
+            query = self.client.collection_group(scan["subject"])
+        else:
+            query = self.client.collection(scan["subject"])
+
+        for where in scan.get("where") or []:
+            corrected_operator = "not-in" if where["operator"] == "not_in" else where["operator"]
+            query = query.where(filter=FieldFilter(where["property"], corrected_operator,
+                                                   where["value"]))
+
+        direction = "ASCENDING"
+        for order in scan.get("order") or []:
+            direction = "ASCENDING" if order["direction"] == "asc" else "DESCENDING"
+            query = query.order_by(order["property"], direction=direction)
+
+        if isinstance(cursor := scan.get("start_after"), dict):
+            # values only order the documents that tie by their path when it is ordered by
+            if all(order["property"] != NAME_FIELD for order in scan.get("order") or []):
+                query = query.order_by(NAME_FIELD, direction=direction)
+            cursor = {**cursor, NAME_FIELD: self.client.document(cursor[NAME_FIELD])}
+
+        if scan.get("fields") is not None:
+            query = query.select(scan["fields"])
+
+        if cursor is not None:
+            query = query.start_after(cursor)
+
+        if scan.get("start_at") is not None:
+            query = query.start_at({NAME_FIELD: self.client.document(scan["start_at"])})
+
+        if scan.get("limit") is not None:
+            query = query.limit(scan["limit"])
+
+        return query
+
+    def _read_options(self) -> dict:
+        """The options of a read, which only pin it when a read time is set."""
+        return {} if self.read_time is None else {"read_time": self.read_time}
+
+    def stream(self, scan: FIKLScan) -> Iterator:
+        return self._query(scan).stream(**self._read_options())
+
+    def count(self, scan: FIKLScan) -> int:
+        results = self._query(scan).count().get(**self._read_options())
+        return int(results[0][0].value)
+
+    def partitions(self, scan: FIKLScan, count: int) -> list[FIKLScan]:
+        if scan["subject_type"] != FIKLSubjectType.COLLECTION_GROUP:
+            return [scan]
+        group = self.client.collection_group(scan["subject"])
+        return [{**scan, "partition": partition}
+                for partition in group.get_partitions(count, **self._read_options())]
+
+    def get(self, path: str, fields: list[str] | None = None):
+        return self.client.document(path).get(field_paths=fields, **self._read_options())
+
+    def get_all(self, paths: list[str], fields: list[str] | None = None) -> Iterator:
+        return self.client.get_all([self.client.document(path) for path in paths],
+                                   field_paths=fields, **self._read_options())
+
+    def collections(self, path: str | None = None) -> list[str]:
+        collections_fn = (self.client.collections if path is None
+                          else self.client.document(path).collections)
+        return [coll.id for coll in collections_fn(**self._read_options())]
+
+    def add(self, collection: str, data: dict, document_id: str | None = None) -> str:
+        _, reference = self.client.collection(collection).add(firestore_values(data),
+                                                               document_id=document_id)
+        return reference.path
+
+    def document_path(self, collection: str, document_id: str | None = None) -> str:
+        return self.client.collection(collection).document(document_id).path
+
+    def update(self, path: str, data: dict):
+        self.client.document(path).update(firestore_values(data))
+
+    def delete(self, path: str):
+        self.client.document(path).delete()
+
+    def commit(self, writes: list[FIKLWrite]):
+        batch = self.client.batch()
+        for write in writes:
+            reference = self.client.document(write["path"])
+            data = firestore_values(write["data"])
+            match write["operation"]:
+                case "create":
+                    batch.create(reference, data)
+                case "set":
+                    batch.set(reference, data)
+                case "update":
+                    batch.update(reference, data)
+                case "delete":
+                    batch.delete(reference)
+        batch.commit()
+
+
+def firestore_client(app, database: str | None):
+    """
+    Creates the Firestore client of a database of a Firebase app. The database is only named
+    when it is not the default one, which older Firebase Admin SDKs can not name.
+
+    Returns:
+        Client: The client of the database.
+    """
+    if database in (None, DEFAULT_DATABASE):
+        return fs.client(app)
+    return fs.client(app, database_id=database)
+
+
+def lookup(data: dict | None, field_path: str) -> tuple[bool, object]:
+    """
+    Resolves a dotted field path against a nested dict.
+
+    Returns:
+        tuple: Whether the field exists and the value of the field.
+    """
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return (False, None)
+        value = value[part]
+    return (True, value)
+
+
+def assign(data: dict, field_path: str, value):
+    """Assigns a value to a dotted field path within a nested dict."""
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    data[parts[-1]] = value
+
+
+def sort_value(value) -> tuple:
+    """
+    Creates a key that orders mixed values the way that Firestore orders them:
+    null, booleans, numbers, timestamps, strings, bytes, references, geopoints, arrays, maps.
+    """
+    match value:
+        case None:
+            return (0, 0)
+        case bool():
+            return (1, value)
+        case int() | float():
+            return (2, value)
+        case datetime.datetime():
+            as_utc = value if value.tzinfo is None else \
+                value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return (3, as_utc)
+        case str():
+            return (4, value)
+        case bytes():
+            return (5, value)
+        case GeoPoint():
+            return (7, (value.latitude, value.longitude))
+        case list() | tuple():
+            return (8, tuple(sort_value(item) for item in value))
+        case dict():
+            return (9, tuple(sorted((key, sort_value(item)) for key, item in value.items())))
+
+    if isinstance(getattr(value, "path", None), str):
+        return (6, value.path)
+    return (10, repr(value))
+
+
+def firestore_values(data: dict | None) -> dict | None:
+    """
+    Replaces field transforms, at any depth, with the Firestore sentinels.
+
+    Returns:
+        dict: The data to write to Firestore.
+    """
+    if data is None:
+        return None
+    return {key: value.to_firestore() if isinstance(value, FieldTransform)
+            else firestore_values(value) if isinstance(value, dict) else value
+            for key, value in data.items()}
+
+
+def resolve_transforms(data: dict) -> dict:
+    """
+    Replaces field transforms, at any depth, with the values that they give for a new document.
+
+    Returns:
+        dict: The data of the new document.
+    """
+    resolved = {}
+    for key, value in data.items():
+        if isinstance(value, FieldTransform):
+            if value.kind != "delete":
+                resolved[key] = value.apply(False, None)
+        else:
+            resolved[key] = resolve_transforms(value) if isinstance(value, dict) else value
+    return resolved
+
+
+def unassign(data: dict, field_path: str):
+    """Removes the field at a dotted field path within a nested dict, if it exists."""
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            return
+        data = data[part]
+    data.pop(parts[-1], None)
+
+
+def index_key(value):
+    """Converts a value into something that can be used as a hash index key."""
+    try:
+        hash(value)
+        return (isinstance(value, bool), value)
+    except TypeError:
+        return (False, repr(value))
+
+
+def is_hint(where: FIKLWhere) -> bool:
+    """
+    Determines if a locally evaluated clause can narrow the documents that are read from the
+    local indexes: its values must be strings or numbers, which compare the same way in Python
+    as they do in Firestore.
+    """
+    if where["operator"] not in HINTED_OPERATORS:
+        return False
+    values = where["value"] if where["operator"] == "in" else [where["value"]]
+    return isinstance(values, list) and \
+        all(isinstance(value, (str, int, float)) and not isinstance(value, bool)
+            for value in values)
+
+
+def matches(data: dict, where: FIKLWhere) -> bool:
+    """Evaluates a where clause against a document with Firestore semantics."""
+    found, value = lookup(data, where["property"])
+    return found and compare(value, where["operator"], where["value"])
+
+
+def compare(value, operator: str, expected) -> bool:
+    """
+    Compares the value of a field that exists with the value of a where clause, with
+    Firestore semantics: values of different types never match and != and not_in do not
+    match null.
+    """
+    try:
+        match operator:
+            case "==":
+                return value == expected
+            case "!=":
+                return value is not None and value != expected
+            case "<":
+                return value < expected
+            case "<=":
+                return value <= expected
+            case ">":
+                return value > expected
+            case ">=":
+                return value >= expected
+            case "in":
+                return value in expected
+            case "not_in":
+                return value is not None and value not in expected
+            case "array_contains":
+                return isinstance(value, list) and expected in value
+            case "array_contains_any":
+                return isinstance(value, list) and any(item in value for item in expected)
+            case "like":
+                as_regex = expected.replace("%", ".*?")
+                return re.search(f"^{as_regex}$", value) is not None
+    except TypeError:
+        return False
+
+    return False
+
+
+class Descending:
+    """Inverts the ordering of a wrapped sort value."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+class MemoryReference:
+    """A reference to a document that is held by the memory backend."""
+    __slots__ = ("path", "id")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]  # pylint: disable=invalid-name
+
+
+class FieldIndex:
+    """
+    The local indexes of a field of a collection: a hash index for equality and `in` filters,
+    a sorted index for range filters and an inverted index of the elements of arrays for
+    `array_contains` filters. The indexes are kept up to date as documents are written.
+    """
+    __slots__ = ("field", "hashed", "ordered", "elements")
+
+    def __init__(self, field: str, documents: dict[str, dict]):
+        self.field = field
+        self.hashed: dict[object, dict[str, None]] = defaultdict(dict)
+        self.ordered: list[tuple[tuple, str]] = []
+        self.elements: dict[object, dict[str, None]] = defaultdict(dict)
+        for document_id, data in documents.items():
+            self.add(document_id, data, ordered=False)
+        self.ordered.sort()
+
+    def add(self, document_id: str, data: dict | None, ordered: bool = True):
+        """Indexes a document, the sorted index is only kept sorted when ordered is True."""
+        found, value = (False, None) if data is None else lookup(data, self.field)
+        if not found:
+            return
+
+        self.hashed[index_key(value)][document_id] = None
+        if ordered:
+            insort(self.ordered, (sort_value(value), document_id))
+        else:
+            self.ordered.append((sort_value(value), document_id))
+        if isinstance(value, list):
+            for item in value:
+                self.elements[index_key(item)][document_id] = None
+
+    def remove(self, document_id: str, data: dict | None):
+        """Removes a document, as it was indexed, from the indexes."""
+        found, value = (False, None) if data is None else lookup(data, self.field)
+        if not found:
+            return
+
+        self.hashed.get(index_key(value), {}).pop(document_id, None)
+        entry = (sort_value(value), document_id)
+        if (position := bisect_left(self.ordered, entry)) < len(self.ordered) \
+                and self.ordered[position] == entry:
+            del self.ordered[position]
+        if isinstance(value, list):
+            for item in value:
+                self.elements.get(index_key(item), {}).pop(document_id, None)
+
+    def _range(self, where: FIKLWhere) -> tuple[int, int]:
+        """
+        Finds the positions in the sorted index of the values that match a range filter, which
+        like Firestore only match values of the same type.
+        """
+        value = sort_value(where["value"])
+        start = bisect_left(self.ordered, (value[0],), key=lambda entry: entry[0])
+        end = bisect_left(self.ordered, (value[0] + 1,), key=lambda entry: entry[0])
+        match where["operator"]:
+            case ">":
+                start = bisect_right(self.ordered, value, start, end, key=lambda entry: entry[0])
+            case ">=":
+                start = bisect_left(self.ordered, value, start, end, key=lambda entry: entry[0])
+            case "<":
+                end = bisect_left(self.ordered, value, start, end, key=lambda entry: entry[0])
+            case "<=":
+                end = bisect_right(self.ordered, value, start, end, key=lambda entry: entry[0])
+        return (start, end)
+
+    def size(self, where: FIKLWhere) -> int:
+        """
+        Counts, at most, the documents that may match a filter with one of the
+        INDEXED_OPERATORS.
+
+        Returns:
+            int: The number of candidates.
+        """
+        match where["operator"]:
+            case "==":
+                return len(self.hashed.get(index_key(where["value"]), ()))
+            case "in":
+                return sum(len(self.hashed.get(index_key(value), ())) for value in where["value"])
+            case "array_contains":
+                return len(self.elements.get(index_key(where["value"]), ()))
+            case "array_contains_any":
+                return sum(len(self.elements.get(index_key(value), ()))
+                           for value in where["value"])
+        start, end = self._range(where)
+        return end - start
+
+    def candidates(self, where: FIKLWhere) -> list[str]:
+        """
+        Lists the ids of the documents that may match a filter with one of the
+        INDEXED_OPERATORS.
+
+        Returns:
+            list: The ids of the candidates.
+        """
+        match where["operator"]:
+            case "==":
+                return list(self.hashed.get(index_key(where["value"]), ()))
+            case "in":
+                return list(dict.fromkeys(
+                    document_id for value in where["value"]
+                    for document_id in self.hashed.get(index_key(value), ())))
+            case "array_contains":
+                return list(self.elements.get(index_key(where["value"]), ()))
+            case "array_contains_any":
+                return list(dict.fromkeys(
+                    document_id for value in where["value"]
+                    for document_id in self.elements.get(index_key(value), ())))
+        start, end = self._range(where)
+        return [document_id for _, document_id in self.ordered[start:end]]
+
+
+class MemorySnapshot:
+    """A snapshot of a document that is held by the memory backend."""
+    __slots__ = ("reference", "id", "exists", "_data", "_fields")
+
+    def __init__(self, path: str, data: dict | None, fields: list[str] | None = None):
+        self.reference = MemoryReference(path)
+        self.id = self.reference.id  # pylint: disable=invalid-name
+        self.exists = data is not None
+        self._data = data
+        self._fields = fields
+
+    def to_dict(self) -> dict | None:
+        """Returns the document data, reduced to the projected fields."""
+        if self._data is None:
+            return None
+
+        if self._fields is None:
+            return dict(self._data)
+
+        projected = {}
+        for field in self._fields:
+            found, value = lookup(self._data, field)
+            if found:
+                assign(projected, field, value)
+        return projected
+
+
+class MemoryBackend(Backend):
+    """
+    Executes queries against documents that are held in memory, such as an offline dump.
+    Equality, `in`, range and `array_contains` filters are served from the local indexes of
+    their fields, which are built on first use (or with `create local index`) and updated as
+    documents are written. The sorted results of the last SORTED_CACHE_SIZE scan shapes are cached
+    so that paged scans only sort once.
+    """
+    name = "memory"
+    capabilities = (Capability.PROJECTION | Capability.AGGREGATION | Capability.OR_FILTERS
+                    | Capability.PARTITIONING | Capability.BULK_WRITES
+                    | Capability.LOCAL_INDEXES)
+    operators = ALL_OPERATORS
+
+    def __init__(self, collections: dict[str, dict[str, dict]] | None = None):
+        self._collections: dict[str, dict[str, dict]] = defaultdict(dict)
+        self._indexes: dict[tuple, FieldIndex] = {}
+        self._sorted: OrderedDict[tuple, list] = OrderedDict()
+        self._lock = threading.RLock()
+        for collection, documents in (collections or {}).items():
+            self._collections[collection].update(documents)
+
+    @classmethod
+    def from_file(cls, path: str) -> "MemoryBackend":
+        """
+        Loads a JSON dump in the form {"collection/path": {"document_id": {...}}}.
+
+        Returns:
+            MemoryBackend: The backend holding the dumped documents.
+        """
+        with open(path, encoding="utf-8") as file:
+            return cls(json.load(file))
+
+    def _scope(self, scan: FIKLScan) -> list[str]:
+        """The collection paths that a scan reads from."""
+        if scan["subject_type"] == FIKLSubjectType.COLLECTION_GROUP:
+            return sorted(path for path in self._collections
+                          if path.rsplit("/", 1)[-1] == scan["subject"])
+        return [scan["subject"]]
+
+    def _index(self, collection: str, field: str) -> FieldIndex:
+        """Gets (building if required) the local indexes of a field in a collection."""
+        if (key := (collection, field)) not in self._indexes:
+            self._indexes[key] = FieldIndex(field, self._collections[collection])
+        return self._indexes[key]
+
+    def create_index(self, collection: str, field: str) -> int:
+        with self._lock:
+            self._index(collection, field)
+            return len(self._collections[collection])
+
+    def _candidates(self, collection: str, wheres: list[FIKLWhere],
+                    hints: list[FIKLWhere]) -> Iterator[str]:
+        """
+        Yields the ids of the documents that might match, using the narrowest index. The hints
+        are clauses that are evaluated locally, which may narrow the candidates when their
+        values compare the same way in Python as they do in Firestore.
+        """
+        sizes: list[tuple[int, FieldIndex, FIKLWhere]] = []
+        for where in wheres + [where for where in hints if is_hint(where)]:
+            if where["operator"] in INDEXED_OPERATORS:
+                index = self._index(collection, where["property"])
+                sizes.append((index.size(where), index, where))
+
+        if len(sizes) == 0:
+            return iter(self._collections[collection])
+        _, index, where = min(sizes, key=lambda size: size[0])
+        return iter(index.candidates(where))
+
+    def _matching(self, scan: FIKLScan) -> list[tuple[str, dict]]:
+        """Finds the (path, data) pairs that match the where clauses of the scan."""
+        wheres = scan.get("where") or []
+        orders = scan.get("order") or []
+        results = []
+        for collection in self._scope(scan):
+            documents = self._collections[collection]
+            for document_id in self._candidates(collection, wheres, scan.get("local_where") or []):
+                data = documents[document_id]
+                if all(matches(data, where) for where in wheres) and \
+                        all(order["property"] == NAME_FIELD or lookup(data, order["property"])[0]
+                            for order in orders):
+                    results.append((f"{collection}/{document_id}", data))
+        return results
+
+    def _sort_key(self, orders: list[FIKLOrderBy]):
+        """Creates the function that orders (path, data) pairs for the provided orders."""
+        def key(item: tuple[str, dict]):
+            path, data = item
+            values = []
+            for order in orders:
+                value = path if order["property"] == NAME_FIELD else \
+                    sort_value(lookup(data, order["property"])[1])
+                values.append(Descending(value) if order["direction"] == "desc" else value)
+            values.append(path)
+            return tuple(values)
+        return key
+
+    def _ordered(self, scan: FIKLScan) -> list[tuple[tuple, str, dict]]:
+        """
+        Returns the matching documents in scan order, caching the sorted result. Without a
+        remote order, the documents are presorted by the local order of the scan, which the
+        local sort then only has to confirm.
+        """
+        shape = (scan["subject"], scan["subject_type"],
+                 repr(scan.get("where")), repr(scan.get("order")), repr(scan.get("partition")),
+                 repr(scan.get("local_where")), repr(scan.get("local_order")))
+        if shape in self._sorted:
+            self._sorted.move_to_end(shape)
+        else:
+            key = self._sort_key(scan.get("order") or scan.get("local_order") or [])
+            rows = [(key(item), *item) for item in self._matching(scan)]
+            rows.sort(key=lambda row: row[0])
+            if scan.get("partition") is not None:
+                start, end = scan["partition"]
+                rows = [row for row in rows if start <= row[1] and (end is None or row[1] < end)]
+            self._sorted[shape] = rows
+            if len(self._sorted) > SORTED_CACHE_SIZE:
+                self._sorted.popitem(last=False)
+        return self._sorted[shape]
+
+    def stream(self, scan: FIKLScan) -> Iterator[MemorySnapshot]:
+        rows = self._ordered(scan)
+
+        start = 0
+        if (cursor := scan.get("start_after")) is not None:
+            orders = scan.get("order") or scan.get("local_order") or []
+            item = (cursor[NAME_FIELD], cursor) if isinstance(cursor, dict) else \
+                (cursor.reference.path, self._read(cursor.reference.path) or {})
+            cursor_key = self._sort_key(orders)(item)
+            start = bisect_right(rows, cursor_key, key=lambda row: row[0])
+        elif (path := scan.get("start_at")) is not None:
+            orders = scan.get("order") or []
+            start = bisect_left(rows, self._sort_key(orders)((path, self._read(path) or {})),
+                                key=lambda row: row[0])
+
+        end = len(rows) if scan.get("limit") is None else start + scan["limit"]
+        for _, path, data in rows[start:end]:
+            yield MemorySnapshot(path, data, scan.get("fields"))
+
+    def count(self, scan: FIKLScan) -> int:
+        if scan.get("limit") is None and scan.get("start_after") is None:
+            return len(self._matching(scan))
+        return sum(1 for _ in self.stream(scan))
+
+    def partitions(self, scan: FIKLScan, count: int) -> list[FIKLScan]:
+        paths = sorted(f"{collection}/{document_id}" for collection in self._scope(scan)
+                       for document_id in self._collections[collection])
+        size = max(1, -(-len(paths) // max(1, count)))
+        bounds = paths[::size] or [""]
+        return [{**scan, "partition": (start, bounds[index + 1] if index + 1 < len(bounds)
+                                       else None)}
+                for index, start in enumerate(bounds)]
+
+    def _read(self, path: str) -> dict | None:
+        """Reads the raw data of a document."""
+        collection, document_id = path.rsplit("/", 1)
+        return self._collections.get(collection, {}).get(document_id)
+
+    def _invalidate(self, collection: str):
+        """Drops the cached sorts that include the provided collection."""
+        collection_id = collection.rsplit("/", 1)[-1]
+        self._sorted = OrderedDict((shape, rows) for shape, rows in self._sorted.items()
+                                   if shape[0] not in (collection, collection_id))
+
+    def _write(self, write: FIKLWrite):
+        """Applies a single write and drops anything cached for the collection."""
+        with self._lock:
+            self._apply(write)
+
+    def _apply(self, write: FIKLWrite):
+        """Applies a single write, the caller holds the lock."""
+        collection, document_id = write["path"].rsplit("/", 1)
+        documents = self._collections[collection]
+        previous = documents.get(document_id)
+        match write["operation"]:
+            case "create":
+                if document_id in documents:
+                    raise ValueError(f"Document already exists: {write['path']}")
+                documents[document_id] = resolve_transforms(write["data"])
+            case "set":
+                documents[document_id] = resolve_transforms(write["data"])
+            case "update":
+                if document_id not in documents:
+                    raise ValueError(f"No document to update: {write['path']}")
+                updated = copy.deepcopy(documents[document_id])
+                for field, value in write["data"].items():
+                    if isinstance(value, FieldTransform) and value.kind == "delete":
+                        unassign(updated, field)
+                    elif isinstance(value, FieldTransform):
+                        assign(updated, field, value.apply(*lookup(updated, field)))
+                    else:
+                        assign(updated, field, value)
+                documents[document_id] = updated
+            case "delete":
+                documents.pop(document_id, None)
+
+        for (indexed, _), index in self._indexes.items():
+            if indexed == collection:
+                index.remove(document_id, previous)
+                index.add(document_id, documents.get(document_id))
+        self._invalidate(collection)
+
+    def get(self, path: str, fields: list[str] | None = None) -> MemorySnapshot:
+        return MemorySnapshot(path, self._read(path), fields)
+
+    def collections(self, path: str | None = None) -> list[str]:
+        depth = 0 if path is None else path.count("/") + 1
+        prefix = "" if path is None else f"{path}/"
+        return sorted({collection.rsplit("/", 1)[-1] for collection, documents
+                       in self._collections.items()
+                       if collection.startswith(prefix) and collection.count("/") == depth
+                       and documents})
+
+    def add(self, collection: str, data: dict, document_id: str | None = None) -> str:
+        path = self.document_path(collection, document_id)
+        self._write({"operation": "create", "path": path, "data": data})
+        return path
+
+    def document_path(self, collection: str, document_id: str | None = None) -> str:
+        return f"{collection}/{document_id or uuid.uuid4().hex[:20]}"
+
+    def update(self, path: str, data: dict):
+        self._write({"operation": "update", "path": path, "data": data})
+
+    def delete(self, path: str):
+        self._write({"operation": "delete", "path": path, "data": None})
+
+    def commit(self, writes: list[FIKLWrite]):
+        with self._lock:
+            for write in writes:
+                if write["operation"] == "create" and self._read(write["path"]) is not None:
+                    raise ValueError(f"Document already exists: {write['path']}")
+                if write["operation"] == "update" and self._read(write["path"]) is None:
+                    raise ValueError(f"No document to update: {write['path']}")
+            for write in writes:
+                self._apply(write)
+
+
+BACKEND_HOLDER: dict[str, Backend | None] = {"backend": None}
+# the backend of a thread that executes a query against another database than the session
+THREAD_BACKEND = threading.local()
+
+
+def current_backend() -> Backend:
+    """
+    Fetches the backend that queries are executed against, defaulting to Firestore.
+
+    Returns:
+        Backend: The backend in use.
+    """
+    if (backend := getattr(THREAD_BACKEND, "backend", None)) is not None:
+        return backend
+    if BACKEND_HOLDER["backend"] is None:
+        BACKEND_HOLDER["backend"] = FirestoreBackend()
+    return BACKEND_HOLDER["backend"]
+
+
+def use_backend(backend: Backend | None) -> Backend | None:
+    """
+    Sets the backend that queries are executed against.
+
+    Returns:
+        Backend: The backend that was previously in use.
+    """
+    previous = BACKEND_HOLDER["backend"]
+    BACKEND_HOLDER["backend"] = backend
+    return previous
+
+
+@contextlib.contextmanager
+def thread_backend(backend: Backend) -> Iterator[Backend]:
+    """
+    Executes the queries of the current thread against a backend, rather than the backend of
+    the session, while in the context.
+    """
+    previous = getattr(THREAD_BACKEND, "backend", None)
+    THREAD_BACKEND.backend = backend
+    try:
+        yield backend
+    finally:
+        THREAD_BACKEND.backend = previous
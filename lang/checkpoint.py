@@ -0,0 +1,125 @@
+"""
+This module provides the checkpoints of long running exports.
+
+A checkpoint records the query, the path and the order by values of the last document that was
+read and how much of the output file has been written, so that an interrupted export can be
+resumed from where it stopped rather than from the start. The export resumes after the saved
+values, so it does not depend on the last document still being there unchanged.
+"""
+# lang/checkpoint.py
+import datetime
+import json
+import os
+import uuid
+from typing import TypedDict
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from lang import encoding
+
+CHECKPOINT_DIR = "~/.fikl/checkpoints"
+
+
+class CheckpointError(ValueError):
+    """
+    Exception raised when a checkpoint can not be found or read.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+
+class FIKLCursorValue(TypedDict):
+    """An order by value of the last document that was read, along with its type."""
+    type: str
+    value: object
+
+
+class FIKLCheckpoint(TypedDict):
+    """The progress of an export."""
+    id: str  # pylint: disable=invalid-name
+    query: str
+    dest: str | None
+    cursor: str | None
+    after: dict[str, FIKLCursorValue] | None
+    offset: int
+    count: int
+    columns: list[str]
+
+
+def checkpoint_path(checkpoint_id: str) -> str:
+    """Determines where the checkpoint with the provided id is saved."""
+    return os.path.join(os.path.expanduser(CHECKPOINT_DIR), f"{checkpoint_id}.json")
+
+
+def create_checkpoint(query: str) -> FIKLCheckpoint:
+    """
+    Creates a new checkpoint for the query. The checkpoint is only saved once the export has
+    made progress.
+
+    Returns:
+        FIKLCheckpoint: The new checkpoint.
+    """
+    return {"id": uuid.uuid4().hex[:8], "query": query, "dest": None, "cursor": None,
+            "after": None, "offset": 0, "count": 0, "columns": []}
+
+
+def checkpoint_exists(checkpoint_id: str) -> bool:
+    """Indicates if the checkpoint with the provided id has been saved."""
+    return os.path.exists(checkpoint_path(checkpoint_id))
+
+
+def load_checkpoint(checkpoint_id: str) -> FIKLCheckpoint:
+    """
+    Loads a saved checkpoint.
+
+    Returns:
+        FIKLCheckpoint: The saved checkpoint.
+    """
+    try:
+        with open(checkpoint_path(checkpoint_id), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as exception:
+        raise CheckpointError(f"Unable to resume checkpoint {checkpoint_id}: {exception}") \
+            from exception
+
+
+def save_checkpoint(checkpoint: FIKLCheckpoint):
+    """Saves the checkpoint, replacing the previously saved progress in a single step."""
+    path = checkpoint_path(checkpoint["id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def remove_checkpoint(checkpoint_id: str):
+    """Removes a checkpoint once the export has completed."""
+    if checkpoint_exists(checkpoint_id):
+        os.remove(checkpoint_path(checkpoint_id))
+
+
+def encode_cursor_value(value) -> FIKLCursorValue:
+    """
+    Converts an order by value to a JSON value along with its type, so that it can be
+    converted back to the same value. Only nulls, booleans, numbers, strings and timestamps
+    are converted.
+
+    Returns:
+        FIKLCursorValue: The type of the value and the value.
+    """
+    if isinstance(value, datetime.datetime):
+        return {"type": "timestamp", "value": encoding.encode_datetime(value)}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {"type": "value", "value": value}
+    raise ValueError(f"Unable to save the order by value {value!r}")
+
+
+def decode_cursor_value(value: FIKLCursorValue):
+    """Converts a saved order by value back to the value."""
+    if value["type"] != "timestamp":
+        return value["value"]
+    if value["value"].endswith("Z"):
+        return DatetimeWithNanoseconds.from_rfc3339(value["value"])
+    return datetime.datetime.fromisoformat(value["value"])
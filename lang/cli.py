@@ -3,57 +3,227 @@
 
 import os.path
 import os
+from enum import Enum
 import atexit
+import itertools
 import readline
-import firebase_admin
-
 import typer
 from typing_extensions import Annotated
 from rich import print as rprint, print_json
+from rich.table import Table
 
-from lang import ql
+from lang import encoding, ql, record, writes
+from lang.backend import Backend, MemoryBackend, current_backend, use_backend
+from lang.checkpoint import (CheckpointError, checkpoint_exists, create_checkpoint,
+                             load_checkpoint)
+from lang.planner import PLANNER_SETTINGS
+from lang.pool import project_app
+from lang.schema import SchemaCache, use_schema_cache
 
 from lang.transformer import (FIKLFormatType)
 
 app = typer.Typer(rich_markup_mode="rich")
 
+
+class Placement(str, Enum):
+    """The ways that the clauses of queries are placed."""
+    AUTO = "auto"
+    MANUAL = "manual"
+
+
 QUERY_COMMAND_HELP = "The query to execute against the Firestore database."
+OFFLINE_OPTION_HELP = "Query a JSON dump of collections held in memory instead of Firestore."
+PAGE_SIZE_OPTION_HELP = "The number of documents that the REPL shows at a time."
+CHECKPOINT_OPTION_HELP = ("Save the progress of a paged query that is output to a file, "
+                          "so that it can be resumed.")
+RESUME_OPTION_HELP = "Resume the checkpointed query with the given id."
+WRITE_WORKERS_OPTION_HELP = "The number of writes, or batches of writes, that are sent in parallel."
+REPLAY_FAILURES_OPTION_HELP = "Apply the writes of a failure journal again."
+SORT_MEMORY_OPTION_HELP = ("The megabytes of records that are sorted locally in memory, "
+                           "beyond which sorted runs are spilled to temporary files.")
+DATABASE_OPTION_HELP = ("The database to query, as project or project/database. Repeat the "
+                        "option to run each query against several databases in parallel.")
+PLACEMENT_OPTION_HELP = ("How clauses are placed: [bold]auto[/bold] evaluates clauses locally "
+                         "when Firestore is missing an index, [bold]manual[/bold] only when "
+                         "they are marked with ^.")
 PROGRESS_HOLDER = {"progress": None}
+RESULTS_HOLDER = {"documents": None, "format": None, "view": "json", "shown": 0, "page_size": 50,
+                  "columns": []}
+HIGHLIGHT_LIMIT = 100_000
+COMPLETER_DELIMS = " \t\n,()[]=<>!"
 
 
 @app.command(epilog="See https://github.com/crbaker/fikl for more details.")
-def query(query_text: Annotated[(str), typer.Argument(help=QUERY_COMMAND_HELP)] = None):
+def query(query_text: Annotated[(str), typer.Argument(help=QUERY_COMMAND_HELP)] = None,  # pylint: disable=too-many-arguments
+          offline: Annotated[(str), typer.Option(help=OFFLINE_OPTION_HELP)] = None,
+          page_size: Annotated[(int), typer.Option(help=PAGE_SIZE_OPTION_HELP)] = 50,
+          checkpoint: Annotated[(bool), typer.Option(help=CHECKPOINT_OPTION_HELP)] = False,
+          resume: Annotated[(str), typer.Option(help=RESUME_OPTION_HELP)] = None,
+          write_workers: Annotated[(int), typer.Option(help=WRITE_WORKERS_OPTION_HELP)] = 8,
+          replay_failures: Annotated[(str), typer.Option(help=REPLAY_FAILURES_OPTION_HELP)] = None,
+          placement: Annotated[(Placement), typer.Option(help=PLACEMENT_OPTION_HELP)] = "auto",
+          sort_memory: Annotated[(int), typer.Option(help=SORT_MEMORY_OPTION_HELP)] = 512,
+          database: Annotated[(list[str]), typer.Option(help=DATABASE_OPTION_HELP)] = None):
     """
     Typer command handler to handle the query command.
     """
+    RESULTS_HOLDER["page_size"] = page_size
+    writes.WRITE_SETTINGS["workers"] = write_workers
+    PLANNER_SETTINGS["placement"] = Placement(placement).value
+    record.SORT_SETTINGS["memory"] = sort_memory * 2**20
     try:
-        if (env_var := 'GOOGLE_APPLICATION_CREDENTIALS') not in os.environ:
-            rprint(
-                f"""[italic yellow]Warning: {env_var} is not set[/italic yellow]""")
+        if offline is not None:
+            use_backend(MemoryBackend.from_file(os.path.expanduser(offline)))
+        else:
+            if (env_var := 'GOOGLE_APPLICATION_CREDENTIALS') not in os.environ:
+                rprint(
+                    f"""[italic yellow]Warning: {env_var} is not set[/italic yellow]""")
 
-        configure_firebase()
+            configure_firebase()
+            if database:
+                ql.use_databases(database)
 
-        if query_text is None:
+        if replay_failures is not None:
+            output_content(*ql.replay_failures(replay_failures))
+        elif resume is not None or checkpoint:
+            run_checkpointed_and_output(query_text, resume)
+        elif query_text is None:
             start_repl()
         else:
             run_query_and_output(query_text)
-    except ql.QueryError as exception:
+    except (ql.QueryError, CheckpointError) as exception:
         typer.echo(exception)
 
 
 def configure_firebase():
     """ Configures the Firebase SDK. """
-    firebase_admin.initialize_app()
+    project_app(None)
+
 
+def run_query_and_output(query_text, lazy: bool = False):
+    """
+    Runs the supplied query and outputs the results. When lazy output is requested the
+    results of select queries are read and shown one page at a time.
+    """
+    results = ql.run_query(query_text, lazy)
+
+    if isinstance(results[0], str):
+        RESULTS_HOLDER["documents"] = None
+        output_content(results[0], results[1])
+    else:
+        RESULTS_HOLDER.update(documents=results[0], format=results[1], shown=0, columns=[])
+        output_next_page()
 
-def run_query_and_output(query_text):
+
+def run_checkpointed_and_output(query_text: str | None, resume: str | None):
     """
-    Runs the supplied query and outputs the results.
+    Runs the supplied query, or resumes a checkpointed query, saving its progress as it goes.
+    When the query is interrupted the command to resume it is shown.
     """
-    results = ql.run_query(query_text)
+    if resume is not None:
+        progress = load_checkpoint(resume)
+    elif query_text is not None:
+        progress = create_checkpoint(query_text)
+    else:
+        raise CheckpointError("A query is required to create a checkpoint")
+
+    try:
+        results = ql.run_checkpointed_query(progress)
+    except (ql.QueryError, KeyboardInterrupt):
+        if checkpoint_exists(progress["id"]):
+            rprint(f"[italic yellow]Stopped after {progress['count']} documents, "
+                   f"resume with `fikl --resume {progress['id']}`[/italic yellow]")
+        raise
+
+    output_content(results[0], results[1])
+
+
+def output_content(content: str, output_format: FIKLFormatType):
+    """
+    Outputs formatted results. Highlighting is skipped for large results because rich
+    would otherwise take longer to pretty print them than the query took to run.
+    """
+    if len(content) > HIGHLIGHT_LIMIT:
+        typer.echo(content)
+    elif output_format == FIKLFormatType.CSV:
+        rprint(content)
+    else:
+        print_json(content)
+
+
+def as_table(documents: list[dict]) -> Table:
+    """Creates a table with a column for every (flattened) field of the documents."""
+    rows = [ql.flatten(document, encode=True) if isinstance(document, dict)
+            else {"value": document} for document in documents]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+
+    table = Table(*columns)
+    for row in rows:
+        table.add_row(*["" if (value := row.get(column)) is None
+                        else value if isinstance(value, str)
+                        else encoding.dumps(value, compact=True) for column in columns])
+    return table
+
+
+def output_next_page():
+    """Reads the next page of documents from the open results and outputs them."""
+    if (documents := RESULTS_HOLDER["documents"]) is None:
+        rprint("[italic blue]There are no more results[/italic blue]")
+        return
+
+    page_size = RESULTS_HOLDER["page_size"]
+    page = list(itertools.islice(documents, page_size + 1))
+    page, peeked = page[:page_size], page[page_size:]
+
+    if RESULTS_HOLDER["view"] == "table":
+        rprint(as_table(page))
+    elif RESULTS_HOLDER["format"] == FIKLFormatType.CSV:
+        output_content(ql.csv_dumps(page, header=RESULTS_HOLDER["shown"] == 0,
+                                    columns=RESULTS_HOLDER["columns"]), FIKLFormatType.CSV)
+    else:
+        output_content(ql.output_as(page, RESULTS_HOLDER["format"]), FIKLFormatType.JSON)
+
+    first = RESULTS_HOLDER["shown"] + 1
+    RESULTS_HOLDER["shown"] += len(page)
+
+    if peeked:
+        RESULTS_HOLDER["documents"] = itertools.chain(peeked, documents)
+        rprint(f"[italic blue]Showing {first}-{RESULTS_HOLDER['shown']}. "
+               f"Type `more` for the next {page_size}[/italic blue]")
+    else:
+        RESULTS_HOLDER["documents"] = None
+
+
+def completer(schema: SchemaCache):
+    """
+    Creates the readline completer of keywords, collections and field paths. The candidates
+    are only worked out when the first completion is requested.
+    """
+    matches: list[str] = []
+
+    def complete(text: str, state: int) -> str | None:
+        if state == 0:
+            line = readline.get_line_buffer()[:readline.get_begidx()]
+            matches[:] = schema.completions(line, text)
+        return matches[state] if state < len(matches) else None
+
+    return complete
+
+
+def complete_schema(backend: Backend) -> SchemaCache:
+    """
+    Completes the names of the collections and fields of a backend in the REPL, which are
+    read in the background.
+
+    Returns:
+        SchemaCache: The schema cache of the backend.
+    """
+    schema = SchemaCache(backend)
+    use_schema_cache(schema)
+    schema.collections()
+    readline.set_completer(completer(schema))
+    return schema
 
-    output_fn = rprint if results[1] == FIKLFormatType.CSV else print_json
-    output_fn(results[0])
 
 def start_repl():
     """
@@ -72,11 +242,15 @@ def start_repl():
 
     atexit.register(save_history)
 
+    schema = complete_schema(current_backend())
+
+    readline.set_completer_delims(COMPLETER_DELIMS)
     readline.parse_and_bind("tab: complete")
     readline.parse_and_bind("set editing-mode vi")
 
     rprint("[italic pink]FIKL Repl[/italic pink] :fire:")
-    rprint("[italic blue]type `exit` to quit[/italic blue]")
+    rprint("[italic blue]type `exit` to quit, `more` for the next page of results "
+           "and `view table` or `view json` to change how results are shown[/italic blue]")
 
     current_query: str = None
 
@@ -93,11 +267,25 @@ def start_repl():
         elif current_query == "cls":
             typer.clear()
             current_query = None
+        elif current_query in {"view table", "view json"}:
+            RESULTS_HOLDER["view"] = current_query.split()[1]
+            current_query = None
+        elif current_query == "more":
+            try:
+                output_next_page()
+            except ql.QueryError as exception:
+                RESULTS_HOLDER["documents"] = None
+                rprint("[italic red]Query Error[/italic red] :exploding_head:")
+                rprint(exception)
+            finally:
+                current_query = None
         elif current_query.endswith(';'):
             try:
-                run_query_and_output(current_query[:-1])
+                run_query_and_output(current_query[:-1], lazy=True)
             except ql.QueryError as exception:
                 rprint("[italic red]Query Error[/italic red] :exploding_head:")
                 rprint(exception)
             finally:
                 current_query = None
+                if schema.backend is not current_backend():
+                    schema = complete_schema(current_backend())
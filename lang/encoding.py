@@ -0,0 +1,145 @@
+"""
+This module provides the JSON encoding of Firestore values.
+
+orjson is used when it is installed, otherwise the stdlib json module is used. Both produce
+the same output: values that JSON does not support are encoded by encode_value, mapping keys
+by primitive_key and floats that are not finite as null. orjson writes large and small floats
+in another notation than the stdlib, so documents that may hold such floats are encoded by
+the stdlib.
+"""
+# lang/encoding.py
+import base64
+import datetime
+import json
+import math
+import re
+from collections.abc import Mapping
+from enum import Enum
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+
+try:
+    from google.cloud.firestore_v1.vector import Vector
+except ImportError:  # pragma: no cover - vectors need google-cloud-firestore 2.16
+    Vector = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# orjson output that may hold a float in exponent notation, such as 1e16 or 0.00001, which the
+# stdlib writes as 1e+16 and 1e-05
+ORJSON_EXPONENT = re.compile(rb"[0-9][eE]|0\.0000")
+
+
+def encode_datetime(value: datetime.datetime | datetime.date) -> str:
+    """
+    Converts a timestamp to RFC 3339. Timezone aware timestamps are converted to UTC and
+    nanosecond precision is kept for Firestore timestamps.
+
+    Returns:
+        str: The formatted timestamp.
+    """
+    if isinstance(value, DatetimeWithNanoseconds):
+        return value.rfc3339()
+
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        utc = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return f"{utc.isoformat()}Z"
+
+    return value.isoformat()
+
+
+def encode_value(value):
+    """
+    Converts a single value that JSON does not support into a stable JSON representation.
+
+    Returns:
+        The JSON compatible representation of the value.
+    """
+    if Vector is not None and isinstance(value, Vector):
+        return list(value)
+
+    match value:
+        case datetime.datetime() | datetime.date():
+            return encode_datetime(value)
+        case GeoPoint():
+            return {"latitude": value.latitude, "longitude": value.longitude}
+        case bytes() | bytearray() | memoryview():
+            return base64.b64encode(bytes(value)).decode("ascii")
+        case Enum():
+            return value.value
+        case set() | frozenset():
+            return sorted(value, key=repr)
+
+    if isinstance(getattr(value, "path", None), str):
+        # DocumentReference (or any other reference) is represented by its path
+        return value.path
+
+    return str(value)
+
+
+def to_primitive(value):
+    """
+    Recursively converts a document into plain JSON compatible values.
+
+    Returns:
+        The converted value.
+    """
+    match value:
+        case float() if not math.isfinite(value):
+            return None
+        case None | bool() | int() | float() | str():
+            return value
+        case Mapping():
+            return {primitive_key(key): to_primitive(item) for key, item in value.items()}
+        case list() | tuple():
+            return [to_primitive(item) for item in value]
+
+    return to_primitive(encode_value(value))
+
+
+def primitive_key(key):
+    """
+    Converts a mapping key into a string key, such as a group by value. Keys that JSON
+    supports are converted as the stdlib does.
+
+    Returns:
+        str: The converted key.
+    """
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    value = encode_value(key)
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+
+def dumps(value, compact: bool = False) -> str:
+    """
+    Serializes the value as JSON, indented by two spaces unless compact output is requested.
+
+    Returns:
+        str: The JSON document.
+    """
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        try:
+            content = orjson.dumps(value, default=encode_value, option=option)
+            if not ORJSON_EXPONENT.search(content):
+                return content.decode("utf-8")
+        except TypeError:
+            # e.g. keys that are not strings or integers wider than 64 bits
+            pass
+
+    options = {"separators": (",", ":")} if compact else {"indent": 2}
+    try:
+        return json.dumps(value, default=encode_value, ensure_ascii=False, allow_nan=False,
+                          **options)
+    except (TypeError, ValueError):
+        # keys that are not strings, or floats that are not finite
+        return json.dumps(to_primitive(value), ensure_ascii=False, **options)
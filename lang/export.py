@@ -0,0 +1,427 @@
+"""
+This module provides the bulk export of collections to sharded NDJSON files.
+
+Every collection (and every partition of the exported collection, when the backend can
+partition it) is read by a worker of a thread pool, so that many collections and shards are
+in flight at once. Each document is written as one line of compact JSON, with its path in
+`_path`, and a manifest records the shards that were written.
+
+An incremental export only reads the documents that changed since its last run: those whose
+watermark field is at least the largest value that was exported, in the order of the field.
+The high-water mark of every incremental export is kept in WATERMARK_FILE for Firestore
+databases, and for other backends only for as long as the backend is in use.
+"""
+# lang/export.py
+import datetime
+import gzip
+import json
+import os
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from collections.abc import Iterator
+from typing import TextIO, TypedDict
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from lang import encoding
+from lang.backend import Backend, Capability, FIKLScan, lookup
+from lang.transformer import FIKLExportQuery, FIKLSubjectType
+
+EXPORT_WORKERS = 8
+EXPORT_PAGE_SIZE = 1000
+EXPORT_SHARD_SIZE = 10_000
+EXPORT_LIST_BATCH = 50
+MANIFEST_FILE = "manifest.json"
+WATERMARK_FILE = "~/.fikl/watermarks.json"
+
+
+class FIKLShard(TypedDict):
+    """A file of exported documents."""
+    file: str
+    collection: str
+    documents: int
+    read_time: str
+
+
+class FIKLExportTask(TypedDict):
+    """A collection, or partition of a collection, that is exported by a single worker."""
+    scan: FIKLScan
+    collection: str
+    partition: int
+
+
+class FIKLManifest(TypedDict):
+    """The description of a completed export."""
+    subject: str
+    recursive: bool
+    compressed: bool
+    started: str
+    finished: str
+    documents: int
+    collections: dict[str, int]
+    shards: list[FIKLShard]
+
+
+class FIKLWatermark(TypedDict):
+    """
+    The high-water mark of an incremental export: the largest value of its field that was
+    exported, as its type and JSON value, and the paths of the documents that hold it.
+    """
+    type: str
+    value: object
+    paths: list[str]
+    runs: int
+
+
+class FIKLIncrementalManifest(FIKLManifest):
+    """The description of the runs of an incremental export."""
+    field: str
+    exported: int
+    watermark: object
+
+
+def utc_now() -> str:
+    """The current time as an RFC 3339 timestamp."""
+    return encoding.encode_datetime(datetime.datetime.now(datetime.timezone.utc))
+
+
+def shard_file(task: FIKLExportTask, index: int, compress: bool) -> str:
+    """Names a shard file, relative to the export directory, after its collection."""
+    extension = "ndjson.gz" if compress else "ndjson"
+    return os.path.join(*task["collection"].split("/"),
+                        f"{task['partition']:03d}-{index:05d}.{extension}")
+
+
+def open_shard(path: str, compress: bool) -> TextIO:
+    """Opens a shard file for writing, creating the directories of its collection."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+    return open(path, "w", encoding="utf-8")
+
+
+class ShardWriter:
+    """Writes the documents of a task to shards of at most EXPORT_SHARD_SIZE documents."""
+
+    def __init__(self, task: FIKLExportTask, directory: str, compress: bool):
+        self.task = task
+        self.directory = directory
+        self.compress = compress
+        self.read_time = utc_now()
+        self.shards: list[FIKLShard] = []
+        self._file: TextIO | None = None
+
+    def write(self, path: str, data: dict):
+        """Writes a document as a line of the current shard, starting a shard when it is full."""
+        if not self.shards or self.shards[-1]["documents"] == EXPORT_SHARD_SIZE:
+            self.close()
+            self.shards.append({"file": shard_file(self.task, len(self.shards), self.compress),
+                                "collection": self.task["collection"], "documents": 0,
+                                "read_time": self.read_time})
+            self._file = open_shard(os.path.join(self.directory, self.shards[-1]["file"]),
+                                    self.compress)
+
+        data["_path"] = path
+        self._file.write(encoding.dumps(data, compact=True))
+        self._file.write("\n")
+        self.shards[-1]["documents"] += 1
+
+    def close(self):
+        """Closes the current shard."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_pages(backend: Backend, scan: FIKLScan) -> Iterator:
+    """
+    Reads every document of the scan one page of EXPORT_PAGE_SIZE at a time.
+
+    Yields:
+        DocumentSnapshot: The documents of the scan.
+    """
+    last = None
+    while True:
+        batch = list(backend.stream({**scan, "limit": EXPORT_PAGE_SIZE, "start_after": last}))
+        yield from batch
+
+        if len(batch) < EXPORT_PAGE_SIZE:
+            return
+        last = batch[-1]
+
+
+def export_task(backend: Backend, task: FIKLExportTask, directory: str, compress: bool,
+                recursive: bool) -> tuple[list[FIKLShard], list[str]]:
+    """
+    Reads every document of the task one page at a time and writes them to shards of at
+    most EXPORT_SHARD_SIZE documents.
+
+    Returns:
+        tuple: The shards that were written and, for recursive exports, the paths of the
+        documents whose subcollections are still to be listed.
+    """
+    writer = ShardWriter(task, directory, compress)
+    parents: list[str] = []
+
+    try:
+        for snapshot in read_pages(backend, task["scan"]):
+            if (data := snapshot.to_dict()) is None:
+                continue
+
+            writer.write(snapshot.reference.path, data)
+            if recursive:
+                parents.append(snapshot.reference.path)
+    finally:
+        writer.close()
+
+    return (writer.shards, parents)
+
+
+def subcollection_tasks(backend: Backend, parents: list[str]) -> list[FIKLExportTask]:
+    """
+    Lists the subcollections of the provided documents.
+
+    Returns:
+        list: The tasks that export the subcollections.
+    """
+    return [{"scan": {"subject": f"{path}/{child}", "subject_type": FIKLSubjectType.COLLECTION},
+             "collection": f"{path}/{child}", "partition": 0}
+            for path in parents for child in backend.collections(path)]
+
+
+def export_collections(backend: Backend, fikl_query: FIKLExportQuery) -> FIKLManifest:
+    """
+    Exports the subject of the query, and optionally every nested subcollection, to the
+    output directory and writes the manifest of the export.
+
+    Returns:
+        FIKLManifest: The manifest of the export.
+    """
+    directory = os.path.abspath(os.path.expanduser(fikl_query["output"]))
+    os.makedirs(directory, exist_ok=True)
+    started = utc_now()
+
+    root: FIKLScan = {"subject": fikl_query["subject"],
+                      "subject_type": fikl_query["subject_type"]}
+    scans = backend.partitions(root, EXPORT_WORKERS) \
+        if backend.supports(Capability.PARTITIONING) else [root]
+
+    shards: list[FIKLShard] = []
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+        def submit(task: FIKLExportTask) -> Future:
+            return executor.submit(export_task, backend, task, directory,
+                                   fikl_query["compress"], fikl_query["recursive"])
+
+        def submit_listing(parents: list[str]) -> set[Future]:
+            # listing subcollections takes a round trip per document, so it is spread
+            # over the workers in batches
+            return {executor.submit(subcollection_tasks, backend,
+                                    parents[start:start + EXPORT_LIST_BATCH])
+                    for start in range(0, len(parents), EXPORT_LIST_BATCH)}
+
+        pending = {submit({"scan": scan, "collection": fikl_query["subject"], "partition": index})
+                   for index, scan in enumerate(scans)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if isinstance(result := future.result(), tuple):
+                        shards.extend(result[0])
+                        pending |= submit_listing(result[1])
+                    else:
+                        pending |= {submit(child) for child in result}
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    shards.sort(key=lambda shard: shard["file"])
+    collections: dict[str, int] = {}
+    for shard in shards:
+        collections[shard["collection"]] = collections.get(shard["collection"], 0) \
+            + shard["documents"]
+
+    manifest: FIKLManifest = {
+        "subject": fikl_query["subject"],
+        "recursive": fikl_query["recursive"],
+        "compressed": fikl_query["compress"],
+        "started": started,
+        "finished": utc_now(),
+        "documents": sum(collections.values()),
+        "collections": collections,
+        "shards": shards
+    }
+
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as file:
+        file.write(encoding.dumps(manifest))
+
+    return manifest
+
+
+WATERMARK_HOLDER: dict[str, object] = {
+    "lock": threading.Lock(),
+    "saved": None,
+    "unsaved": weakref.WeakKeyDictionary()
+}
+
+
+def watermark_key(fikl_query: FIKLExportQuery, directory: str) -> str:
+    """The key of the watermark of an incremental export within the store."""
+    return (f"{fikl_query['subject_type'].name.lower()}:{fikl_query['subject']}:"
+            f"{fikl_query['incremental']}:{directory}")
+
+
+def backend_watermarks(backend: Backend) -> dict[str, FIKLWatermark]:
+    """The watermarks of the exports of the backend's database, the caller holds the lock."""
+    if (scope := backend.scope()) is None:
+        return WATERMARK_HOLDER["unsaved"].setdefault(backend, {})
+
+    if WATERMARK_HOLDER["saved"] is None:
+        try:
+            with open(os.path.expanduser(WATERMARK_FILE), "r", encoding="utf-8") as file:
+                WATERMARK_HOLDER["saved"] = json.load(file)
+        except (OSError, ValueError):
+            WATERMARK_HOLDER["saved"] = {}
+    return WATERMARK_HOLDER["saved"].setdefault(scope, {})
+
+
+def save_watermark(backend: Backend, key: str, watermark: FIKLWatermark):
+    """Stores the watermark of an incremental export, replacing the watermark of its last run."""
+    with WATERMARK_HOLDER["lock"]:
+        backend_watermarks(backend)[key] = watermark
+        if backend.scope() is None:
+            return
+
+        path = os.path.expanduser(WATERMARK_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(WATERMARK_HOLDER["saved"], file)
+        os.replace(f"{path}.tmp", path)
+
+
+def encode_mark(value) -> tuple[str, object]:
+    """
+    Converts the value of a watermark field to its type and a JSON value.
+
+    Returns:
+        tuple: The type of the value and the value.
+    """
+    if isinstance(value, datetime.datetime):
+        return ("timestamp", encoding.encode_datetime(value))
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        return ("number" if not isinstance(value, str) else "string", value)
+    raise ValueError(f"The watermark field of an incremental export must hold timestamps, "
+                     f"numbers or strings, not {value!r}")
+
+
+def decode_mark(watermark: FIKLWatermark):
+    """Converts a stored watermark back to the value of its field."""
+    if watermark["type"] != "timestamp":
+        return watermark["value"]
+    if watermark["value"].endswith("Z"):
+        return DatetimeWithNanoseconds.from_rfc3339(watermark["value"])
+    return datetime.datetime.fromisoformat(watermark["value"])
+
+
+def previous_manifest(directory: str) -> FIKLIncrementalManifest | None:
+    """Reads the manifest of the last run of an incremental export, if it is still there."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return manifest if "watermark" in manifest else None
+
+
+def write_changes(backend: Backend, scan: FIKLScan, field: str, watermark: tuple,
+                  writer: ShardWriter) -> tuple:
+    """
+    Writes the documents of the scan that are not the exported documents of the watermark.
+
+    Returns:
+        tuple: The new mark, the greatest value of the field that was read, and the paths of
+        the documents that hold it.
+    """
+    mark, exported = watermark
+    paths = list(exported)
+    for snapshot in read_pages(backend, scan):
+        if (data := snapshot.to_dict()) is None:
+            continue
+
+        path = snapshot.reference.path
+        value = lookup(data, field)[1]
+        if value == mark and path in exported:
+            continue
+        if value != mark:
+            encode_mark(value)
+            mark, paths = value, []
+        paths.append(path)
+        writer.write(path, data)
+    return (mark, paths)
+
+
+def export_incremental(backend: Backend, fikl_query: FIKLExportQuery) -> FIKLIncrementalManifest:
+    """
+    Exports the documents that changed since the last run of an incremental export: those
+    whose watermark field is at least the stored high-water mark, read one page at a time in
+    the order of the field. The documents that hold the mark and were exported by the last run
+    are skipped, so that documents written with the same value as the mark are not missed.
+    Each run writes shards of its own, which are added to the manifest of the earlier runs
+    while it is in the directory, and the mark is only stored once every shard was written.
+    Documents without the field are not exported.
+
+    Returns:
+        FIKLIncrementalManifest: The manifest of the runs of the export.
+    """
+    directory = os.path.abspath(os.path.expanduser(fikl_query["output"]))
+    os.makedirs(directory, exist_ok=True)
+    started = utc_now()
+    field = fikl_query["incremental"]
+    key = watermark_key(fikl_query, directory)
+
+    with WATERMARK_HOLDER["lock"]:
+        previous = backend_watermarks(backend).get(key)
+    mark = None if previous is None else decode_mark(previous)
+    exported = set() if previous is None else set(previous["paths"])
+    runs = 0 if previous is None else previous["runs"]
+
+    scan: FIKLScan = {
+        "subject": fikl_query["subject"],
+        "subject_type": fikl_query["subject_type"],
+        "where": [] if mark is None else [
+            {"property": field, "operator": ">=", "value": mark, "local": False}],
+        "order": [{"property": field, "direction": "asc", "local": False}]
+    }
+    writer = ShardWriter({"scan": scan, "collection": fikl_query["subject"], "partition": runs},
+                         directory, fikl_query["compress"])
+    try:
+        mark, paths = write_changes(backend, scan, field, (mark, exported), writer)
+    finally:
+        writer.close()
+
+    shards = writer.shards
+    if previous is not None:
+        shards = (previous_manifest(directory) or {"shards": []})["shards"] + shards
+    documents = sum(shard["documents"] for shard in shards)
+    kind, value = encode_mark(mark) if mark is not None else (None, None)
+    manifest: FIKLIncrementalManifest = {
+        "subject": fikl_query["subject"],
+        "recursive": False,
+        "compressed": fikl_query["compress"],
+        "started": started,
+        "finished": utc_now(),
+        "documents": documents,
+        "collections": {fikl_query["subject"]: documents},
+        "shards": shards,
+        "field": field,
+        "exported": sum(shard["documents"] for shard in writer.shards),
+        "watermark": value
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as file:
+        file.write(encoding.dumps(manifest))
+
+    if mark is not None:
+        save_watermark(backend, key, {"type": kind, "value": value, "paths": paths,
+                                      "runs": runs + 1})
+    return manifest
@@ -0,0 +1,254 @@
+"""
+This module provides the index advisor, which suggests the composite indexes of a database.
+
+The shape of every query that the backend runs is logged, along with whether Firestore
+rejected it for a missing index. The suggested indexes are those that would let Firestore
+evaluate every clause of the logged queries that were rejected or that evaluated clauses
+locally, leaving out the indexes that already exist and those that another index serves.
+"""
+# lang/indexes.py
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import TypedDict
+
+from lang.backend import Backend
+from lang.planner import EQUALITY_OPERATORS, FIKLPlan, is_missing_index
+from lang.transformer import FIKLQuery, FIKLSubjectType
+
+QUERY_LOG_FILE = "~/.fikl/queries.ndjson"
+QUERY_LOG_LIMIT = 10 * 1024 * 1024
+
+ARRAY_OPERATORS = frozenset({"array_contains", "array_contains_any"})
+
+QUERY_LOG_LOCK = threading.Lock()
+
+
+class FIKLLoggedClause(TypedDict):
+    """
+    A where or order by clause of a logged query, without its value. The operator of an order
+    by is its direction.
+    """
+    field: str
+    operator: str
+    remote: bool
+
+
+class FIKLLoggedQuery(TypedDict):
+    """The shape of a query that the backend ran."""
+    scope: str
+    time: str
+    collection: str
+    query_scope: str
+    where: list[FIKLLoggedClause]
+    order: list[FIKLLoggedClause]
+    missing_index: bool
+
+
+class FIKLIndexField(TypedDict, total=False):
+    """A field of a composite index, as found in firestore.indexes.json."""
+    fieldPath: str
+    order: str
+    arrayConfig: str
+
+
+class FIKLIndex(TypedDict):
+    """A composite index, as found in firestore.indexes.json."""
+    collectionGroup: str
+    queryScope: str
+    fields: list[FIKLIndexField]
+
+
+class FIKLIndexes(TypedDict):
+    """The contents of a firestore.indexes.json file."""
+    indexes: list[FIKLIndex]
+    fieldOverrides: list[dict]
+
+
+def log_query(backend: Backend, fikl_query: FIKLQuery, plan: FIKLPlan,
+              error: BaseException | None = None):
+    """
+    Appends the shape of a query that the backend ran to the query log. Only the clauses that
+    Firestore can evaluate are logged, those that were evaluated locally are marked as such.
+    Gets of a single document and the queries of unsaved databases are not logged.
+    """
+    if (scope := backend.scope()) is None or \
+            fikl_query["subject_type"] == FIKLSubjectType.DOCUMENT:
+        return
+
+    where = [{"field": clause["property"], "operator": clause["operator"], "remote": True}
+             for clause in plan["remote_where"]]
+    where += [{"field": clause["property"], "operator": clause["operator"], "remote": False}
+              for clause in plan["local_where"] if clause["operator"] in backend.operators]
+    orders = plan["local_order"] or plan["remote_order"]
+
+    entry: FIKLLoggedQuery = {
+        "scope": scope,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "collection": fikl_query["subject"].rsplit("/", 1)[-1],
+        "query_scope": "COLLECTION_GROUP"
+        if fikl_query["subject_type"] == FIKLSubjectType.COLLECTION_GROUP else "COLLECTION",
+        "where": where,
+        "order": [{"field": order["property"], "operator": order["direction"] or "asc",
+                   "remote": not plan["local_order"]} for order in orders],
+        "missing_index": error is not None and is_missing_index(error)
+    }
+
+    path = os.path.expanduser(QUERY_LOG_FILE)
+    with QUERY_LOG_LOCK:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) > QUERY_LOG_LIMIT:
+            os.replace(path, f"{path}.1")
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+
+
+def read_query_log(scope: str) -> list[FIKLLoggedQuery]:
+    """
+    Reads the logged queries of a database, including those of the rotated log.
+
+    Returns:
+        list: The logged queries, oldest first.
+    """
+    path = os.path.expanduser(QUERY_LOG_FILE)
+    entries = []
+    for log in (f"{path}.1", path):
+        if not os.path.exists(log):
+            continue
+        with open(log, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line that was cut short when fikl was interrupted
+                    continue
+                if entry.get("scope") == scope:
+                    entries.append(entry)
+    return entries
+
+
+def required_index(entry: FIKLLoggedQuery) -> tuple[FIKLIndex, int] | None:
+    """
+    Works out the composite index that serves every logged clause of a query: the fields of
+    the equality filters, then those of the other filters, then those of the order by, the
+    same as the index that Firestore asks for. Queries of equality filters alone, and those of
+    a single field, are served by single-field indexes.
+
+    Returns:
+        tuple: The index and the number of its leading equality fields, which can be in any
+        order, or None when single-field indexes serve the query.
+    """
+    equalities = [clause for clause in entry["where"] if clause["operator"] in EQUALITY_OPERATORS]
+    others = [clause for clause in entry["where"] if clause["operator"] not in EQUALITY_OPERATORS]
+    directions = {order["field"]: order["operator"] for order in reversed(entry["order"])}
+    arrays = {clause["field"] for clause in equalities if clause["operator"] in ARRAY_OPERATORS}
+
+    leading = list(dict.fromkeys(clause["field"] for clause in equalities))
+    fields = list(dict.fromkeys(leading + [clause["field"] for clause in others]
+                                + [order["field"] for order in entry["order"]]))
+    if len(fields) <= 1 or not (others or entry["order"]):
+        return None
+
+    index: FIKLIndex = {
+        "collectionGroup": entry["collection"],
+        "queryScope": entry["query_scope"],
+        "fields": [{"fieldPath": field, "arrayConfig": "CONTAINS"} if field in arrays else
+                   {"fieldPath": field, "order": "DESCENDING"
+                    if directions.get(field) == "desc" else "ASCENDING"} for field in fields]
+    }
+    return (index, len(leading))
+
+
+def _field_key(field: FIKLIndexField) -> tuple:
+    """The hashable form of an index field."""
+    return (field["fieldPath"], field.get("order"), field.get("arrayConfig"))
+
+
+def is_served(index: FIKLIndex, equalities: int, others: list[FIKLIndex]) -> bool:
+    """
+    Indicates if other indexes serve the queries of an index. An index with the same fields
+    serves them, where the leading equality fields can be in any order. Firestore also merges
+    indexes that end with the same fields, so indexes that each lead with some of the equality
+    fields serve them when together they lead with every equality field.
+
+    Returns:
+        bool: True when the index is not needed.
+    """
+    fields = [_field_key(field) for field in index["fields"]]
+    leading, trailing = set(fields[:equalities]), fields[equalities:]
+
+    found, merged = False, set()
+    for other in others:
+        if (other["collectionGroup"], other["queryScope"]) != \
+                (index["collectionGroup"], index["queryScope"]):
+            continue
+        other_fields = [_field_key(field) for field in other["fields"]]
+        split = len(other_fields) - len(trailing)
+        if split >= 0 and other_fields[split:] == trailing \
+                and set(other_fields[:split]) <= leading:
+            found = True
+            merged |= set(other_fields[:split])
+    return found and merged == leading
+
+
+def suggest_indexes(backend: Backend, existing: list[FIKLIndex] | None = None) -> list[FIKLIndex]:
+    """
+    Suggests the composite indexes that let Firestore evaluate every clause of the logged
+    queries that were rejected for a missing index or that evaluated clauses locally. The
+    indexes that queries already used and the existing indexes are left out, as are the
+    indexes that are served by merging indexes with fewer equality fields.
+
+    Returns:
+        list: The suggested indexes, in the order they were first needed.
+    """
+    if (scope := backend.scope()) is None:
+        return []
+
+    used = list(existing or [])
+    wanted: list[tuple[FIKLIndex, int]] = []
+    for entry in read_query_log(scope):
+        if (required := required_index(entry)) is None:
+            continue
+        local = any(not clause["remote"] for clause in entry["where"] + entry["order"])
+        if entry["missing_index"] or local:
+            wanted.append(required)
+        else:
+            used.append(required[0])
+
+    suggested: dict[int, FIKLIndex] = {}
+    for position in sorted(range(len(wanted)), key=lambda position: wanted[position][1]):
+        index, equalities = wanted[position]
+        if not is_served(index, equalities, used + list(suggested.values())):
+            suggested[position] = index
+    return [suggested[position] for position in sorted(suggested)]
+
+
+def read_indexes(path: str) -> FIKLIndexes:
+    """
+    Reads a firestore.indexes.json file.
+
+    Returns:
+        FIKLIndexes: The indexes and field overrides that the file declares, which are empty
+        when the file does not exist.
+    """
+    declared: FIKLIndexes = {"indexes": [], "fieldOverrides": []}
+    full_path = os.path.expanduser(path)
+    if os.path.exists(full_path):
+        with open(full_path, "r", encoding="utf-8") as file:
+            declared.update(json.load(file))
+    return declared
+
+
+def write_indexes(path: str, declared: FIKLIndexes) -> str:
+    """
+    Writes a firestore.indexes.json file, replacing the file once it has been written.
+
+    Returns:
+        str: The full path of the file.
+    """
+    full_path = os.path.abspath(os.path.expanduser(path))
+    with open(f"{full_path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(declared, file, indent=2)
+    os.replace(f"{full_path}.tmp", full_path)
+    return full_path
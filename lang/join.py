@@ -0,0 +1,159 @@
+"""
+This module joins the documents of a query with the documents of a related collection.
+
+The keys of the joined documents are collected from JOIN_BATCH_SIZE documents at a time, as
+the documents of the query are read. Documents that are joined on their id are read with a
+single get_all call per batch, and documents that are joined on a field with `in` queries of
+up to JOIN_IN_SIZE keys. The joined documents of the last JOIN_CACHE_SIZE keys are kept, so that
+a key is only read once however many nearby documents hold it, and a long join does not keep
+every joined document in memory.
+"""
+# lang/join.py
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable, Iterator
+
+from lang.backend import NAME_FIELD, Backend, lookup
+from lang.record import FIKLRecord
+from lang.transformer import FIKLJoin, FIKLSubjectType
+from lang.writes import batched
+
+JOIN_BATCH_SIZE = 100
+JOIN_IN_SIZE = 30
+JOIN_CACHE_SIZE = 4 * JOIN_BATCH_SIZE
+
+
+def join_alias(join: FIKLJoin) -> str:
+    """The field that the joined documents are output in, the id of the joined collection."""
+    return join["collection"].rsplit("/", 1)[-1]
+
+
+def split_fields(fields: list[str] | str, join: FIKLJoin) -> tuple[list[str] | str, list | None]:
+    """
+    Splits the requested fields into the fields of the documents of the query and the fields
+    of the joined documents, which are prefixed with the id of the joined collection.
+
+    Returns:
+        tuple: The fields of the documents of the query, and the fields of the joined
+        documents, or None when every field of the joined documents is requested.
+    """
+    if fields == "*":
+        return ("*", None)
+
+    alias = join_alias(join)
+    own = [field for field in fields if field != alias and not field.startswith(f"{alias}.")]
+    joined = [field[len(alias) + 1:] for field in fields if field.startswith(f"{alias}.")]
+    return (own, joined if joined and alias not in fields else None)
+
+
+def join_key(record: FIKLRecord, join: FIKLJoin) -> Hashable | None:
+    """
+    Reads the key of the joined documents from a record: its document id for __name__, or the
+    value of the joined field, which is only a key when it can be compared and hashed.
+
+    Returns:
+        The key, or None when the record does not hold one.
+    """
+    if join["field"] == NAME_FIELD:
+        return record.path.rsplit("/", 1)[-1]
+
+    value = record.values.get(join["field"])
+    if join["key"] == NAME_FIELD and hasattr(value, "path"):
+        # a reference to the joined document
+        return value.path
+    return value if isinstance(value, (str, int, float, bool)) else None
+
+
+def cache_key(key: Hashable) -> tuple:
+    """
+    Keys the joined documents of a key by its type as well as its value, as True and 1 are
+    equal in Python but not in Firestore. Integers and floats compare by value in Firestore,
+    so they share a type.
+    """
+    if isinstance(key, bool):
+        return (bool, key)
+    return (float if isinstance(key, int) else type(key), key)
+
+
+def read_by_name(backend: Backend, join: FIKLJoin, keys: list,
+                 fields: list[str] | None) -> dict:
+    """
+    Reads the joined documents of the keys, which are document ids or paths, with a single
+    get_all call.
+
+    Returns:
+        dict: The joined document of every cache_key, or None when it does not exist.
+    """
+    paths = {cache_key(key): key if "/" in str(key) else f"{join['collection']}/{key}"
+             for key in keys}
+    documents = {}
+    for snapshot in backend.get_all(list(dict.fromkeys(paths.values())), fields):
+        if (data := snapshot.to_dict()) is not None and fields is None:
+            data["_path"] = snapshot.reference.path
+        documents[snapshot.reference.path] = data
+    return {key: documents.get(path) for key, path in paths.items()}
+
+
+def read_by_field(backend: Backend, join: FIKLJoin, keys: list,
+                  fields: list[str] | None) -> dict:
+    """
+    Reads the joined documents whose joined field holds one of the keys, with an `in` query
+    for every JOIN_IN_SIZE keys.
+
+    Returns:
+        dict: The list of joined documents of every cache_key.
+    """
+    documents = {cache_key(key): [] for key in keys}
+    for chunk in batched(keys, JOIN_IN_SIZE):
+        scan = {
+            "subject": join["collection"],
+            "subject_type": FIKLSubjectType.COLLECTION,
+            "where": [{"property": join["key"], "operator": "in", "value": chunk,
+                       "local": False}],
+            "order": [],
+            "limit": None,
+            "fields": None if fields is None else list(dict.fromkeys(fields + [join["key"]])),
+            "start_after": None
+        }
+        for snapshot in backend.stream(scan):
+            if (data := snapshot.to_dict()) is None:
+                continue
+            if fields is None:
+                data["_path"] = snapshot.reference.path
+            documents.setdefault(cache_key(lookup(data, join["key"])[1]), []).append(data)
+    return documents
+
+
+def join_records(backend: Backend, records: Iterable[FIKLRecord], join: FIKLJoin,
+                 fields: list[str] | None) -> Iterator[FIKLRecord]:
+    """
+    Adds the joined documents to the records, as they are consumed. A record joined on the id
+    of the joined documents holds a single document, or None, and a record joined on another
+    field holds the list of documents whose field holds the key.
+
+    Yields:
+        FIKLRecord: The records with their joined documents.
+    """
+    read = read_by_name if join["key"] == NAME_FIELD else read_by_field
+    alias = join_alias(join)
+    missing = None if join["key"] == NAME_FIELD else []
+    cache: OrderedDict = OrderedDict()
+
+    for batch in batched(records, JOIN_BATCH_SIZE):
+        keys = [join_key(record, join) for record in batch]
+        unread = {}
+        for key in keys:
+            if key is None:
+                continue
+            if (cached := cache_key(key)) in cache:
+                cache.move_to_end(cached)
+            else:
+                unread.setdefault(cached, key)
+        if unread:
+            cache.update(read(backend, join, list(unread.values()), fields))
+        # the keys of the batch were used last, so only the keys of earlier batches are evicted
+        while len(cache) > JOIN_CACHE_SIZE:
+            cache.popitem(last=False)
+
+        for record, key in zip(batch, keys):
+            record.document[alias] = missing if key is None else cache.get(cache_key(key), missing)
+            yield record
@@ -0,0 +1,359 @@
+"""
+This module decides which parts of a fikl query are executed by the backend.
+
+With automatic placement every clause that is not marked local is first pushed down. When
+Firestore rejects the query because a composite index is missing, the query shape is
+remembered and the query is planned again so that the backend only evaluates clauses that
+single-field indexes serve, choosing the most selective of them, and the rest are evaluated
+locally.
+"""
+# lang/planner.py
+import json
+import os
+import threading
+import weakref
+from typing import TypedDict
+
+from google.api_core import exceptions
+
+from lang.backend import Backend, Capability, FIKLScan, DISJUNCTIVE_OPERATORS
+from lang.join import NAME_FIELD, split_fields
+from lang.stats import FIKLCollectionStats, FIKLEstimate, collection_stats, estimate_query, \
+    selectivity
+from lang.transformer import (FIKLQuery,
+                              FIKLQueryType,
+                              FIKLSubjectType,
+                              FIKLWhere,
+                              FIKLOrderBy)
+
+PLACEMENT_FILE = "~/.fikl/placements.json"
+PLANNER_SETTINGS = {"placement": "auto"}
+
+# filters that Firestore serves by merging single-field indexes
+EQUALITY_OPERATORS = frozenset({"==", "in", "array_contains", "array_contains_any"})
+
+
+class PlanError(ValueError):
+    """Raised when a query can not be executed by the selected backend."""
+
+
+class FIKLPlan(TypedDict):
+    """The definition of how a query is split between the backend and local evaluation."""
+    backend: str
+    remote_where: list[FIKLWhere]
+    local_where: list[FIKLWhere]
+    remote_order: list[FIKLOrderBy]
+    local_order: list[FIKLOrderBy]
+    projection: list[str] | None
+    aggregate: str | None
+    limit: int | None
+    fallback: bool
+    estimate: FIKLEstimate | None
+
+
+def plan_where(fikl_query: FIKLQuery, backend: Backend) -> tuple[list, list]:
+    """
+    Splits the where clauses into those evaluated by the backend and those evaluated locally.
+    Disjunctive operators are evaluated locally when the backend does not support OR filters.
+
+    Returns:
+        tuple: The remote where clauses and the local where clauses.
+    """
+    remote, local = [], []
+    for where in fikl_query.get("where") or []:
+        if where["local"]:
+            local.append(where)
+        elif where["operator"] in DISJUNCTIVE_OPERATORS and \
+                not backend.supports(Capability.OR_FILTERS):
+            local.append(where)
+        elif where["operator"] not in backend.operators:
+            raise PlanError(f"The '{where['operator']}' operator is not supported by "
+                            f"{backend.name}. Use local evaluation by placing ^ after the "
+                            f"property name. Did you mean {where['property']}^ ?")
+        else:
+            remote.append(where)
+    return (remote, local)
+
+
+def order_by_selectivity(local_where: list[FIKLWhere],
+                         stats: FIKLCollectionStats | None) -> list[FIKLWhere]:
+    """
+    Orders the local where clauses so that the clauses that exclude the most documents are
+    evaluated first, and the evaluation of a document stops as early as possible.
+
+    Returns:
+        list: The local where clauses, most selective first.
+    """
+    return sorted(local_where, key=lambda where: selectivity(stats, where))
+
+
+def plan_order(fikl_query: FIKLQuery) -> tuple[list, list]:
+    """
+    Splits the order by clauses. When any clause is local then every clause is applied
+    locally (after the remote ones have been applied by the backend), otherwise the order
+    returned by the backend is used as is.
+
+    Returns:
+        tuple: The remote order by clauses and the local order by clauses.
+    """
+    orders = fikl_query.get("order") or []
+    remote = [order for order in orders if order["local"] is False]
+    local = orders if len(remote) < len(orders) else []
+    return (remote, local)
+
+
+def plan_projection(fikl_query: FIKLQuery, local_where: list[FIKLWhere],
+                    local_order: list[FIKLOrderBy], backend: Backend) -> list[str] | None:
+    """
+    Determines the fields that need to be read from the backend. Updates and deletes only
+    need the document keys unless a clause is evaluated locally.
+
+    Returns:
+        list: The fields to read, or None if every field is required.
+    """
+    if not backend.supports(Capability.PROJECTION):
+        return None
+
+    local_fields = [clause["property"] for clause in local_where + local_order]
+
+    if fikl_query["query_type"] in (FIKLQueryType.UPDATE, FIKLQueryType.DELETE):
+        return list(dict.fromkeys(local_fields))
+
+    if fikl_query.get("fields", "*") == "*":
+        return None
+
+    group = [fikl_query["group"]] if fikl_query.get("group") else []
+    if (join := fikl_query.get("join")) is None:
+        return list(dict.fromkeys(fikl_query["fields"] + local_fields + group))
+
+    keys = [] if join["field"] == NAME_FIELD else [join["field"]]
+    fields = split_fields(fikl_query["fields"], join)[0]
+    return list(dict.fromkeys(fields + local_fields + group + keys))
+
+
+def plan_aggregate(fikl_query: FIKLQuery, local_where: list[FIKLWhere],
+                   backend: Backend) -> str | None:
+    """
+    Determines if the aggregate function of the query can be computed by the backend.
+
+    Returns:
+        str: The aggregate to push down, or None.
+    """
+    if fikl_query.get("function") == "count" and backend.supports(Capability.AGGREGATION) \
+            and counts_remote_matches(fikl_query, local_where):
+        return "count"
+    return None
+
+
+def counts_remote_matches(fikl_query: FIKLQuery, local_where: list[FIKLWhere]) -> bool:
+    """Indicates if the count of a query is the number of documents that the backend matches."""
+    return not local_where and not fikl_query.get("group") and not fikl_query.get("sample") \
+        and fikl_query["subject_type"] != FIKLSubjectType.DOCUMENT
+
+
+def plan_sample(fikl_query: FIKLQuery, remote_where: list[FIKLWhere]) -> tuple[list, list]:
+    """
+    Splits the remote where clauses of a sampled query. A sample is read in the order of the
+    document ids, which Firestore only merges with equality filters, and the partitions of a
+    collection group are only read unfiltered.
+
+    Returns:
+        tuple: The where clauses that the sample is read with and those evaluated locally.
+    """
+    if fikl_query["subject_type"] == FIKLSubjectType.COLLECTION_GROUP:
+        return ([], remote_where)
+    return ([where for where in remote_where if where["operator"] in EQUALITY_OPERATORS],
+            [where for where in remote_where if where["operator"] not in EQUALITY_OPERATORS])
+
+
+def query_shape(fikl_query: FIKLQuery) -> str:
+    """
+    Describes the clauses of a query that need an index, without their values, so that
+    queries that need the same index have the same shape.
+
+    Returns:
+        str: The shape of the query.
+    """
+    where = sorted(f"{where['property']} {where['operator']}"
+                   for where in fikl_query.get("where") or [] if not where["local"])
+    order = [f"{order['property']} {order['direction'] or 'asc'}"
+             for order in fikl_query.get("order") or [] if not order["local"]]
+    return (f"{fikl_query['subject_type'].name.lower()}:{fikl_query['subject']}"
+            f"?where={','.join(where)}&order={','.join(order)}")
+
+
+PLACEMENT_HOLDER: dict[str, object] = {
+    "lock": threading.Lock(),
+    "saved": None,
+    "unsaved": weakref.WeakKeyDictionary()
+}
+
+
+def backend_fallbacks(backend: Backend) -> list[str]:
+    """The query shapes that are missing an index in the backend's database, the caller holds
+    the lock."""
+    if (scope := backend.scope()) is None:
+        return PLACEMENT_HOLDER["unsaved"].setdefault(backend, [])
+
+    if PLACEMENT_HOLDER["saved"] is None:
+        try:
+            with open(os.path.expanduser(PLACEMENT_FILE), "r", encoding="utf-8") as file:
+                PLACEMENT_HOLDER["saved"] = json.load(file)
+        except (OSError, ValueError):
+            PLACEMENT_HOLDER["saved"] = {}
+    return PLACEMENT_HOLDER["saved"].setdefault(scope, [])
+
+
+def needs_fallback(backend: Backend, fikl_query: FIKLQuery) -> bool:
+    """Indicates if a query of the same shape was rejected because an index is missing."""
+    with PLACEMENT_HOLDER["lock"]:
+        return query_shape(fikl_query) in backend_fallbacks(backend)
+
+
+def is_missing_index(error: BaseException) -> bool:
+    """Indicates if Firestore rejected a query because it needs a composite index."""
+    return isinstance(error, exceptions.FailedPrecondition) and "index" in str(error).lower()
+
+
+def remember_fallback(backend: Backend, fikl_query: FIKLQuery, error: BaseException) -> bool:
+    """
+    Remembers that a query was rejected because an index is missing, so that queries of the
+    same shape are planned for single-field indexes from now on.
+
+    Returns:
+        bool: True when the query can be planned again, False when the error is of another
+        kind or the query was already planned for single-field indexes.
+    """
+    if PLANNER_SETTINGS["placement"] != "auto" or not is_missing_index(error):
+        return False
+
+    with PLACEMENT_HOLDER["lock"]:
+        fallbacks = backend_fallbacks(backend)
+        if (shape := query_shape(fikl_query)) in fallbacks:
+            return False
+        fallbacks.append(shape)
+
+        if backend.scope() is not None:
+            path = os.path.expanduser(PLACEMENT_FILE)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(PLACEMENT_HOLDER["saved"], file)
+            os.replace(f"{path}.tmp", path)
+    return True
+
+
+def single_field_placements(remote_where: list[FIKLWhere],
+                            remote_order: list[FIKLOrderBy]) -> list[tuple[list, list]]:
+    """
+    Lists the combinations of clauses that Firestore serves without a composite index: only
+    equality filters, which are merged, or the inequality filters of a single field ordered
+    by nothing but that field, or an order by a single field.
+
+    Returns:
+        list: The where and order by clauses of every combination.
+    """
+    equalities = [where for where in remote_where if where["operator"] in EQUALITY_OPERATORS]
+    placements = [(equalities, [])] if equalities else []
+
+    for field in dict.fromkeys(where["property"] for where in remote_where
+                               if where["operator"] not in EQUALITY_OPERATORS):
+        ranges = [where for where in remote_where
+                  if where["property"] == field and where["operator"] not in EQUALITY_OPERATORS]
+        ordered = [order["property"] for order in remote_order] == [field]
+        placements.append((ranges, remote_order if ordered else []))
+
+    if len(remote_order) == 1:
+        placements.append(([], remote_order))
+    return placements
+
+
+def place_on_single_field_indexes(remote_where: list[FIKLWhere],
+                                  remote_order: list[FIKLOrderBy],
+                                  stats: FIKLCollectionStats | None) -> tuple[list, list, list]:
+    """
+    Chooses the clauses that single-field indexes serve and that leave the fewest documents
+    to read, preferring combinations that also order the documents.
+
+    Returns:
+        tuple: The where clauses that are pushed down, those that are evaluated locally, and
+        the order by clauses that are pushed down.
+    """
+    def reads(placement: tuple[list, list]) -> tuple[float, bool]:
+        fraction = 1.0
+        for where in placement[0]:
+            fraction *= selectivity(stats, where)
+        return (fraction, not placement[1])
+
+    placements = single_field_placements(remote_where, remote_order)
+    where, order = min(placements, key=reads) if placements else ([], [])
+    return (where, [clause for clause in remote_where if clause not in where], order)
+
+
+def plan_query(fikl_query: FIKLQuery, backend: Backend) -> FIKLPlan:
+    """
+    Creates the plan that pushes down as much of the query as the backend supports. When a
+    query of the same shape was rejected for a missing index, only the clauses that
+    single-field indexes serve are pushed down. When the collection has been analyzed the plan
+    also estimates the cost of the query.
+
+    Returns:
+        FIKLPlan: The plan for the query.
+    """
+    remote_where, local_where = plan_where(fikl_query, backend)
+    remote_order, local_order = plan_order(fikl_query)
+    stats = collection_stats(backend, fikl_query["subject"], fikl_query["subject_type"])
+
+    fallback = PLANNER_SETTINGS["placement"] == "auto" and needs_fallback(backend, fikl_query)
+    if fallback:
+        remote_where, moved, pushed = place_on_single_field_indexes(
+            remote_where, [] if local_order else remote_order, stats)
+        local_where = local_where + [{**where, "local": True} for where in moved]
+        if not local_order and pushed != remote_order:
+            local_order = [{**order, "local": True} for order in remote_order]
+        remote_order = pushed
+
+    if fikl_query.get("sample") is not None:
+        remote_where, moved = plan_sample(fikl_query, remote_where)
+        local_where = local_where + [{**where, "local": True} for where in moved]
+        local_order = local_order or [{**order, "local": True} for order in remote_order]
+        remote_order = []
+
+    local_where = order_by_selectivity(local_where, stats)
+    # local clauses may change which documents come first, the limit is then applied locally
+    limit = None if local_where or local_order else fikl_query.get("limit")
+
+    return {
+        "backend": backend.name,
+        "remote_where": remote_where,
+        "local_where": local_where,
+        "remote_order": remote_order,
+        "local_order": local_order,
+        "projection": plan_projection(fikl_query, local_where, local_order, backend),
+        "aggregate": plan_aggregate(fikl_query, local_where, backend),
+        "limit": limit,
+        "fallback": fallback,
+        "estimate": None if stats is None else estimate_query(
+            stats, remote_where, local_where, limit, fikl_query.get("limit"))
+    }
+
+
+def scan_for(fikl_query: FIKLQuery, plan: FIKLPlan, **overrides) -> FIKLScan:
+    """
+    Creates the scan that is sent to the backend for the provided plan.
+
+    Returns:
+        FIKLScan: The scan for the remote part of the plan.
+    """
+    scan: FIKLScan = {
+        "subject": fikl_query["subject"],
+        "subject_type": fikl_query["subject_type"],
+        "where": plan["remote_where"],
+        "order": plan["remote_order"],
+        "limit": plan["limit"],
+        "fields": plan["projection"],
+        "start_after": None,
+        "local_where": plan["local_where"],
+        "local_order": plan["local_order"]
+    }
+    scan.update(overrides)
+    return scan
@@ -0,0 +1,81 @@
+"""
+This module provides the pool of Firestore backends that a session uses.
+
+A target names a project and, optionally, a named database of the project as
+project/database. The Firebase app of a project is initialized once, with the default
+credentials, and the client of a database is created once and reused by every later query,
+so that its channels stay open between queries. Switching between targets with use is then
+as cheap as a lookup, and a query can fan out to several targets in parallel.
+"""
+# lang/pool.py
+import threading
+
+import firebase_admin
+from lang.backend import DEFAULT_DATABASE, FirestoreBackend, firestore_client
+
+# the targets that a query fans out to are queried in parallel by at most this many threads
+POOL_WORKERS = 8
+
+POOL_HOLDER = {"lock": threading.Lock(), "backends": {}}
+
+
+def parse_target(target: str) -> tuple[str | None, str]:
+    """
+    Splits a target into its project and database. The project may be left out, as in
+    /database, to name a database of the default project.
+
+    Returns:
+        tuple: The project, None for the default project, and the database.
+    """
+    project, _, database = target.strip().partition("/")
+    if "/" in database or not (project or database):
+        raise ValueError(f"Invalid database: {target}, expected project[/database]")
+    return (project or None, database or DEFAULT_DATABASE)
+
+
+def target_name(project: str | None, database: str) -> str:
+    """The name of a target, as it is written in use and --database."""
+    if database == DEFAULT_DATABASE:
+        return project or DEFAULT_DATABASE
+    return f"{project or ''}/{database}"
+
+
+def project_app(project: str | None) -> firebase_admin.App:
+    """
+    Fetches the Firebase app of a project, initializing it the first time that it is needed.
+
+    Returns:
+        App: The default app for the default project, or else an app named after the project.
+    """
+    try:
+        return firebase_admin.get_app() if project is None else firebase_admin.get_app(project)
+    except ValueError:
+        if project is None:
+            return firebase_admin.initialize_app()
+        return firebase_admin.initialize_app(options={"projectId": project}, name=project)
+
+
+def connect(project: str | None, database: str):
+    """
+    Creates the Firestore client of a database of a project.
+
+    Returns:
+        Client: The client of the database.
+    """
+    return firestore_client(project_app(project), database)
+
+
+def pooled_backend(target: str) -> FirestoreBackend:
+    """
+    Fetches the backend of a target from the pool, connecting to the database the first time
+    that it is used.
+
+    Returns:
+        FirestoreBackend: The backend of the target.
+    """
+    key = parse_target(target)
+    with POOL_HOLDER["lock"]:
+        if (backend := POOL_HOLDER["backends"].get(key)) is None:
+            backend = FirestoreBackend(connect(*key), key[1])
+            POOL_HOLDER["backends"][key] = backend
+    return backend
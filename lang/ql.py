@@ -1,13 +1,16 @@
 """This module provides the fikl query details."""
 # pylint: disable=too-many-return-statements
 # lang/ql.py
+import copy
+import datetime
 import json
-import re
-from operator import itemgetter as i
-from functools import cmp_to_key
 import os
-from collections import defaultdict
-from collections.abc import MutableMapping
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import TypedDict
+from itertools import chain, islice
 
 import pandas as pds
 
@@ -18,21 +21,57 @@ import pydash
 import typer
 
 from firebase_admin import firestore as fs
-
-from google.cloud.firestore_v1.base_query import FieldFilter
-
+from google.api_core import exceptions
+
+from lang import encoding
+from lang.backend import (Backend, Capability, FieldTransform, FIKLScan, FIKLWrite, assign,
+                          compare, current_backend, lookup, thread_backend, use_backend)
+from lang.checkpoint import (FIKLCheckpoint, FIKLCursorValue, decode_cursor_value,
+                             encode_cursor_value, remove_checkpoint, save_checkpoint)
+from lang.export import MANIFEST_FILE, export_collections, export_incremental
+from lang.join import NAME_FIELD, join_records, split_fields
+from lang.indexes import FIKLIndexes, log_query, read_indexes, suggest_indexes, write_indexes
+from lang.writes import (WRITE_BATCH_SIZE, FIKLWriteResult, batched, read_journal, read_records,
+                         schedule_writes)
+from lang.pool import POOL_WORKERS, parse_target, pooled_backend, target_name
+from lang.planner import PLANNER_SETTINGS, FIKLPlan, plan_query, remember_fallback, scan_for
+from lang.record import FIKLRecord, local_values, sort_records
+from lang.sample import sample_size, sample_snapshots
+from lang.schema import record_collections
+from lang.sketch import add_value, new_sketch, sketch_label, sketch_result
+from lang.stats import FIKLCollectionStats, analyze_collection, save_stats
 from lang.transformer import (FIKLQuery,
                               FIKLQueryType,
                               FIKLWhere,
-                              FIKLOrderBy,
                               FIKLSelectQuery,
                               FIKLInsertQuery,
+                              FIKLExportQuery,
+                              FIKLImportQuery,
+                              FIKLAnalyzeQuery,
+                              FIKLIndexesQuery,
+                              FIKLCursorQuery,
+                              FIKLLocalIndexQuery,
+                              FIKLSnapshotQuery,
+                              FIKLUseQuery,
                               FIKLSubjectType,
                               FIKLOutputType,
                               FIKLFormatType,
                               FIKLUpdateQuery, parse)
 
 
+PRIMITIVE_TYPES = frozenset({type(None), bool, int, float, str})
+
+# the documents of a list of paths are read in batches, with a few batches in flight
+DOCUMENTS_BATCH_SIZE = 100
+DOCUMENTS_WORKERS = 4
+
+# the sketches of approximate aggregates are built for partitions of the scan in parallel
+SKETCH_WORKERS = 8
+
+# the documents of a select query are written to its output file in batches
+OUTPUT_BATCH_SIZE = 1000
+
+
 class QueryError(ValueError):
     """
     Exception raised for errors in the input query.
@@ -42,42 +81,247 @@ class QueryError(ValueError):
     """
 
 
+class FIKLCursor(TypedDict):
+    """A declared cursor, holding its position in the results of its select query."""
+    query: FIKLSelectQuery
+    records: Iterator[FIKLRecord]
+    remaining: int | None
+    fetched: int
+
+
+CURSOR_HOLDER: dict[str, FIKLCursor] = {}
+# the point in time that every read of the session is pinned to, between begin and end snapshot
+SNAPSHOT_HOLDER: dict[str, datetime.datetime | None] = {"read_time": None}
+WRITE_QUERIES = frozenset({FIKLQueryType.UPDATE, FIKLQueryType.DELETE, FIKLQueryType.INSERT,
+                           FIKLQueryType.IMPORT})
+# the backends of the databases that every query fans out to, when the session uses several
+DATABASES_HOLDER: dict[str, dict[str, Backend] | None] = {"fan_out": None}
+SESSION_QUERIES = frozenset({FIKLQueryType.USE, FIKLQueryType.BEGIN_SNAPSHOT,
+                             FIKLQueryType.END_SNAPSHOT})
+CURSOR_QUERIES = frozenset({FIKLQueryType.DECLARE, FIKLQueryType.FETCH, FIKLQueryType.CLOSE})
+
+
 def should_output(fikl_query: FIKLQuery) -> bool:
     "Indicates if the output of the query should be saved to a file"
     return "output_type" in fikl_query and object_exists(fikl_query["output_type"])
 
 
-def run_query(query: str) -> tuple[list[dict] | dict, FIKLFormatType]:
+def can_stream(fikl_query: FIKLQuery) -> bool:
+    """Indicates if the documents of the query can be output as they are read."""
+    return fikl_query["query_type"] == FIKLQueryType.SELECT and not should_output(fikl_query) \
+        and not fikl_query.get("group") and not fikl_query.get("function") \
+        and not fikl_query.get("sketches")
+
+
+def can_stream_to_file(fikl_query: FIKLQuery) -> bool:
+    """Indicates if the documents of the query can be written to its file as they are read."""
+    return fikl_query["query_type"] == FIKLQueryType.SELECT \
+        and fikl_query.get("output_type") == FIKLOutputType.PATH \
+        and not fikl_query.get("group") and not fikl_query.get("function") \
+        and not fikl_query.get("sketches")
+
+
+def can_checkpoint(fikl_query: FIKLQuery) -> bool:
+    """Indicates if the progress of the query can be saved, as it is written page by page."""
+    return fikl_query["query_type"] == FIKLQueryType.SELECT \
+        and fikl_query.get("page") is not None \
+        and fikl_query.get("output_type") == FIKLOutputType.PATH \
+        and not fikl_query.get("join") \
+        and fikl_query["subject_type"] != FIKLSubjectType.DOCUMENT \
+        and not fikl_query.get("group") and not fikl_query.get("function")
+
+
+def stream_documents(fikl_query: FIKLSelectQuery) -> Iterator[dict]:
+    """
+    Lazily executes a select query, converting each document as it is read.
+
+    Yields:
+        dict: The documents, reduced to the requested fields.
+    """
+    try:
+        for record in stream_select_query(fikl_query):
+            yield record.document
+    except QueryError:
+        raise
+    except Exception as exception:
+        raise QueryError(exception) from exception
+
+
+def run_query(query: str, lazy: bool = False) -> tuple[str | Iterator[dict], FIKLFormatType]:
     """
     Parses the supplied query against the grammar and and executes the query.
+    When lazy is requested and the results of the query can be streamed, an iterator of
+    documents is returned in place of the formatted content and the query is only
+    executed as the iterator is consumed.
 
     Returns:
-        list: The list of records returned in the case of a select query.
-        int: The number of records affected.
+        str: The formatted content of the results.
+        Iterator: The documents of the query in the case of a lazy select query.
     """
     try:
         fikl_query: FIKLQuery = parse(query)
+        output_format = format_as(fikl_query)
+        read_time = read_time_for(fikl_query)
+
+        if SNAPSHOT_HOLDER["read_time"] is not None and fikl_query["query_type"] in WRITE_QUERIES:
+            raise QueryError("The session reads a snapshot, which is read only, "
+                             "end snapshot before writing")
+
+        if (backends := DATABASES_HOLDER["fan_out"]) is not None and \
+                fikl_query["query_type"] not in SESSION_QUERIES:
+            return fan_out_query(fikl_query, backends)
+
+        if lazy and can_stream(fikl_query) and read_time is None:
+            return (stream_documents(fikl_query), output_format)
+
+        with current_backend().pinned(read_time):
+            return execute_and_format(fikl_query, output_format)
+
+    except QueryError:
+        raise
+    except Exception as exception:
+        raise QueryError(exception) from exception
+
+
+def fan_out_query(fikl_query: FIKLQuery,
+                  backends: dict[str, Backend]) -> tuple[str, FIKLFormatType]:
+    """
+    Executes a read query against several databases in parallel, each from a thread of its
+    own that queries the backend of its database. The results are shown side by side, so they
+    can only be formatted as JSON.
+
+    Returns:
+        str: The results of the query, keyed by database.
+    """
+    if fikl_query["query_type"] in CURSOR_QUERIES:
+        raise QueryError("Cursors read a single database, use one database to declare them")
+    if fikl_query["query_type"] in WRITE_QUERIES | {FIKLQueryType.EXPORT}:
+        raise QueryError("Only reads fan out to several databases, use one database to write, "
+                         "import or export")
+    if format_as(fikl_query) != FIKLFormatType.JSON or should_output(fikl_query):
+        raise QueryError("The results of several databases can only be shown as JSON")
+
+    read_time = read_time_for(fikl_query)
+
+    def execute_on(backend: Backend):
+        with thread_backend(backend), backend.pinned(read_time):
+            content = execute_and_format(copy.deepcopy(fikl_query), FIKLFormatType.JSON)[0]
+        return json.loads(content)
+
+    with ThreadPoolExecutor(max_workers=POOL_WORKERS) as pool:
+        results = dict(zip(backends, pool.map(execute_on, backends.values())))
+    return (output_as(results, FIKLFormatType.JSON), FIKLFormatType.JSON)
+
+
+def use_databases(databases: list[str]) -> list[str]:
+    """
+    Switches the session to the backends of the pool of a list of databases, each written as
+    project[/database]. The first database is queried by the session, and when there are
+    several every query fans out to all of them.
+
+    Returns:
+        list: The names of the databases in use.
+    """
+    try:
+        backends = {target_name(*parse_target(database)): pooled_backend(database)
+                    for database in databases}
+    except ValueError as exception:
+        raise QueryError(exception) from exception
+    use_backend(next(iter(backends.values())))
+    DATABASES_HOLDER["fan_out"] = backends if len(backends) > 1 else None
+    return list(backends)
+
+
+def execute_and_format(fikl_query: FIKLQuery,
+                       output_format: FIKLFormatType) -> tuple[str, FIKLFormatType]:
+    """
+    Executes a parsed query and formats its results, saving them to a file when the query
+    has an output.
+
+    Returns:
+        str: The formatted content of the results.
+    """
+    if can_stream_to_file(fikl_query):
+        saved_to_path, documents_count = stream_to_file(fikl_query)
+        result = {"count": documents_count, "dest": saved_to_path}
+        return (output_as(result, FIKLFormatType.JSON), output_format)
+
+    if fikl_query["query_type"] == FIKLQueryType.SELECT and \
+            (count := execute_count_query(fikl_query)) is not None:
+        documents_count = count
+        content = output_as(count, output_format)
+    else:
         response = execute_query(fikl_query)
 
         if isinstance(response, int):
             return (output_as({"count": response}, FIKLFormatType.JSON), FIKLFormatType.JSON)
 
-        documents = [snapshot_to_document_fn(fikl_query)(
-            doc) for doc in response if object_exists(doc)]
+        if isinstance(response, dict):
+            return (output_as(response, FIKLFormatType.JSON), FIKLFormatType.JSON)
 
-        output_format = format_as(fikl_query)
+        documents = [record_to_document(record) for record in response]
+        documents_count = len(documents)
 
         function = function_for_query(fikl_query)
 
         grouped_results = do_group_by(documents, fikl_query)
         content = output_as(function(grouped_results), output_format)
 
-        if should_output(fikl_query):
-            saved_to_path = output_content(content, fikl_query)
-            result = {"count": len(documents), "dest": saved_to_path}
-            return (output_as(result, FIKLFormatType.JSON), output_format)
+    if should_output(fikl_query):
+        saved_to_path = output_content(content, fikl_query)
+        result = {"count": documents_count, "dest": saved_to_path}
+        return (output_as(result, FIKLFormatType.JSON), output_format)
+
+    return (content, output_format)
+
+
+def read_time_for(fikl_query: FIKLQuery) -> datetime.datetime | None:
+    """
+    Determines the point in time that the reads of a query are pinned to: the time of its
+    as of clause, or else the snapshot of the session.
+
+    Returns:
+        datetime: The read time, or None when the query reads the latest data.
+    """
+    return fikl_query.get("read_time") or SNAPSHOT_HOLDER["read_time"]
+
+def run_checkpointed_query(checkpoint: FIKLCheckpoint) -> tuple[str, FIKLFormatType]:
+    """
+    Executes the query of the checkpoint, a paged select query that is output to a file.
+    Each page is appended to the output file before the checkpoint is saved, so a query that
+    is interrupted can be run again with the same checkpoint to continue from the last page.
+
+    Returns:
+        str: The number of documents written and the path of the output file.
+    """
+    try:
+        fikl_query: FIKLQuery = parse(checkpoint["query"])
+        with current_backend().pinned(read_time_for(fikl_query)):
+            dest = execute_checkpointed_query(fikl_query, checkpoint)
+        remove_checkpoint(checkpoint["id"])
+
+        result = {"count": checkpoint["count"], "dest": dest}
+        return (output_as(result, FIKLFormatType.JSON), FIKLFormatType.JSON)
+
+    except QueryError:
+        raise
+    except Exception as exception:
+        raise QueryError(exception) from exception
+
+def replay_failures(path: str) -> tuple[str, FIKLFormatType]:
+    """
+    Applies the writes of a failure journal again. The journal is removed once it has been
+    replayed, writes that fail again are recorded in a new journal.
 
-        return (content, output_format)
+    Returns:
+        str: The number of writes applied and failed, and the new journal of failures.
+    """
+    try:
+        result = execute_writes("Replaying", read_journal(path))
+        os.remove(os.path.expanduser(path))
+        if isinstance(result, int):
+            result = {"count": result, "failed": 0, "journal": None}
+        return (output_as(result, FIKLFormatType.JSON), FIKLFormatType.JSON)
 
     except QueryError:
         raise
@@ -86,20 +330,58 @@ def run_query(query: str) -> tuple[list[dict] | dict, FIKLFormatType]:
 
 def format_as(fikl_query: FIKLSelectQuery) -> FIKLFormatType:
     """Determines the appropriate format to use for the query results."""
-    return FIKLFormatType.CSV if fikl_query["format"] == FIKLFormatType.CSV else FIKLFormatType.JSON
+    return fikl_query.get("format") or FIKLFormatType.JSON
 
 def output_as(dictionary, file_type: FIKLFormatType):
     """Converts the provided dictionary to the output format."""
     if file_type == FIKLFormatType.CSV:
         return csv_dumps(dictionary)
 
-    return json.dumps(dictionary, indent=2)
+    return encoding.dumps(dictionary, compact=file_type == FIKLFormatType.JSON_COMPACT)
+
+def output_chunk(documents: list, file_type: FIKLFormatType, first: bool,
+                 columns: list[str] | None = None) -> str:
+    """
+    Converts a page of documents to the output format, such that consecutive pages, between
+    output_opening and output_closing, give the same content as output_as of all the documents.
+    The csv columns of the pages are kept in the columns that are passed for every page.
+    """
+    if not documents:
+        return ""
+
+    if file_type == FIKLFormatType.CSV:
+        return csv_dumps(documents, header=first, columns=[] if columns is None else columns)
 
-def csv_dumps(records: list):
-    """Converts the provided records to a csv string."""
-    flat_records = map(flatten, records)
-    data_frame = pds.DataFrame(flat_records)
-    return data_frame.to_csv(index=False)
+    if file_type == FIKLFormatType.JSON_COMPACT:
+        return ("" if first else ",") + ",".join(encoding.dumps(document, compact=True)
+                                                 for document in documents)
+
+    items = ("  " + encoding.dumps(document).replace("\n", "\n  ") for document in documents)
+    return ("\n" if first else ",\n") + ",\n".join(items)
+
+def output_opening(file_type: FIKLFormatType) -> str:
+    """The content that precedes the first page of documents."""
+    return "" if file_type == FIKLFormatType.CSV else "["
+
+def output_closing(file_type: FIKLFormatType, count: int) -> str:
+    """The content that follows the last page of documents."""
+    if file_type == FIKLFormatType.CSV:
+        return ""
+    return "\n]" if count and file_type == FIKLFormatType.JSON else "]"
+
+def csv_dumps(records: list, header: bool = True, columns: list[str] | None = None):
+    """
+    Converts the provided records to a csv string. Consecutive pages of records share their
+    columns when the same list of columns is passed for every page: the columns of earlier
+    pages keep their place, and fields that a page adds are appended after them.
+    """
+    flat_records = [flatten(record, encode=True) for record in records]
+    if columns is None:
+        return pds.DataFrame(flat_records).to_csv(index=False, header=header)
+
+    columns.extend(dict.fromkeys(key for record in flat_records for key in record
+                                 if key not in columns))
+    return pds.DataFrame(flat_records, columns=columns).to_csv(index=False, header=header)
 
 
 def output_content(output_data: str, fikl_query: FIKLSelectQuery):
@@ -119,6 +401,29 @@ def output_content(output_data: str, fikl_query: FIKLSelectQuery):
     return "Unknown output type"
 
 
+def stream_to_file(fikl_query: FIKLSelectQuery) -> tuple[str, int]:
+    """
+    Writes the documents of a select query to its output file as they are read, a batch at a
+    time, so that a large or externally sorted result is never held in memory as a whole.
+
+    Returns:
+        tuple: The path of the output file and the number of documents written to it.
+    """
+    output_format = format_as(fikl_query)
+    full_path = os.path.expanduser(fikl_query["output"])
+    count = 0
+    columns: list[str] = []
+    with open(full_path, "w", encoding="utf-8") as file:
+        file.write(output_opening(output_format))
+        for batch in batched(stream_select_query(fikl_query), OUTPUT_BATCH_SIZE):
+            file.write(output_chunk([record.document for record in batch], output_format,
+                                    count == 0, columns))
+            count += len(batch)
+        file.write(output_closing(output_format, count))
+
+    return (full_path, count)
+
+
 def do_group_by(records, fikl_query: FIKLSelectQuery):
     """Groups records by the provided group property."""
     if "group" in fikl_query and fikl_query["group"]:
@@ -142,24 +447,29 @@ def function_for_query(fikl_query: FIKLSelectQuery):
 
 def merge_setters(dicts: list[dict]) -> dict:
     """
-    Merges a list of setter values into a single dict.
+    Merges a list of setter values into a single dict. Setters with a transform are given
+    a FieldTransform value, which the backend computes as the document is written.
 
     Returns:
         dict: The dict with the setters.
     """
     result = {}
     for setter in dicts:
-        result.update({setter["property"]: setter["value"]})
+        value = setter["value"] if setter.get("transform") is None \
+            else FieldTransform(setter["transform"], setter["value"])
+        result.update({setter["property"]: value})
     return result
 
 
-def flatten(dictionary, parent_key="", separator="."):
-    """Flattens a nested dictionary"""
+def flatten(dictionary, parent_key="", separator=".", encode=False):
+    """Flattens a nested dictionary, optionally encoding values that are not primitives"""
     items = []
     for key, value in dictionary.items():
         new_key = parent_key + separator + key if parent_key else key
+        if encode and type(value) not in PRIMITIVE_TYPES:
+            value = encoding.to_primitive(value)
         if isinstance(value, MutableMapping):
-            items.extend(flatten(value, new_key, separator=separator).items())
+            items.extend(flatten(value, new_key, separator=separator, encode=encode).items())
         else:
             items.append((new_key, value))
     return dict(items)
@@ -240,81 +550,51 @@ def object_exists(obj: dict) -> bool:
     return obj is not None
 
 
-def snapshot_to_document_fn(fikl_query: FIKLQuery):
+def snapshot_to_record_fn(fikl_query: FIKLQuery, plan: FIKLPlan):
     """
-    Creates a function that can be used to convert a DocumentSnapshot to a dictionary.
-    This function will also reduce the returned fields to only those requested in the query.
+    Creates a function that can be used to convert a DocumentSnapshot to a FIKLRecord.
+    The snapshot is only decoded once: the record holds the document reduced to the fields
+    requested in the query, and the values of the fields that are filtered and sorted locally.
 
     Returns:
-        The function that can be called to convert a DocumentSnapshot to a dictionary.
+        The function that can be called to convert a DocumentSnapshot to a FIKLRecord, or
+        None when the document does not exist.
     """
     requested_fields = fikl_query["fields"] if "fields" in fikl_query else "*"
+    keys = []
+    if (join := fikl_query.get("join")) is not None:
+        requested_fields = split_fields(requested_fields, join)[0]
+        keys = [] if join["field"] == NAME_FIELD else [join["field"]]
+    local_fields = list(dict.fromkeys(
+        [where["property"] for where in plan["local_where"]] +
+        [order_by["property"] for order_by in plan["local_order"]] + keys +
+        [sketch["property"] for sketch in fikl_query.get("sketches") or []]))
 
-    def extract_fields_from_snapshot(response: fs.firestore.DocumentSnapshot | str):
-        if isinstance(response, str):
-            return response
-
-        document_dict = response.to_dict()
-        document_dict["_path"] = response.reference.path
-
-        if requested_fields == "*":
-            return document_dict
-
-        return extract_fields(document_dict, requested_fields)
-
-    return extract_fields_from_snapshot
+    def snapshot_to_record(snapshot: fs.firestore.DocumentSnapshot) -> FIKLRecord | None:
+        if (document_dict := snapshot.to_dict()) is None:
+            return None
 
+        path = snapshot.reference.path
+        values = local_values(document_dict, local_fields)
+        document_dict["_path"] = path
 
-def add_order_by_clauses(query: fs.firestore.Query,
-                         fikl_query: FIKLQuery) -> fs.firestore.Query:
-    """
-    Adds the order by clauses to the query.
-
-    Returns:
-        firestore.Query: The query with the order by clauses added.
-    """
-    if "order" in fikl_query and fikl_query["order"] is not None:
-        remote_orders = [where for where in fikl_query["order"]
-                         if where["local"] is False]
-        for order in remote_orders:
-            direction = "ASCENDING" if order["direction"] == "asc" else "DESCENDING"
-            query = query.order_by(
-                order["property"], direction=direction)
-        return query
-
-    return query
+        if requested_fields != "*":
+            document_dict = extract_fields(document_dict, requested_fields)
 
+        return FIKLRecord(path, document_dict, values)
 
-def add_where_clauses(query: fs.firestore.Query,
-                      fikl_query: FIKLQuery) -> fs.firestore.Query:
-    """
-    Adds the where clauses to the query.
-
-    Returns:
-        firestore.Query: The query with the where clauses added.
-    """
-    if fikl_query["where"] is not None:
-        remote_wheres = [where for where in fikl_query["where"]
-                         if where["local"] is False]
-        for where in remote_wheres:
-            corrected_operator = "not-in" if where["operator"] == "not_in" else where["operator"]
-
-            if corrected_operator == "like":
-                error_message = ("The 'like' operator is not supported by Firestore. "
-                                 "Use local evaluation by placing ^ after the property name. "
-                                 f"Did you mean {where['property']}^ ?")
-                raise QueryError(error_message)
+    return snapshot_to_record
 
-            field_filter = FieldFilter(
-                where["property"], corrected_operator, where["value"])
 
-            query = query.where(filter=field_filter)
-        return query
+def record_to_document(response: FIKLRecord | str):
+    """Returns the output document of a record, leaving the names of collections as they are."""
+    if isinstance(response, str):
+        return response
 
-    return query
+    return response.document
 
 
-def execute_query(fikl_query: FIKLQuery) -> list[fs.firestore.DocumentSnapshot] | int:
+def execute_query(fikl_query: FIKLQuery) -> list[FIKLRecord] | int:
     """
     Determines the appropraite query function to execute based on the query type.
 
@@ -326,6 +606,8 @@ def execute_query(fikl_query: FIKLQuery) -> list[fs.firestore.DocumentSnapshot]
     def fn_for_query(fikl_query: FIKLQuery):
         match fikl_query["query_type"]:
             case FIKLQueryType.SELECT:
+                if fikl_query.get("sketches"):
+                    return execute_sketch_query
                 return execute_select_query
             case FIKLQueryType.UPDATE:
                 return execute_update_query
@@ -335,6 +617,30 @@ def execute_query(fikl_query: FIKLQuery) -> list[fs.firestore.DocumentSnapshot]
                 return execute_show_query
             case FIKLQueryType.INSERT:
                 return execute_insert_query
+            case FIKLQueryType.EXPLAIN:
+                return execute_explain_query
+            case FIKLQueryType.EXPORT:
+                return execute_export_query
+            case FIKLQueryType.IMPORT:
+                return execute_import_query
+            case FIKLQueryType.ANALYZE:
+                return execute_analyze_query
+            case FIKLQueryType.INDEXES:
+                return execute_indexes_query
+            case FIKLQueryType.CREATE_INDEX:
+                return execute_create_index_query
+            case FIKLQueryType.DECLARE:
+                return execute_declare_query
+            case FIKLQueryType.FETCH:
+                return execute_fetch_query
+            case FIKLQueryType.CLOSE:
+                return execute_close_query
+            case FIKLQueryType.BEGIN_SNAPSHOT:
+                return execute_begin_snapshot_query
+            case FIKLQueryType.END_SNAPSHOT:
+                return execute_end_snapshot_query
+            case FIKLQueryType.USE:
+                return execute_use_query
             case _:
                 return lambda x: []
 
@@ -343,75 +649,144 @@ def execute_query(fikl_query: FIKLQuery) -> list[fs.firestore.DocumentSnapshot]
     return query_fn(fikl_query)
 
 
-def execute_delete_query(fikl_query: FIKLUpdateQuery) -> int:
+def execute_delete_query(fikl_query: FIKLUpdateQuery) -> int | FIKLWriteResult:
     """
     Executes a delete query against the Firestore database.
 
     Returns:
         int: The number of records deleted.
+        FIKLWriteResult: The number of records deleted and failed, when any failed.
     """
     docs = execute_select_query(fikl_query)
-
-    count = 0
-
-    if len(docs) > 0:
-        with typer.progressbar(label="Deleting", length=len(docs)) as progress:
-            for doc in docs:
-                try:
-                    doc.reference.delete()
-                    count += 1
-                    progress.update(1)
-                except Exception:
-                    pass
-
-    return count
+    return execute_writes("Deleting", [{"operation": "delete", "path": doc.path, "data": None}
+                                       for doc in docs])
 
 
-def execute_update_query(fikl_query: FIKLUpdateQuery) -> int:
+def execute_update_query(fikl_query: FIKLUpdateQuery) -> int | FIKLWriteResult:
     """
     Executes an update query against the Firestore database.
 
     Returns:
         int: The number of records updated.
+        FIKLWriteResult: The number of records updated and failed, when any failed.
     """
     docs = execute_select_query(fikl_query)
-
-    count = 0
     new_values = merge_setters(fikl_query["set"])
+    return execute_writes("Updating", [{"operation": "update", "path": doc.path,
+                                        "data": new_values} for doc in docs])
 
-    if len(docs) > 0:
-        with typer.progressbar(label="Updating", length=len(docs)) as progress:
-            for doc in docs:
-                try:
-                    doc.reference.update(new_values)
-                    count += 1
-                    progress.update(1)
-                except Exception:
-                    pass
 
-    return count
+def execute_writes(label: str, writes: list[FIKLWrite],
+                   batch_size: int = 1) -> int | FIKLWriteResult:
+    """
+    Applies the writes of a mass mutation or insert through the write scheduler, showing its
+    progress.
+
+    Returns:
+        int: The number of writes applied.
+        FIKLWriteResult: The number of writes applied and failed, when any failed.
+    """
+    if len(writes) == 0:
+        return 0
+
+    with typer.progressbar(label=label, length=len(writes)) as progress:
+        result = schedule_writes(current_backend(), writes, progress.update, batch_size)
+
+    return write_result(result)
+
 
+def write_result(result: FIKLWriteResult) -> int | FIKLWriteResult:
+    """The number of writes applied, or the full result of the writes when any failed."""
+    return result if result["failed"] else result["count"]
 
-def execute_insert_query(fikl_query: FIKLInsertQuery) -> int:
+
+def execute_insert_query(fikl_query: FIKLInsertQuery) -> int | FIKLWriteResult:
     """
     Inserts a document into the Firestore database.
 
     Returns:
         int: The number of documents inserted.
+        FIKLWriteResult: The number of documents inserted and failed, when rows failed.
     """
+    if fikl_query.get("rows"):
+        return execute_insert_rows_query(fikl_query)
+
     new_values = merge_setters(fikl_query["set"])
 
     dicts = [expand_key({}, key, value)
              for key, value in new_values.items()]
     merged_dict = merge_dicts(dicts)
 
-    client = fs.client()
-
-    client.collection(fikl_query["subject"]).add(
-        merged_dict, document_id=fikl_query["identifier"])
+    current_backend().add(fikl_query["subject"], merged_dict, fikl_query["identifier"])
     return 1
 
 
+def execute_insert_rows_query(fikl_query: FIKLInsertQuery) -> int | FIKLWriteResult:
+    """
+    Inserts many documents into the Firestore database through the write scheduler,
+    committing them in atomic batches. The document ids are taken from the identifier column,
+    when there is one.
+
+    Returns:
+        int: The number of documents inserted.
+        FIKLWriteResult: The number of documents inserted and failed, when any failed.
+    """
+    backend = current_backend()
+    identifier = fikl_query["identifier"]
+
+    def row_to_write(row: list) -> FIKLWrite:
+        new_values = merge_setters(row)
+        document_id = None
+        if identifier is not None:
+            if new_values.get(identifier) is None:
+                raise QueryError(f"A row has no value for {identifier}")
+            document_id = str(new_values.pop(identifier))
+
+        dicts = [expand_key({}, key, value) for key, value in new_values.items()]
+        return {
+            "operation": "create",
+            "path": backend.document_path(fikl_query["subject"], document_id),
+            "data": merge_dicts(dicts)
+        }
+
+    return execute_writes("Inserting", [row_to_write(row) for row in fikl_query["rows"]],
+                          WRITE_BATCH_SIZE)
+
+
+def execute_import_query(fikl_query: FIKLImportQuery) -> int | FIKLWriteResult:
+    """
+    Imports the records of an NDJSON or CSV file into a collection. Dotted keys are expanded
+    into nested fields and the records are written in batches through the write scheduler as
+    they are read.
+
+    Returns:
+        int: The number of documents imported.
+        FIKLWriteResult: The number of documents imported and failed, when any failed.
+    """
+    backend = current_backend()
+    identifier = fikl_query["identifier"]
+
+    def record_to_write(record: dict) -> FIKLWrite:
+        document_id = None
+        if identifier is not None:
+            if record.get(identifier) is None:
+                raise QueryError(f"A record has no value for {identifier}: {record}")
+            # an exported _path identifies the document by its last segment
+            document_id = str(record.pop(identifier)).rsplit("/", 1)[-1]
+        record.pop("_path", None)
+
+        dicts = [expand_key({}, key, value) for key, value in record.items()]
+        return {
+            "operation": "create" if document_id is None else "set",
+            "path": backend.document_path(fikl_query["subject"], document_id),
+            "data": merge_dicts(dicts)
+        }
+
+    records = read_records(os.path.expanduser(fikl_query["source"]))
+    return write_result(schedule_writes(backend, map(record_to_write, records),
+                                        batch_size=WRITE_BATCH_SIZE))
+
+
 def execute_show_query(fikl_query: FIKLSelectQuery) -> list[str]:
     """
     Fetches the list of root level collections from the Firestore database.
@@ -419,163 +794,646 @@ def execute_show_query(fikl_query: FIKLSelectQuery) -> list[str]:
     Returns:
         list[str]: A list of collections names.
     """
-    client = fs.client()
-    colls = []
+    collections = current_backend().collections(fikl_query["subject"])
+    record_collections(fikl_query["subject"], collections)
+    return collections
+
 
-    collections_fn = client.collections if fikl_query["subject"] is None else client.document(
-        fikl_query["subject"]).collections
+def execute_export_query(fikl_query: FIKLExportQuery) -> dict:
+    """
+    Exports a collection, and optionally its subcollections, to sharded NDJSON files. An
+    incremental export only exports the documents that changed since its last run.
 
-    for coll in collections_fn():
-        colls.append(coll.id)
-    return colls
+    Returns:
+        dict: The number of documents and collections exported and the path of the manifest.
+    """
+    if fikl_query["subject_type"] == FIKLSubjectType.DOCUMENT:
+        raise QueryError("Only collections and collection groups can be exported")
 
+    dest = os.path.join(os.path.abspath(os.path.expanduser(fikl_query["output"])), MANIFEST_FILE)
+    if fikl_query["incremental"] is not None:
+        if fikl_query["recursive"]:
+            raise QueryError("Incremental exports can not be recursive, as subcollections "
+                             "do not share a watermark")
+        manifest = export_incremental(current_backend(), fikl_query)
+        return {"count": manifest["exported"], "watermark": manifest["watermark"], "dest": dest}
 
-def like_to_regex(like: str) -> str:
-    """Converts a like clause to a regex clause."""
-    as_regex = like.replace("%", ".*?")
-    return f"^{as_regex}$"
+    manifest = export_collections(current_backend(), fikl_query)
+    return {
+        "count": manifest["documents"],
+        "collections": len(manifest["collections"]),
+        "dest": dest
+    }
 
 
 def local_compare(document: dict, prop: str, where: FIKLWhere) -> bool:
     """
     Compares the provided value with the provided filter.
     """
-    if prop not in document:
-        return False
-
-    value = document[prop]
-    match where['operator']:
-        case ">":
-            return value > where['value']
-        case ">=":
-            return value >= where['value']
-        case "<":
-            return value < where['value']
-        case "<=":
-            return value <= where['value']
-        case "!=":
-            return value != where['value']
-        case "==":
-            return value == where['value']
-        case "in":
-            return value in where['value']
-        case "not_in":
-            return value not in where['value']
-        case "array_contains":
-            return where['value'] in value
-        case "array_contains_any":
-            return pydash.every(where['value'], lambda v: v in value)
-        case "like":
-            regex = like_to_regex(where['value'])
-            return re.search(regex, value) is not None
-
-    return False
-
-
-def includes(document: dict, local_filters: list[FIKLWhere]) -> bool:
-    """
-    Determines if the provided document should be included in the results.
-    """
-    flat_dict = flatten(document)
-    return pydash.every(local_filters,
-                        lambda where: local_compare(flat_dict, where["property"], where))
-
-
-def filter_locally(records: list[fs.firestore.DocumentSnapshot],
-                   fikl_query: FIKLSelectQuery):
-    """Filters the list of records locally."""
-    if fikl_query["where"] is not None:
-        local_wheres = [
-            where for where in fikl_query["where"] if where["local"] is True]
-        return [doc for doc in records if includes(doc.to_dict(), local_wheres)]
+    return prop in document and compare(document[prop], where["operator"], where["value"])
+
+
+def includes(values: dict, local_filters: list[FIKLWhere]) -> bool:
+    """
+    Determines if the document with the provided flat values should be included in the results.
+    """
+    return all(local_compare(values, where["property"], where) for where in local_filters)
+
+
+def filter_locally(records: Iterable[FIKLRecord], plan: FIKLPlan):
+    """Filters the records locally, as they are consumed."""
+    if plan["local_where"]:
+        return (record for record in records if includes(record.values, plan["local_where"]))
 
     return records
 
 
-def cmp(left, right):
-    """Polyfill for cmp function."""
-    return (left > right) - (left < right)
+def sort_locally(records: Iterable[FIKLRecord], plan: FIKLPlan):
+    """Sorts the records locally."""
+    if plan["local_order"]:
+        return sort_records(records, plan["local_order"])
+    return records
 
 
-def multikeysort(items, columns):
-    """Sorts the provided list of items by the provided list of columns."""
-    comparers = [
-        ((i(col[1:].strip()), -1) if col.startswith('-')
-         else (i(col.strip()), 1))
-        for col in columns
-    ]
+def limit_locally(records: Iterable[FIKLRecord], fikl_query: FIKLQuery):
+    """
+    Limits the records locally, as clauses evaluated locally, samples and queries of many
+    databases may return more records than the limit.
+    """
+    if fikl_query.get("limit") is not None:
+        return islice(records, fikl_query["limit"])
+    return records
 
-    def comparer(left: fs.firestore.DocumentSnapshot,
-                 right: fs.firestore.DocumentSnapshot):
-        left_dict = left.to_dict()
-        right_dict = right.to_dict()
-        comparer_iter = (
-            cmp(fn(left_dict), fn(right_dict)) * mult
-            for fn, mult in comparers
-        )
-        return next((result for result in comparer_iter if result), 0)
-    return sorted(items, key=cmp_to_key(comparer))
 
+def scan_batches(backend: Backend, fikl_query: FIKLSelectQuery, plan: FIKLPlan,
+                 last=None) -> Iterator[list[fs.firestore.DocumentSnapshot]]:
+    """Lazily reads the pages of matching documents, using start_after."""
+    while True:
+        batch: list[fs.firestore.DocumentSnapshot] = []
+        batch.extend(backend.stream(scan_for(fikl_query, plan, limit=fikl_query["page"],
+                                             start_after=last)))
 
-def order_by_as_sort_column(order_by: FIKLOrderBy) -> str:
-    """Creates a new sort column from the provided order by clause."""
-    return order_by["property"] if order_by["direction"] == "asc" else f"-{order_by['property']}"
+        if len(batch) == 0:
+            break
+        yield batch
 
+        last = batch[-1]
 
-def sort_locally(records: list[fs.firestore.DocumentSnapshot], fikl_query: FIKLSelectQuery):
-    """Sorts the list of records locally."""
-    if "order" in fikl_query and fikl_query["order"] is not None:
-        sorters = [order_by_as_sort_column(order_by)
-                   for order_by in fikl_query["order"]]
-        return multikeysort(records, sorters)
-    return records
 
+def scan_pages(backend: Backend, fikl_query: FIKLSelectQuery,
+               plan: FIKLPlan) -> Iterator[fs.firestore.DocumentSnapshot]:
+    """Lazily reads every matching document one page at a time, using start_after."""
+    return chain.from_iterable(scan_batches(backend, fikl_query, plan))
 
-def execute_select_query(fikl_query: FIKLSelectQuery) -> list[fs.firestore.DocumentSnapshot]:
+
+def read_paths(path: str) -> list[str]:
     """
-    Executes a select query against the Firestore database.
+    Reads a file of document paths, one per line. Blank lines and lines that start with # are
+    skipped.
 
     Returns:
-        list: A list of documents that match the query.
+        list: The document paths.
     """
+    with open(os.path.expanduser(path), "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
 
-    client = fs.client()
 
-    def execute_collection_query(query: fs.firestore.Query) -> list[fs.firestore.DocumentSnapshot]:
-        query = add_where_clauses(query, fikl_query)
-        query = add_order_by_clauses(query, fikl_query)
+def read_documents(backend: Backend, paths: list[str],
+                   fields: list[str] | None) -> Iterator[fs.firestore.DocumentSnapshot]:
+    """
+    Lazily reads the documents of a list of paths, in the order of the list, with a get_all
+    call for every DOCUMENTS_BATCH_SIZE paths and up to DOCUMENTS_WORKERS calls in flight.
+    The paths of the documents that do not exist are reported once every document was read.
 
-        results: list[fs.firestore.DocumentSnapshot] = []
+    Yields:
+        DocumentSnapshot: The snapshot of every document that exists.
+    """
+    def read_batch(batch: list[str]) -> list:
+        snapshots = {snapshot.reference.path: snapshot
+                     for snapshot in backend.get_all(batch, fields)}
+        return [snapshots.get(path) for path in batch]
+
+    missing = []
+    with ThreadPoolExecutor(max_workers=DOCUMENTS_WORKERS) as pool:
+        pending = deque()
+        batches = batched(dict.fromkeys(paths), DOCUMENTS_BATCH_SIZE)
+        while (batch := next(batches, None)) is not None or pending:
+            if batch is not None:
+                pending.append((batch, pool.submit(read_batch, batch)))
+                if len(pending) < DOCUMENTS_WORKERS:
+                    continue
+
+            batch, future = pending.popleft()
+            for path, snapshot in zip(batch, future.result()):
+                if snapshot is None or not snapshot.exists:
+                    missing.append(path)
+                else:
+                    yield snapshot
+
+    if missing:
+        typer.echo(f"{len(missing)} of the documents do not exist: {', '.join(missing)}",
+                   err=True)
+
+
+def read_sample(backend: Backend, fikl_query: FIKLSelectQuery,
+                plan: FIKLPlan) -> Iterator[fs.firestore.DocumentSnapshot]:
+    """
+    Lazily reads the sample of a query. Once every sampled document was read, the size of the
+    sample is reported, as the results of the query are estimates. The size is reported before
+    the last document of a full sample is yielded, as a limit stops reading at that document.
 
-        if "limit" in fikl_query and fikl_query["limit"] is not None:
-            query = query.limit(fikl_query["limit"])
-            results.extend(query.get())
+    Yields:
+        DocumentSnapshot: The sampled documents.
+    """
+    # the limit caps the size of the sample, not the documents that it is drawn from
+    scan = scan_for(fikl_query, plan, limit=None)
+    size, total = sample_size(backend, scan, fikl_query["sample"])
+    if plan["limit"] is not None:
+        size = min(size, plan["limit"])
+
+    def report(sampled: int):
+        of_total = "" if total is None else f" of {total}"
+        typer.echo(f"The results are estimates from a sample of {sampled}{of_total} documents",
+                   err=True)
+
+    sampled = 0
+    snapshots = backend.stream({**scan, "limit": size}) if total is not None and size >= total \
+        else sample_snapshots(backend, scan, size)
+    for snapshot in snapshots:
+        sampled += 1
+        if sampled == size:
+            report(sampled)
+        yield snapshot
+
+    if sampled < size:
+        report(sampled)
+
+
+def stream_select_query(fikl_query: FIKLSelectQuery) -> Iterator[FIKLRecord]:
+    """
+    Executes a select query against the current backend. Documents are read from the
+    backend as they are consumed, unless they have to be sorted locally, and each
+    snapshot is converted to a record once.
+
+    Returns:
+        Iterator: The records of the documents that match the query.
+    """
+    backend = current_backend()
+
+    def run(plan: FIKLPlan) -> Iterator[FIKLRecord]:
+        to_record = snapshot_to_record_fn(fikl_query, plan)
+
+        if fikl_query.get("paths") is not None or fikl_query.get("paths_file") is not None:
+            paths = fikl_query["paths"] or read_paths(fikl_query["paths_file"])
+            snapshots = read_documents(backend, paths, plan["projection"])
+        elif fikl_query["subject_type"] == FIKLSubjectType.DOCUMENT:
+            snapshots = iter([backend.get(fikl_query["subject"], plan["projection"])])
         elif "page" in fikl_query and fikl_query["page"] is not None:
-            batch_query = query.limit(fikl_query["page"])
-            last = None
+            snapshots = scan_pages(backend, fikl_query, plan)
+        elif fikl_query.get("sample") is not None:
+            snapshots = read_sample(backend, fikl_query, plan)
+        else:
+            snapshots = backend.stream(scan_for(fikl_query, plan))
 
-            while True:
-                batch: list[fs.firestore.DocumentSnapshot] = []
+        records = (record for record in map(to_record, snapshots) if object_exists(record))
+        records = limit_locally(sort_locally(filter_locally(records, plan), plan), fikl_query)
+        if (join := fikl_query.get("join")) is not None:
+            return join_records(backend, records, join, split_fields(fikl_query["fields"], join)[1])
+        return records
 
-                if last is None:
-                    batch.extend(batch_query.get())
-                else:
-                    batch.extend(batch_query.start_after(last).get())
+    return with_index_fallback(fikl_query, backend, run)
+
+
+def log_results(backend: Backend, fikl_query: FIKLQuery, plan: FIKLPlan,
+                results: Iterable) -> Iterator:
+    """
+    Logs the shape of a query for the index advisor once the backend has answered it, or
+    rejected it.
+
+    Yields:
+        The results of the query.
+    """
+    logged = False
+    try:
+        for result in results:
+            if not logged:
+                logged = True
+                log_query(backend, fikl_query, plan)
+            yield result
+    except exceptions.FailedPrecondition as error:
+        if not logged:
+            log_query(backend, fikl_query, plan, error)
+        raise
+
+    if not logged:
+        log_query(backend, fikl_query, plan)
+
+
+def with_index_fallback(fikl_query: FIKLQuery, backend: Backend,
+                        run: Callable[[FIKLPlan], Iterable]) -> Iterator:
+    """
+    Runs the plan of a query. When the backend rejects the query because an index is missing,
+    before any result was produced, the query is planned again for single-field indexes.
 
-                results.extend(batch)
-                if len(batch) == 0:
-                    break
+    Yields:
+        The results of the query.
+    """
+    plan = plan_query(fikl_query, backend)
+    started = False
+    try:
+        for result in log_results(backend, fikl_query, plan, run(plan)):
+            started = True
+            yield result
+    except exceptions.FailedPrecondition as error:
+        if started or not remember_fallback(backend, fikl_query, error):
+            raise
+        plan = plan_query(fikl_query, backend)
+        yield from log_results(backend, fikl_query, plan, run(plan))
 
-                last = batch[-1]
+
+def execute_select_query(fikl_query: FIKLSelectQuery) -> list[FIKLRecord]:
+    """
+    Executes a select query against the current backend.
+
+    Returns:
+        list: A list of records of the documents that match the query.
+    """
+    return list(stream_select_query(fikl_query))
+
+
+def sketch_records(fikl_query: FIKLSelectQuery, records: Iterable[FIKLRecord]) -> list:
+    """
+    Summarizes the fields of the approximate aggregates of a query with sketches. Fields that
+    are missing, null or hold a map are skipped.
+
+    Returns:
+        list: A sketch for every approximate aggregate of the query.
+    """
+    sketches = fikl_query["sketches"]
+    summaries = [new_sketch(sketch) for sketch in sketches]
+    for record in records:
+        for sketch, summary in zip(sketches, summaries):
+            if sketch["property"] in record.values:
+                add_value(summary, record.values[sketch["property"]])
+    return summaries
+
+
+def execute_sketch_query(fikl_query: FIKLSelectQuery) -> list[FIKLRecord]:
+    """
+    Executes a select query of approximate aggregates, which summarizes the documents with
+    sketches as they are read, in constant memory. When the backend partitions the scan, the
+    partitions are summarized in parallel, up to SKETCH_WORKERS at once, and their sketches
+    are merged. A limit applies to the whole scan, so a limited query is not partitioned.
+
+    Returns:
+        list: A single record, holding the answer of every approximate aggregate.
+    """
+    for sketch in fikl_query["sketches"]:
+        if sketch["quantile"] is not None and not 0 <= sketch["quantile"] <= 1:
+            raise QueryError(f"The quantile of {sketch_label(sketch)} must be between 0 and 1")
+
+    backend = current_backend()
+    plan = plan_query(fikl_query, backend)
+    if fikl_query.get("sample") is not None or fikl_query.get("limit") is not None \
+            or plan["remote_where"] or plan["remote_order"] \
+            or not backend.supports(Capability.PARTITIONING):
+        summaries = sketch_records(fikl_query, stream_select_query(fikl_query))
+    else:
+        to_record = snapshot_to_record_fn(fikl_query, plan)
+
+        def sketch_partition(scan: FIKLScan) -> list:
+            records = (record for record in map(to_record, backend.stream(scan))
+                       if object_exists(record))
+            return sketch_records(fikl_query, filter_locally(records, plan))
+
+        scans = backend.partitions(scan_for(fikl_query, plan, limit=None), SKETCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=SKETCH_WORKERS) as pool:
+            partitions = list(pool.map(sketch_partition, scans))
+        summaries = [reduce(lambda merged, summary: merged.merge(summary), merging)
+                     for merging in zip(*partitions)]
+        log_query(backend, fikl_query, plan)
+
+    return [FIKLRecord(fikl_query["subject"], {
+        sketch_label(sketch): sketch_result(sketch, summary)
+        for sketch, summary in zip(fikl_query["sketches"], summaries)}, {})]
+
+
+def execute_checkpointed_query(fikl_query: FIKLSelectQuery, checkpoint: FIKLCheckpoint) -> str:
+    """
+    Executes a paged select query, appending each page to the output file and saving the
+    checkpoint after every page. When the checkpoint has a cursor, the output file is truncated
+    to the saved offset and the query continues after the cursor.
+
+    Returns:
+        str: The path of the output file.
+    """
+    if not can_checkpoint(fikl_query):
+        raise QueryError("Checkpoints require a select query from a collection that uses "
+                         "page and output to a file, without join, group by, count or distinct")
+
+    backend = current_backend()
+    plan = plan_query(fikl_query, backend)
+    if plan["local_order"]:
+        raise QueryError("Checkpoints require the results to be ordered by Firestore, "
+                         "remove the ^ from the order by")
+
+    to_record = snapshot_to_record_fn(fikl_query, plan)
+    output_format = format_as(fikl_query)
+    dest = checkpoint["dest"] or os.path.abspath(os.path.expanduser(fikl_query["output"]))
+
+    # the order by values of the last document are read along with the page, to be saved
+    orders = [order["property"] for order in plan["remote_order"]
+              if order["property"] != NAME_FIELD]
+    if plan["projection"] is not None:
+        plan = {**plan, "projection": list(dict.fromkeys(plan["projection"] + orders))}
+    last = resume_position(backend, checkpoint)
+
+    with open(dest, "r+b" if checkpoint["dest"] is not None else "wb") as file:
+        if checkpoint["dest"] is None:
+            file.write(output_opening(output_format).encode("utf-8"))
+            checkpoint.update(dest=dest, offset=file.tell())
         else:
-            results.extend(query.get())
+            file.truncate(checkpoint["offset"])
+            file.seek(checkpoint["offset"])
+
+        for batch in scan_batches(backend, fikl_query, plan, last):
+            records = filter_locally((record for record in map(to_record, batch)
+                                      if object_exists(record)), plan)
+            documents = [record.document for record in records]
+
+            file.write(output_chunk(documents, output_format, checkpoint["count"] == 0,
+                                    checkpoint.setdefault("columns", [])).encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+
+            checkpoint.update(cursor=batch[-1].reference.path,
+                              after=cursor_values(batch[-1], orders), offset=file.tell(),
+                              count=checkpoint["count"] + len(documents))
+            save_checkpoint(checkpoint)
+
+        file.write(output_closing(output_format, checkpoint["count"]).encode("utf-8"))
+
+    return dest
+
+
+def cursor_values(snapshot, fields: list[str]) -> dict[str, FIKLCursorValue] | None:
+    """
+    Converts the order by values of the last document of a page to the values that are saved
+    in the checkpoint.
+
+    Returns:
+        dict: The values keyed by field, or None when a value can not be saved.
+    """
+    data = snapshot.to_dict() or {}
+    try:
+        return {field: encode_cursor_value(lookup(data, field)[1]) for field in fields}
+    except ValueError:
+        return None
+
+
+def resume_position(backend: Backend, checkpoint: FIKLCheckpoint):
+    """
+    Works out where a checkpointed query resumes: after the saved order by values and path of
+    the last document that was read. Checkpoints without values, as their values could not be
+    saved, resume after the last document as it is now.
+
+    Returns:
+        The start_after of the next page, or None to start from the first page.
+    """
+    if checkpoint["cursor"] is None:
+        return None
+    if (after := checkpoint.get("after")) is None:
+        return backend.get(checkpoint["cursor"])
+
+    position = {NAME_FIELD: checkpoint["cursor"]}
+    for field, value in after.items():
+        assign(position, field, decode_cursor_value(value))
+    return position
+
+
+def execute_count_query(fikl_query: FIKLSelectQuery) -> int | None:
+    """
+    Counts the matching documents with an aggregation query when the backend supports it.
+
+    Returns:
+        int: The number of matching documents, or None if the count can not be pushed down.
+    """
+    backend = current_backend()
+    plan = plan_query(fikl_query, backend)
+
+    if plan["aggregate"] != "count":
+        return None
+
+    try:
+        count = backend.count(scan_for(fikl_query, plan))
+    except exceptions.FailedPrecondition as error:
+        log_query(backend, fikl_query, plan, error)
+        if not remember_fallback(backend, fikl_query, error):
+            raise
+        return execute_count_query(fikl_query)
+
+    log_query(backend, fikl_query, plan)
+    return count
+
+
+def execute_analyze_query(fikl_query: FIKLAnalyzeQuery) -> FIKLCollectionStats:
+    """
+    Works out and stores the statistics of a collection, which the planner uses to estimate
+    the cost of queries.
+
+    Returns:
+        FIKLCollectionStats: The statistics of the collection.
+    """
+    if fikl_query["subject_type"] == FIKLSubjectType.DOCUMENT:
+        raise QueryError("Only collections and collection groups can be analyzed")
+
+    backend = current_backend()
+    stats = analyze_collection(backend, fikl_query["subject"], fikl_query["subject_type"],
+                               fikl_query["sample"])
+    save_stats(backend, stats)
+    return stats
 
-        return sort_locally(filter_locally(results, fikl_query), fikl_query)
 
-    match fikl_query["subject_type"]:
-        case FIKLSubjectType.COLLECTION_GROUP:
-            return execute_collection_query(client.collection_group(fikl_query["subject"]))
-        case FIKLSubjectType.COLLECTION:
-            return execute_collection_query(client.collection(fikl_query["subject"]))
-        case FIKLSubjectType.DOCUMENT:
-            return [client.document(fikl_query["subject"]).get()]
+def execute_indexes_query(fikl_query: FIKLIndexesQuery) -> FIKLIndexes | dict:
+    """
+    Suggests the composite indexes that the logged queries of the database need. When a file
+    is given, the suggestions are added to the indexes that it declares.
+
+    Returns:
+        FIKLIndexes: The suggested indexes, as the contents of a firestore.indexes.json file.
+        dict: The number of indexes that were added and the path of the file.
+    """
+    backend = current_backend()
+    if backend.scope() is None:
+        raise QueryError(f"Indexes are not suggested for the {backend.name} backend")
+
+    if fikl_query["output"] is None:
+        return {"indexes": suggest_indexes(backend), "fieldOverrides": []}
+
+    declared = read_indexes(fikl_query["output"])
+    suggested = suggest_indexes(backend, declared["indexes"])
+    declared["indexes"] = declared["indexes"] + suggested
+    return {"count": len(suggested), "dest": write_indexes(fikl_query["output"], declared)}
+
+
+def execute_create_index_query(fikl_query: FIKLLocalIndexQuery) -> dict:
+    """
+    Builds the local indexes of a field of a collection, ahead of the queries that filter or
+    order by it. The indexes are kept up to date as documents are written.
+
+    Returns:
+        dict: The collection and field that were indexed, and the number of indexed documents.
+    """
+    backend = current_backend()
+    if not backend.supports(Capability.LOCAL_INDEXES):
+        raise QueryError(f"Local indexes are not supported by the {backend.name} backend")
+
+    return {
+        "collection": fikl_query["subject"],
+        "field": fikl_query["field"],
+        "count": backend.create_index(fikl_query["subject"], fikl_query["field"])
+    }
+
+
+def execute_declare_query(fikl_query: FIKLCursorQuery) -> dict:
+    """
+    Declares a cursor for a select query. Nothing is read until documents are fetched, which
+    reads them a page at a time, using start_after, with pages the size of the fetch.
+
+    Returns:
+        dict: The name of the cursor.
+    """
+    query: FIKLSelectQuery = fikl_query["query"]
+    if query["query_type"] != FIKLQueryType.SELECT \
+            or query["subject_type"] == FIKLSubjectType.DOCUMENT or not can_stream(query):
+        raise QueryError("Cursors require a select query from a collection, without group "
+                         "by, count, distinct or output")
+
+    execute_close_query(fikl_query)
+    paged: FIKLSelectQuery = {**query, "limit": None, "page": 1,
+                              "read_time": read_time_for(query)}
+    CURSOR_HOLDER[fikl_query["cursor"]] = {
+        "query": paged,
+        "records": stream_select_query(paged),
+        "remaining": query.get("limit"),
+        "fetched": 0
+    }
+    return {"cursor": fikl_query["cursor"]}
+
+
+def execute_fetch_query(fikl_query: FIKLCursorQuery) -> list[FIKLRecord]:
+    """
+    Fetches the next documents of a cursor, reading no more pages than are needed.
+
+    Returns:
+        list: The records of the next documents, which is empty once the cursor is exhausted.
+    """
+    if (cursor := CURSOR_HOLDER.get(fikl_query["cursor"])) is None:
+        raise QueryError(f"There is no cursor named {fikl_query['cursor']}")
+
+    count = fikl_query["count"] if cursor["remaining"] is None \
+        else min(fikl_query["count"], cursor["remaining"])
+    # the page size is read again before every page, so the next pages match the fetch
+    cursor["query"]["page"] = max(count, 1)
+    try:
+        with current_backend().pinned(cursor["query"]["read_time"]):
+            records = list(islice(cursor["records"], count))
+    except Exception:
+        CURSOR_HOLDER.pop(fikl_query["cursor"], None)
+        raise
+
+    cursor["fetched"] += len(records)
+    if cursor["remaining"] is not None:
+        cursor["remaining"] -= len(records)
+    return records
+
+
+def execute_close_query(fikl_query: FIKLCursorQuery) -> dict:
+    """
+    Closes a cursor, releasing the stream that it holds.
+
+    Returns:
+        dict: The name of the cursor and the number of documents that were fetched from it.
+    """
+    if (cursor := CURSOR_HOLDER.pop(fikl_query["cursor"], None)) is None:
+        if fikl_query["query_type"] == FIKLQueryType.CLOSE:
+            raise QueryError(f"There is no cursor named {fikl_query['cursor']}")
+        return {"cursor": fikl_query["cursor"], "count": 0}
+
+    cursor["records"].close()
+    return {"cursor": fikl_query["cursor"], "count": cursor["fetched"]}
+
+
+def execute_begin_snapshot_query(fikl_query: FIKLSnapshotQuery) -> dict:
+    """
+    Pins every read of the session to a point in time, the time of the query or else the
+    current time, until the snapshot is ended. Queries then read the same consistent state
+    of the database however they are paged or split, and writes are refused.
+
+    Returns:
+        dict: The point in time that the reads are pinned to.
+    """
+    backend = current_backend()
+    if not backend.supports(Capability.SNAPSHOTS):
+        raise QueryError(f"Snapshots are not supported by the {backend.name} backend")
+
+    read_time = fikl_query["read_time"] or datetime.datetime.now(datetime.timezone.utc)
+    SNAPSHOT_HOLDER["read_time"] = read_time
+    return {"snapshot": read_time.isoformat()}
+
+
+def execute_end_snapshot_query(_fikl_query: FIKLSnapshotQuery) -> dict:
+    """
+    Stops pinning the reads of the session, queries read the latest data again.
+
+    Returns:
+        dict: The point in time that the reads were pinned to.
+    """
+    read_time, SNAPSHOT_HOLDER["read_time"] = SNAPSHOT_HOLDER["read_time"], None
+    return {"snapshot": None if read_time is None else read_time.isoformat()}
+
+
+def execute_use_query(fikl_query: FIKLUseQuery) -> dict:
+    """
+    Switches the databases that the session queries. The clients of the databases are kept
+    in a pool, so switching back to a database reuses its client.
+
+    Returns:
+        dict: The databases that the session queries.
+    """
+    return {"databases": use_databases(fikl_query["databases"])}
+
+
+def execute_explain_query(fikl_query: FIKLQuery) -> dict:
+    """
+    Describes how the explained query would be executed, without executing it.
+
+    Returns:
+        dict: The plan of the explained query.
+    """
+    backend = current_backend()
+    plan = plan_query(fikl_query["query"], backend)
+    join = fikl_query["query"].get("join")
+
+    return {
+        "backend": plan["backend"],
+        "placement": "single_field_indexes" if plan["fallback"] else PLANNER_SETTINGS["placement"],
+        "capabilities": [capability.name for capability in type(backend.capabilities)
+                         if capability in backend.capabilities],
+        "remote": {
+            "where": plan["remote_where"],
+            "order": plan["remote_order"],
+            "fields": plan["projection"] if plan["projection"] is not None else "*",
+            "aggregate": plan["aggregate"],
+            "limit": plan["limit"]
+        },
+        "local": {
+            "where": plan["local_where"],
+            "order": plan["local_order"]
+        },
+        "sample": fikl_query["query"].get("sample"),
+        "join": None if join is None else {
+            **join, "lookup": "get_all" if join["key"] == NAME_FIELD else "in"
+        },
+        "estimate": plan["estimate"]
+    }
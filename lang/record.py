@@ -0,0 +1,198 @@
+"""
+This module provides the record that a document snapshot is materialized into.
+
+Each snapshot is decoded (to_dict) exactly once. The record keeps the document as it will be
+output along with the flat values of the fields that are filtered and sorted locally, so
+every later stage of a query reads the record rather than the snapshot.
+
+Records are sorted in memory while they fit in the memory budget of SORT_SETTINGS (in bytes).
+Beyond it, sorted runs of records are pickled to temporary files and merged as the sorted
+records are consumed, so that only the current record of every run is held in memory.
+"""
+# lang/record.py
+import heapq
+import io
+import pickle
+import tempfile
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from itertools import islice
+from typing import IO
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1.base_document import BaseDocumentReference
+
+from lang.backend import Descending, lookup, sort_value
+from lang.transformer import FIKLOrderBy
+
+SORT_SETTINGS = {"memory": 512 * 2**20}
+SORT_SAMPLE_SIZE = 100
+# a record takes about four times the size of its pickled form in memory
+SORT_MEMORY_FACTOR = 4
+
+
+class FIKLRecord:
+    """A document that has been read by a query."""
+    __slots__ = ("path", "document", "values")
+
+    def __init__(self, path: str, document: dict, values: dict):
+        self.path = path
+        self.document = document
+        self.values = values
+
+    def __repr__(self):
+        return f"FIKLRecord({self.path!r})"
+
+
+def local_values(data: dict, fields: Iterable[str]) -> dict:
+    """
+    Reads the values of the provided dotted fields, keyed by field path. Like a flattened
+    document, fields that are missing or hold a map are left out.
+
+    Returns:
+        dict: The values of the fields.
+    """
+    values = {}
+    for field in fields:
+        found, value = lookup(data, field)
+        if found and not isinstance(value, Mapping):
+            values[field] = value
+    return values
+
+
+class _RecordPickler(pickle.Pickler):
+    """
+    Pickles records to a run file. Timestamps are pickled as RFC 3339 to keep their
+    nanoseconds, and document references, which hold a client, are kept in memory.
+    """
+
+    def __init__(self, file: IO[bytes], references: list):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.references = references
+
+    def persistent_id(self, obj):
+        """Identifies the values that are not pickled as they are."""
+        if isinstance(obj, DatetimeWithNanoseconds):
+            return ("timestamp", obj.rfc3339())
+        if isinstance(obj, BaseDocumentReference):
+            self.references.append(obj)
+            return ("reference", len(self.references) - 1)
+        return None
+
+
+class _RecordUnpickler(pickle.Unpickler):
+    """Reads the records of a run file."""
+
+    def __init__(self, file: IO[bytes], references: list):
+        super().__init__(file)
+        self.references = references
+
+    def persistent_load(self, pid):
+        """Restores the values that were not pickled as they are."""
+        kind, value = pid
+        if kind == "timestamp":
+            return DatetimeWithNanoseconds.from_rfc3339(value)
+        return self.references[value]
+
+
+def dump_record(file: IO[bytes], record: FIKLRecord, references: list):
+    """Pickles a record on its own, so that no memo of earlier records is held."""
+    _RecordPickler(file, references).dump((record.path, record.document, record.values))
+
+
+def load_records(file: IO[bytes], references: list) -> Iterator[FIKLRecord]:
+    """
+    Reads the records of a run file, in the order that they were pickled.
+
+    Yields:
+        FIKLRecord: The records.
+    """
+    while True:
+        try:
+            yield FIKLRecord(*_RecordUnpickler(file, references).load())
+        except EOFError:
+            return
+
+
+def sort_key(orders: list[FIKLOrderBy]) -> Callable[[FIKLRecord], tuple]:
+    """Creates the function that orders records by the local values of the order by clauses."""
+    def key(record: FIKLRecord) -> tuple:
+        values = []
+        for order in orders:
+            value = sort_value(record.values.get(order["property"]))
+            values.append(Descending(value) if order["direction"] == "desc" else value)
+        return tuple(values)
+    return key
+
+
+def run_size(sample: list[FIKLRecord], memory: int) -> int:
+    """
+    Estimates how many records fit in the memory budget, from the pickled size of a sample.
+
+    Returns:
+        int: The number of records that are sorted in memory at a time.
+    """
+    if not sample:
+        return 1
+
+    file = io.BytesIO()
+    for record in sample:
+        dump_record(file, record, [])
+    return max(1, memory * len(sample) // (file.tell() * SORT_MEMORY_FACTOR))
+
+
+def spill_run(run: list[FIKLRecord], references: list) -> IO[bytes]:
+    """
+    Pickles a sorted run of records to a temporary file, which is deleted once it is closed.
+
+    Returns:
+        The file, positioned at its first record.
+    """
+    file = tempfile.TemporaryFile()
+    for record in run:
+        dump_record(file, record, references)
+    file.seek(0)
+    return file
+
+
+def merge_runs(files: list[IO[bytes]], run: list[FIKLRecord], references: list,
+               key: Callable[[FIKLRecord], tuple]) -> Iterator[FIKLRecord]:
+    """
+    Merges the spilled runs and the last run, which is still held in memory. The runs are
+    merged in the order that they were read, so records that sort the same keep their order.
+
+    Yields:
+        FIKLRecord: The sorted records.
+    """
+    try:
+        spilled = [load_records(file, references) for file in files]
+        yield from heapq.merge(*spilled, run, key=key)
+    finally:
+        for file in files:
+            file.close()
+
+
+def sort_records(records: Iterable[FIKLRecord], orders: list[FIKLOrderBy]) -> Iterable[FIKLRecord]:
+    """
+    Sorts records by the local values of the order by clauses, ordering mixed types the way
+    that Firestore does. Missing values sort as null. Records that do not fit in the memory
+    budget are spilled to temporary files in sorted runs, which are merged as they are read.
+
+    Returns:
+        Iterable: The sorted records, as a list when they were sorted in memory.
+    """
+    key = sort_key(orders)
+    records = iter(records)
+    run = list(islice(records, SORT_SAMPLE_SIZE))
+    size = run_size(run, SORT_SETTINGS["memory"])
+    files: list[IO[bytes]] = []
+    references: list = []
+
+    while True:
+        run.extend(islice(records, max(0, size - len(run))))
+        run.sort(key=key)
+        if (following := next(records, None)) is None:
+            break
+        files.append(spill_run(run, references))
+        run = [following]
+
+    return run if not files else merge_runs(files, run, references, key)
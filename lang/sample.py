@@ -0,0 +1,119 @@
+"""
+This module reads random samples of the documents of a query, for approximate answers.
+
+A sample of a collection is read with random seeks into the range of its document ids. Each
+seek reads the documents that follow a random id, in id order, so a sample of N documents
+costs about N document reads and SAMPLE_SEEKS queries, rather than a scan. The random
+ids are spread evenly between the first and the last id that match the query, which suits
+the random ids that Firestore generates as well as ids that share a prefix.
+
+A sample of a collection group is read from the start of each of its partitions.
+"""
+# lang/sample.py
+import bisect
+import math
+import os
+import random
+import string
+from collections.abc import Iterator
+
+from lang.backend import NAME_FIELD, Backend, Capability, FIKLScan
+from lang.stats import sample_scans
+from lang.transformer import FIKLSample, FIKLSubjectType
+
+SAMPLE_SEEKS = 16
+SAMPLE_ATTEMPTS = 4
+SAMPLE_KEY_LENGTH = 8
+# the characters that random ids are made of, in order: numbers, hexadecimal ids, the ids
+# that Firestore generates and, for any other id, every printable character but /
+SAMPLE_ALPHABETS = (string.digits,
+                    string.digits + "abcdef",
+                    string.digits + string.ascii_uppercase + string.ascii_lowercase,
+                    "".join(chr(code) for code in range(32, 127) if chr(code) != "/"))
+
+
+def sample_size(backend: Backend, scan: FIKLScan, sample: FIKLSample) -> tuple[int, int | None]:
+    """
+    Works out how many documents to sample, counting the documents that match the scan when
+    the backend counts them itself.
+
+    Returns:
+        tuple: The number of documents to sample, and the number of documents that match the
+        scan, or None when they were not counted.
+    """
+    total = backend.count(scan) if backend.supports(Capability.AGGREGATION) else None
+    if sample["percent"] is None:
+        return (sample["size"], total)
+
+    if total is None:
+        raise ValueError(f"A percentage can not be sampled from the {backend.name} backend, "
+                         "which does not count documents")
+    return (math.ceil(total * sample["percent"] / 100), total)
+
+
+def id_between(low: str, high: str, rng: random.Random) -> str:
+    """
+    Picks a random document id between two ids. After their common prefix, the next
+    SAMPLE_KEY_LENGTH characters of the ids are read as numbers in the base of the smallest
+    of the SAMPLE_ALPHABETS that holds them, and a random number between the two numbers is
+    written back as characters.
+
+    Returns:
+        str: The random id.
+    """
+    prefix = os.path.commonprefix([low, high])
+    rest = {char for key in (low, high) for char in key[len(prefix):][:SAMPLE_KEY_LENGTH]}
+    alphabet = next((alphabet for alphabet in SAMPLE_ALPHABETS if rest <= set(alphabet)),
+                    SAMPLE_ALPHABETS[-1])
+    base = len(alphabet)
+
+    def as_number(key: str) -> int:
+        number = 0
+        for char in key[len(prefix):][:SAMPLE_KEY_LENGTH].ljust(SAMPLE_KEY_LENGTH, alphabet[0]):
+            number = number * base + min(bisect.bisect_left(alphabet, char), base - 1)
+        return number
+
+    number = rng.randint(as_number(low), as_number(high))
+    chars = []
+    for _ in range(SAMPLE_KEY_LENGTH):
+        number, digit = divmod(number, base)
+        chars.append(alphabet[digit])
+    return prefix + "".join(reversed(chars))
+
+
+def sample_snapshots(backend: Backend, scan: FIKLScan, size: int,
+                     rng: random.Random | None = None) -> Iterator:
+    """
+    Reads a random sample of about size of the documents that match the scan. A document is
+    read once, however many seeks reach it.
+
+    Yields:
+        DocumentSnapshot: The sampled documents.
+    """
+    if scan["subject_type"] == FIKLSubjectType.COLLECTION_GROUP:
+        for partition in sample_scans(backend, scan, size):
+            yield from backend.stream(partition)
+        return
+
+    rng = rng or random.Random()
+    by_name = {**scan, "order": [{"property": NAME_FIELD, "direction": "asc", "local": False}],
+               "local_where": [], "local_order": [], "start_after": None}
+    first = next(iter(backend.stream({**by_name, "limit": 1})), None)
+    last = next(iter(backend.stream({**by_name, "limit": 1, "order": [
+        {"property": NAME_FIELD, "direction": "desc", "local": False}]})), None)
+    if first is None or last is None:
+        return
+
+    low, high = first.id, last.id
+    seen: set[str] = set()
+    per_seek = max(1, math.ceil(size / SAMPLE_SEEKS))
+    for _ in range(SAMPLE_SEEKS * SAMPLE_ATTEMPTS):
+        if len(seen) >= size:
+            return
+
+        seek = f"{scan['subject']}/{id_between(low, high, rng)}"
+        for snapshot in backend.stream({**by_name, "start_at": seek,
+                                        "limit": min(per_seek, size - len(seen))}):
+            if snapshot.reference.path not in seen:
+                seen.add(snapshot.reference.path)
+                yield snapshot
@@ -0,0 +1,211 @@
+"""
+This module provides the schema cache that powers tab completion in the REPL.
+
+The cache holds the names of collections and the field paths of documents, which are
+inferred by sampling SCHEMA_SAMPLE_SIZE documents of a collection. Entries are saved to disk
+and are refreshed in the background once they are older than SCHEMA_TTL seconds, so that
+completion never waits on the network.
+"""
+# lang/schema.py
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Mapping
+import functools
+from typing import TypedDict
+
+from lang.backend import Backend
+from lang.transformer import FIKLSubjectType, read_grammar
+
+SCHEMA_FILE = "~/.fikl/schema.json"
+SCHEMA_TTL = 3600.0
+SCHEMA_SAMPLE_SIZE = 20
+
+SUBJECT_KEYWORDS = {"from", "within", "into", "at"}
+SUBJECT_PATTERN = re.compile(r'\b(from|within|into|at)\s+(?:"([^"]+)"|(\w+))', re.IGNORECASE)
+NAME_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class FIKLSchemaEntry(TypedDict):
+    """Cached names along with when they were read."""
+    updated: float
+    names: list[str]
+
+
+class FIKLSchema(TypedDict):
+    """The cached collections (keyed by parent document) and fields (keyed by collection)."""
+    collections: dict[str, FIKLSchemaEntry]
+    fields: dict[str, FIKLSchemaEntry]
+
+
+def field_paths(data: Mapping, parent: str = "") -> list[str]:
+    """
+    Lists the dotted path of every field of a document, including the paths of maps.
+
+    Returns:
+        list: The field paths.
+    """
+    paths = []
+    for key, value in data.items():
+        path = f"{parent}.{key}" if parent else str(key)
+        paths.append(path)
+        if isinstance(value, Mapping):
+            paths.extend(field_paths(value, path))
+    return paths
+
+
+@functools.cache
+def grammar_keywords() -> list[str]:
+    """
+    Lists the keywords of the FIKL language.
+
+    Returns:
+        list: The keywords, in alphabetical order.
+    """
+    return sorted(set(re.findall(r'"([a-z][a-z_]*)"', read_grammar())))
+
+
+def as_name(name: str) -> str:
+    """Quotes a collection or field name unless the grammar accepts it without quotes."""
+    return name if NAME_PATTERN.fullmatch(name) else f'"{name}"'
+
+
+class SchemaCache:
+    """
+    The collections and fields of the database that a backend reads. Reads always return
+    straight away with what is cached, a refresh of missing or expired entries is started in
+    the background.
+    """
+
+    def __init__(self, backend: Backend, path: str | None = SCHEMA_FILE):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._refreshing: set[tuple[str, str]] = set()
+        self._scope = backend.scope() if path is not None else None
+        self._path = os.path.expanduser(path) if self._scope is not None else None
+        self._schema: FIKLSchema = self._load()
+
+    def _load(self) -> FIKLSchema:
+        """Reads the cached schema of the backend's database from disk."""
+        if self._path is not None and os.path.exists(self._path):
+            try:
+                with open(self._path, "r", encoding="utf-8") as file:
+                    if (schema := json.load(file).get(self._scope)) is not None:
+                        return schema
+            except (OSError, ValueError):
+                pass
+        return {"collections": {}, "fields": {}}
+
+    def _save(self):
+        """Writes the schema to disk, alongside the schemas of other databases."""
+        if self._path is None:
+            return
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        try:
+            with open(self._path, "r", encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            saved = {}
+
+        with self._lock:
+            saved[self._scope] = json.loads(json.dumps(self._schema))
+
+        temporary = f"{self._path}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(saved, file)
+        os.replace(temporary, self._path)
+
+    def _cached(self, kind: str, key: str) -> list[str]:
+        """Returns the cached names, refreshing them in the background when they expired."""
+        with self._lock:
+            entry = self._schema[kind].get(key)
+        if entry is None or time.time() - entry["updated"] > SCHEMA_TTL:
+            self.refresh(kind, key)
+        return [] if entry is None else entry["names"]
+
+    def _read(self, kind: str, key: str) -> list[str]:
+        """Reads the names from the backend."""
+        if kind == "collections":
+            return self.backend.collections(key or None)
+
+        scan = {"subject": key, "subject_type": FIKLSubjectType.COLLECTION,
+                "limit": SCHEMA_SAMPLE_SIZE}
+        paths = (field_paths(data) for snapshot in self.backend.stream(scan)
+                 if (data := snapshot.to_dict()) is not None)
+        return sorted({path for sample in paths for path in sample})
+
+    def record(self, kind: str, key: str, names: list[str]):
+        """Stores names that were read, e.g. by a `show collections` query."""
+        with self._lock:
+            self._schema[kind][key] = {"updated": time.time(), "names": sorted(names)}
+        self._save()
+
+    def refresh(self, kind: str, key: str, wait: bool = False):
+        """Reads the names again in the background, unless they are already being read."""
+        def run():
+            try:
+                self.record(kind, key, self._read(kind, key))
+            except Exception:  # pylint: disable=broad-exception-caught
+                # completion keeps using what is cached until the next refresh
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard((kind, key))
+
+        with self._lock:
+            if (kind, key) in self._refreshing:
+                return
+            self._refreshing.add((kind, key))
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def collections(self, parent: str = "") -> list[str]:
+        """The cached ids of the collections beneath a document, or at the root."""
+        return self._cached("collections", parent)
+
+    def fields(self, collection: str) -> list[str]:
+        """The cached field paths of the documents of a collection."""
+        return self._cached("fields", collection)
+
+    def completions(self, line: str, text: str) -> list[str]:
+        """
+        Completes the word that is being typed. Collections are completed after `from`,
+        `within`, `into` and `at`, otherwise keywords and the fields of the query's subject.
+
+        Returns:
+            list: The candidates that start with the text.
+        """
+        words = line.split()
+        if words and words[-1].lower() in SUBJECT_KEYWORDS:
+            candidates = [as_name(name) for name in self.collections()]
+        else:
+            candidates = list(grammar_keywords())
+            if (subject := SUBJECT_PATTERN.search(line)) is not None:
+                collection = subject.group(2) or subject.group(3)
+                if subject.group(1).lower() == "at":
+                    collection = collection.rsplit("/", 1)[0]
+                candidates += [as_name(path) for path in self.fields(collection)]
+
+        prefix = text.lstrip('"')
+        return [candidate for candidate in candidates
+                if candidate.startswith(text) or candidate.lstrip('"').startswith(prefix)]
+
+
+SCHEMA_HOLDER: dict[str, SchemaCache | None] = {"cache": None}
+
+
+def use_schema_cache(cache: SchemaCache | None):
+    """Sets the schema cache that completes queries and records what queries read."""
+    SCHEMA_HOLDER["cache"] = cache
+
+
+def record_collections(parent: str | None, names: list[str]):
+    """Records the collections that a `show collections` query listed."""
+    if (cache := SCHEMA_HOLDER["cache"]) is not None:
+        cache.record("collections", parent or "", names)
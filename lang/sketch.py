@@ -0,0 +1,229 @@
+"""
+This module provides the sketches behind the approximate aggregate functions.
+
+A sketch summarizes the values of a field in a fixed amount of memory, however many documents
+are read, and two sketches of disjoint sets of documents merge into the sketch of their union,
+so the partitions of a scan can be summarized in parallel:
+
+* approx_count_distinct counts the distinct values with a HyperLogLog of 2**SKETCH_PRECISION
+  registers, which has a standard error of about 1.04 / sqrt(2**SKETCH_PRECISION).
+* approx_quantile finds a quantile of the numbers with a KLL sketch, which keeps at most
+  about three times SKETCH_QUANTILE_SIZE numbers, each standing for a power of two of the
+  numbers that were read, with a rank error of about 1.7 / SKETCH_QUANTILE_SIZE.
+"""
+# lang/sketch.py
+import hashlib
+import math
+import random
+
+from lang import encoding
+from lang.transformer import FIKLSketch
+
+SKETCH_PRECISION = 14
+SKETCH_QUANTILE_SIZE = 200
+SKETCH_QUANTILE_SHRINK = 2 / 3
+
+
+class HyperLogLog:
+    """Estimates the number of distinct values that were added."""
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = SKETCH_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(2 ** precision)
+
+    def add(self, value):
+        """Adds a value, values are equal when they are encoded the same."""
+        key = encoding.dumps(value, compact=True).encode("utf-8")
+        hashed = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = hashed >> bits
+        if (rank := bits - (hashed & ((1 << bits) - 1)).bit_length() + 1) > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Merges the values of another sketch of the same precision into this sketch."""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> int:
+        """
+        Estimates the number of distinct values with the improved estimator of Ertl, which
+        is unbiased for small and large counts alike, without bias correction tables.
+
+        Returns:
+            int: The estimated number of distinct values.
+        """
+        size = len(self.registers)
+        bits = 64 - self.precision
+        counts = [0] * (bits + 2)
+        for register in self.registers:
+            counts[register] += 1
+        if counts[0] == size:
+            return 0
+
+        total = size * _tau(1 - counts[bits + 1] / size)
+        for rank in range(bits, 0, -1):
+            total = 0.5 * (total + counts[rank])
+        total += size * _sigma(counts[0] / size)
+        return round(size * size / (2 * math.log(2) * total))
+
+
+def _sigma(ratio: float) -> float:
+    """The series of the estimator for the share of registers that are empty."""
+    if ratio == 1:
+        return math.inf
+    power, total = 1.0, ratio
+    while True:
+        ratio *= ratio
+        previous = total
+        total += ratio * power
+        power += power
+        if total == previous:
+            return total
+
+
+def _tau(ratio: float) -> float:
+    """The series of the estimator for the share of registers that are not full."""
+    if ratio in {0, 1}:
+        return 0.0
+    power, total = 1.0, 1 - ratio
+    while True:
+        ratio = math.sqrt(ratio)
+        previous = total
+        power *= 0.5
+        total -= (1 - ratio) ** 2 * power
+        if total == previous:
+            return total / 3
+
+
+class QuantileSketch:
+    """
+    Estimates the quantiles of the numbers that were added with a KLL sketch. The numbers are
+    kept in levels, a number of level n standing for 2**n numbers. When a level is full it is
+    sorted and every other number, starting at random with the first or the second, moves up
+    a level. The levels below the top hold fewer numbers, by SKETCH_QUANTILE_SHRINK a level.
+    The smallest and the largest numbers are kept aside, as the quantiles 0 and 1.
+    """
+    __slots__ = ("size", "levels", "capacity", "rng", "low", "high")
+
+    def __init__(self, size: int = SKETCH_QUANTILE_SIZE, rng: random.Random | None = None):
+        self.size = size
+        self.levels: list[list[float]] = []
+        self.capacity = 0
+        self.rng = rng or random.Random()
+        self.low: float | None = None
+        self.high: float | None = None
+        self._grow()
+
+    def _level_capacity(self, level: int) -> int:
+        """The number of numbers that a level holds before it is compacted."""
+        depth = len(self.levels) - level - 1
+        return math.ceil(SKETCH_QUANTILE_SHRINK ** depth * self.size) + 1
+
+    def _grow(self):
+        """Adds a level on top of the others, which makes the lower levels hold fewer numbers."""
+        self.levels.append([])
+        self.capacity = sum(self._level_capacity(level) for level in range(len(self.levels)))
+
+    def _held(self) -> int:
+        """The number of numbers that the levels hold."""
+        return sum(len(level) for level in self.levels)
+
+    def _compact(self, level: int):
+        """Moves every other number of a full level up a level."""
+        if level + 1 >= len(self.levels):
+            self._grow()
+        numbers = sorted(self.levels[level])
+        odd = len(numbers) % 2
+        self.levels[level + 1].extend(numbers[odd + self.rng.randrange(2)::2])
+        self.levels[level] = numbers[:odd]
+
+    def _compress(self):
+        """Compacts the full levels, from the bottom up, until the sketch has room again."""
+        for level, numbers in enumerate(self.levels):
+            if len(numbers) >= self._level_capacity(level):
+                self._compact(level)
+                if self._held() < self.capacity:
+                    return
+
+    def add(self, number: float):
+        """Adds a number."""
+        self.low = number if self.low is None else min(self.low, number)
+        self.high = number if self.high is None else max(self.high, number)
+        self.levels[0].append(number)
+        if len(self.levels[0]) >= self._level_capacity(0):
+            self._compress()
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Merges the numbers of another sketch into this sketch."""
+        self.low = min((number for number in (self.low, other.low) if number is not None),
+                       default=None)
+        self.high = max((number for number in (self.high, other.high) if number is not None),
+                        default=None)
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for level, numbers in enumerate(other.levels):
+            self.levels[level].extend(numbers)
+        while self._held() >= self.capacity:
+            self._compress()
+        return self
+
+    def quantile(self, quantile: float) -> float | None:
+        """
+        Estimates a quantile, the smallest number that at least that share of the numbers is
+        less than or equal to.
+
+        Returns:
+            float: The estimated quantile, or None when no number was added.
+        """
+        weighted = sorted((number, 2 ** level)
+                          for level, numbers in enumerate(self.levels) for number in numbers)
+        if not weighted:
+            return None
+        if quantile <= 0:
+            return self.low
+        if quantile >= 1:
+            return self.high
+
+        rank = quantile * sum(weight for _, weight in weighted)
+        seen = 0
+        for number, weight in weighted:
+            seen += weight
+            if seen >= rank:
+                return number
+        return self.high
+
+
+def sketch_label(sketch: FIKLSketch) -> str:
+    """The name of the result of an approximate aggregate, as it is written in the query."""
+    if sketch["function"] == "approx_quantile":
+        return f"approx_quantile({sketch['property']}, {sketch['quantile']:g})"
+    return f"{sketch['function']}({sketch['property']})"
+
+
+def new_sketch(sketch: FIKLSketch) -> HyperLogLog | QuantileSketch:
+    """Creates an empty sketch for an approximate aggregate."""
+    if sketch["function"] == "approx_quantile":
+        return QuantileSketch()
+    return HyperLogLog()
+
+
+def add_value(summary: HyperLogLog | QuantileSketch, value):
+    """
+    Adds the value of a field to a sketch. Null values are skipped, like missing fields, and
+    quantiles are only found for numbers.
+    """
+    if value is None:
+        return
+    if isinstance(summary, HyperLogLog):
+        summary.add(value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        summary.add(value)
+
+
+def sketch_result(sketch: FIKLSketch, summary: HyperLogLog | QuantileSketch):
+    """The approximate answer of a sketch."""
+    if isinstance(summary, HyperLogLog):
+        return summary.estimate()
+    return summary.quantile(sketch["quantile"])
@@ -0,0 +1,428 @@
+"""
+This module provides the statistics of collections that the planner uses to estimate how many
+documents a query reads and returns.
+
+`analyze` samples (or fully scans) a collection and records, for every field path, the
+fraction of documents that hold the field, an estimate of its number of distinct values, its
+smallest and largest values and the mix of its value types, along with the number of
+documents and their average size. The statistics of Firestore databases are kept in
+STATS_FILE, the statistics of other backends only for as long as the backend is in use.
+"""
+# lang/stats.py
+import datetime
+import json
+import math
+import os
+import threading
+import weakref
+from collections import Counter
+from collections.abc import Mapping
+from typing import TypedDict
+
+from google.cloud.firestore_v1 import GeoPoint
+
+from lang import encoding
+from lang.backend import Backend, Capability, FIKLScan, lookup, sort_value
+from lang.schema import field_paths
+from lang.transformer import FIKLSubjectType, FIKLWhere
+
+STATS_FILE = "~/.fikl/stats.json"
+STATS_PARTITIONS = 8
+
+# the selectivity of clauses on fields that have not been analyzed, as guessed by most
+# relational databases
+DEFAULT_SELECTIVITY = {
+    "==": 0.005,
+    "in": 0.05,
+    "!=": 0.995,
+    "not_in": 0.95,
+    "<": 1 / 3,
+    "<=": 1 / 3,
+    ">": 1 / 3,
+    ">=": 1 / 3,
+    "array_contains": 0.01,
+    "array_contains_any": 0.05,
+    "like": 0.05
+}
+RANGE_OPERATORS = {"<", "<=", ">", ">="}
+
+
+class FIKLFieldStats(TypedDict):
+    """The statistics of a single field path."""
+    presence: float
+    distinct: int
+    min: object
+    max: object
+    types: dict[str, float]
+    elements: int | None
+    length: float | None
+
+
+class FIKLCollectionStats(TypedDict):
+    """The statistics of a collection or collection group."""
+    subject: str
+    subject_type: str
+    analyzed: str
+    documents: int
+    sampled: int
+    average_size: int
+    fields: dict[str, FIKLFieldStats]
+
+
+class FIKLEstimate(TypedDict):
+    """The estimated cost of a query."""
+    analyzed: str
+    documents: int
+    reads: int
+    results: int
+    selectivity: list[dict]
+
+
+def type_name(value) -> str:
+    """Names the Firestore type of a value."""
+    match value:
+        case None:
+            return "null"
+        case bool():
+            return "boolean"
+        case int() | float():
+            return "number"
+        case datetime.datetime():
+            return "timestamp"
+        case str():
+            return "string"
+        case bytes():
+            return "bytes"
+        case GeoPoint():
+            return "geopoint"
+        case list() | tuple():
+            return "array"
+        case Mapping():
+            return "map"
+    return "reference" if isinstance(getattr(value, "path", None), str) else "unknown"
+
+
+def value_size(value) -> int:
+    """The storage size of a value, as Firestore calculates it."""
+    match value:
+        case None | bool():
+            return 1
+        case int() | float() | datetime.datetime():
+            return 8
+        case str():
+            return len(value.encode("utf-8")) + 1
+        case bytes():
+            return len(value)
+        case GeoPoint():
+            return 16
+        case list() | tuple():
+            return sum(value_size(item) for item in value)
+        case Mapping():
+            return sum(len(str(key).encode("utf-8")) + 1 + value_size(item)
+                       for key, item in value.items())
+    if isinstance(path := getattr(value, "path", None), str):
+        return document_name_size(path)
+    return 8
+
+
+def document_name_size(path: str) -> int:
+    """The storage size of the name of a document, as Firestore calculates it."""
+    return sum(len(segment.encode("utf-8")) + 1 for segment in path.split("/")) + 16
+
+
+def document_size(path: str, data: dict) -> int:
+    """The storage size of a document, as Firestore calculates it."""
+    return document_name_size(path) + value_size(data) + 32
+
+
+def distinct_key(value):
+    """A hashable key that is equal for equal values."""
+    try:
+        hash(value)
+        return (type_name(value), value)
+    except TypeError:
+        return (type_name(value), encoding.dumps(value, compact=True))
+
+
+def estimate_distinct(counts: Counter, sampled: int, documents: int) -> int:
+    """
+    Estimates the number of distinct values of the whole collection from the values of a
+    sample with the GEE estimator, values that were seen once are scaled up by the square root
+    of the sampling ratio.
+
+    Returns:
+        int: The estimated number of distinct values.
+    """
+    if sampled >= documents or sampled == 0:
+        return len(counts)
+
+    once = sum(1 for count in counts.values() if count == 1)
+    return min(round(math.sqrt(documents / sampled) * once + len(counts) - once),
+               max(documents, len(counts)))
+
+
+def sample_scans(backend: Backend, scan: FIKLScan, sample: int | None) -> list[FIKLScan]:
+    """
+    Splits the reading of a sample over partitions of the collection, so that the sample is
+    spread over the whole key range rather than taken from its start.
+
+    Returns:
+        list: The scans that read the sample.
+    """
+    if sample is None:
+        return [scan]
+
+    scans = backend.partitions(scan, STATS_PARTITIONS) \
+        if backend.supports(Capability.PARTITIONING) else [scan]
+    limit = math.ceil(sample / len(scans))
+    return [{**partition, "limit": limit} for partition in scans]
+
+
+class FieldSample:
+    """Accumulates the values of a field path that were read while analyzing a collection."""
+
+    def __init__(self):
+        self.count = 0
+        self.values: Counter = Counter()
+        self.types: Counter = Counter()
+        self.elements: Counter | None = None
+        self.length = 0
+        self.bounds: list[tuple] | None = None
+
+    def add(self, value):
+        """Records a value of the field."""
+        self.count += 1
+        self.types[type_name(value)] += 1
+        self.values[distinct_key(value)] += 1
+
+        if isinstance(value, list):
+            if self.elements is None:
+                self.elements = Counter()
+            self.elements.update(map(distinct_key, value))
+            self.length += len(value)
+
+        if not isinstance(value, Mapping):
+            key = (sort_value(value), value)
+            if self.bounds is None:
+                self.bounds = [key, key]
+            else:
+                self.bounds = [min(self.bounds[0], key, key=lambda pair: pair[0]),
+                               max(self.bounds[1], key, key=lambda pair: pair[0])]
+
+    def stats(self, sampled: int, documents: int) -> FIKLFieldStats:
+        """
+        Works out the statistics of the field.
+
+        Returns:
+            FIKLFieldStats: The statistics of the field.
+        """
+        arrays = self.elements is not None
+        return {
+            "presence": self.count / sampled,
+            "distinct": estimate_distinct(self.values, sampled, documents),
+            "min": None if self.bounds is None else encoding.to_primitive(self.bounds[0][1]),
+            "max": None if self.bounds is None else encoding.to_primitive(self.bounds[1][1]),
+            "types": {name: total / self.count for name, total in self.types.most_common()},
+            "elements": estimate_distinct(self.elements, sampled, documents) if arrays else None,
+            "length": self.length / self.types["array"] if arrays else None
+        }
+
+
+def analyze_collection(backend: Backend, subject: str, subject_type: FIKLSubjectType,
+                       sample: int | None = None) -> FIKLCollectionStats:
+    """
+    Reads a sample of the documents of a collection, or every document when no sample size
+    is provided, and works out the statistics of every field path.
+
+    Returns:
+        FIKLCollectionStats: The statistics of the collection.
+    """
+    scan: FIKLScan = {"subject": subject, "subject_type": subject_type}
+    fields: dict[str, FieldSample] = {}
+    sampled = size = 0
+
+    for partition in sample_scans(backend, scan, sample):
+        for snapshot in backend.stream(partition):
+            if (data := snapshot.to_dict()) is None:
+                continue
+            sampled += 1
+            size += document_size(snapshot.reference.path, data)
+            for path in set(field_paths(data)):
+                fields.setdefault(path, FieldSample()).add(lookup(data, path)[1])
+
+    documents = sampled
+    if sample is not None and backend.supports(Capability.AGGREGATION):
+        documents = max(backend.count(scan), sampled)
+
+    return {
+        "subject": subject,
+        "subject_type": subject_type.name,
+        "analyzed": encoding.encode_datetime(datetime.datetime.now(datetime.timezone.utc)),
+        "documents": documents,
+        "sampled": sampled,
+        "average_size": round(size / sampled) if sampled else 0,
+        "fields": {path: field.stats(sampled, documents) for path, field in sorted(fields.items())}
+    }
+
+
+STATS_HOLDER: dict[str, object] = {
+    "lock": threading.Lock(),
+    "saved": None,
+    "unsaved": weakref.WeakKeyDictionary()
+}
+
+
+def stats_key(subject: str, subject_type: FIKLSubjectType) -> str:
+    """The key of the statistics of a collection within the store."""
+    return f"{subject_type.name.lower()}:{subject}"
+
+
+def backend_stats(backend: Backend) -> dict[str, FIKLCollectionStats]:
+    """The statistics of the collections of the backend's database, the caller holds the lock."""
+    if (scope := backend.scope()) is None:
+        return STATS_HOLDER["unsaved"].setdefault(backend, {})
+
+    if STATS_HOLDER["saved"] is None:
+        try:
+            with open(os.path.expanduser(STATS_FILE), "r", encoding="utf-8") as file:
+                STATS_HOLDER["saved"] = json.load(file)
+        except (OSError, ValueError):
+            STATS_HOLDER["saved"] = {}
+    return STATS_HOLDER["saved"].setdefault(scope, {})
+
+
+def save_stats(backend: Backend, stats: FIKLCollectionStats):
+    """Stores the statistics of a collection, replacing any earlier statistics."""
+    key = stats_key(stats["subject"], FIKLSubjectType[stats["subject_type"]])
+    with STATS_HOLDER["lock"]:
+        backend_stats(backend)[key] = stats
+        if backend.scope() is None:
+            return
+
+        path = os.path.expanduser(STATS_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write(encoding.dumps(STATS_HOLDER["saved"], compact=True))
+        os.replace(f"{path}.tmp", path)
+
+
+def collection_stats(backend: Backend, subject: str,
+                     subject_type: FIKLSubjectType) -> FIKLCollectionStats | None:
+    """
+    Fetches the stored statistics of a collection.
+
+    Returns:
+        FIKLCollectionStats: The statistics, or None when the collection has not been analyzed.
+    """
+    if subject_type == FIKLSubjectType.DOCUMENT:
+        return None
+    with STATS_HOLDER["lock"]:
+        return backend_stats(backend).get(stats_key(subject, subject_type))
+
+
+def range_fraction(field: FIKLFieldStats, where: FIKLWhere) -> float | None:
+    """
+    Interpolates the fraction of the values of a numeric field that satisfy a range clause.
+
+    Returns:
+        float: The fraction, or None when the field or the value is not numeric.
+    """
+    low, high, value = field["min"], field["max"], where["value"]
+    if not all(isinstance(item, (int, float)) and not isinstance(item, bool)
+               for item in (low, high, value)):
+        return None
+    if high == low:
+        below = 1.0 if value > low else 0.0
+        equal = 1.0 if value == low else 0.0
+    else:
+        below = min(max((value - low) / (high - low), 0.0), 1.0)
+        equal = 0.0
+
+    match where["operator"]:
+        case "<":
+            return below
+        case "<=":
+            return min(below + equal, 1.0)
+        case ">":
+            return 1.0 - below - equal
+    return 1.0 - below
+
+
+def selectivity(stats: FIKLCollectionStats | None, where: FIKLWhere) -> float:
+    """
+    Estimates the fraction of documents that satisfy a where clause, assuming that values are
+    spread evenly.
+
+    Returns:
+        float: The estimated fraction of documents.
+    """
+    operator = where["operator"]
+    if stats is None:
+        return DEFAULT_SELECTIVITY[operator]
+    if (field := stats["fields"].get(where["property"])) is None:
+        # every operator requires the field to be present
+        return 0.0
+
+    presence = field["presence"]
+    distinct = max(field["distinct"], 1)
+    count = len(where["value"]) if isinstance(where["value"], list) else 1
+
+    match operator:
+        case "==":
+            fraction = 1 / distinct
+        case "in":
+            fraction = min(count / distinct, 1.0)
+        case "!=":
+            fraction = 1 - 1 / distinct
+        case "not_in":
+            fraction = max(1 - count / distinct, 0.0)
+        case _ if operator in RANGE_OPERATORS:
+            if (fraction := range_fraction(field, where)) is None:
+                fraction = DEFAULT_SELECTIVITY[operator]
+        case "array_contains" | "array_contains_any" if field["elements"]:
+            # the chance that an array holds one of the values, elements are spread evenly
+            fraction = min(count * field["length"] / field["elements"], 1.0) \
+                * field["types"].get("array", 0.0)
+        case _:
+            # the patterns of strings are not analyzed
+            fraction = DEFAULT_SELECTIVITY[operator]
+
+    return presence * fraction
+
+
+def estimate_query(stats: FIKLCollectionStats, remote_where: list[FIKLWhere],
+                   local_where: list[FIKLWhere], remote_limit: int | None,
+                   limit: int | None) -> FIKLEstimate:
+    """
+    Estimates the number of documents that a query reads from the backend and returns,
+    assuming that the clauses are independent.
+
+    Returns:
+        FIKLEstimate: The estimated cost of the query.
+    """
+    clauses = [{"property": where["property"], "operator": where["operator"],
+                "local": where in local_where,
+                "selectivity": round(selectivity(stats, where), 6)}
+               for where in remote_where + local_where]
+
+    reads = float(stats["documents"])
+    for clause in clauses:
+        if not clause["local"]:
+            reads *= clause["selectivity"]
+    results = reads
+    for clause in clauses:
+        if clause["local"]:
+            results *= clause["selectivity"]
+
+    if remote_limit is not None:
+        reads = min(reads, remote_limit)
+    if limit is not None:
+        results = min(results, limit)
+
+    return {
+        "analyzed": stats["analyzed"],
+        "documents": stats["documents"],
+        "reads": math.ceil(reads),
+        "results": math.ceil(results),
+        "selectivity": clauses
+    }
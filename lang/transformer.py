@@ -1,13 +1,15 @@
 """transformer for lark processing."""
-# pylint: disable=too-many-arguments
+# pylint: disable=too-many-arguments,too-many-public-methods
 import ast
+import datetime
+import functools
 import os
 import sys
 
 from enum import Enum
 from typing import TypedDict
 from typing import Union
-from lark import Lark, Transformer, v_args, Tree
+from lark import Lark, Transformer, v_args, Tree, Token
 
 AllTypes = Union[int, float, str, bool, None]
 
@@ -23,6 +25,18 @@ class FIKLQueryType(Enum):
     DELETE = 3
     SHOW = 4
     INSERT = 5
+    EXPLAIN = 6
+    EXPORT = 7
+    IMPORT = 8
+    ANALYZE = 9
+    INDEXES = 10
+    DECLARE = 11
+    FETCH = 12
+    CLOSE = 13
+    CREATE_INDEX = 14
+    BEGIN_SNAPSHOT = 15
+    END_SNAPSHOT = 16
+    USE = 17
 
 
 class FIKLSubjectType(Enum):
@@ -35,6 +49,7 @@ class FIKLFormatType(Enum):
     """The different kinds of supported output format types."""
     JSON = 1
     CSV = 2
+    JSON_COMPACT = 3
 
 class FIKLOutputType(Enum):
     """The different kinds of supported output destinations."""
@@ -65,10 +80,15 @@ class FIKLOrderBy(TypedDict):
     local: bool
 
 
-class FIKLUpdateSet(TypedDict):
-    """The definition of a setter that is used when updating a Firestore record."""
+class FIKLUpdateSet(TypedDict, total=False):
+    """
+    The definition of a setter that is used when updating a Firestore record. A setter with a
+    transform (increment, array_union, array_remove, server_timestamp or delete) is computed by
+    the server, with the value as the operand of the transform.
+    """
     property: str
     value: AllTypes
+    transform: str | None
 
 
 class FIKLUpdateQuery(FIKLQuery):
@@ -77,20 +97,106 @@ class FIKLUpdateQuery(FIKLQuery):
 
 
 class FIKLInsertQuery(FIKLQuery):
-    """The definition of an insert query."""
+    """
+    The definition of an insert query. A multi-row insert has rows in place of set, and
+    its identifier is the name of the column that holds the document ids.
+    """
     set: list[FIKLUpdateSet]
+    rows: list[list[FIKLUpdateSet]] | None
     identifier: str
 
 
+class FIKLJoin(TypedDict):
+    """
+    The definition of a join: the field of the documents of the query that holds the key of
+    the joined documents, and the field of the joined documents that holds that key, or
+    __name__ for their document id.
+    """
+    collection: str
+    field: str
+    key: str
+
+
+class FIKLSample(TypedDict):
+    """The definition of a sample, of a number or a percentage of the documents."""
+    size: int | None
+    percent: float | None
+
+
+class FIKLSketch(TypedDict):
+    """The definition of an approximate aggregate of a field, computed with a sketch."""
+    function: str
+    property: str
+    quantile: float | None
+
+
 class FIKLSelectQuery(FIKLQuery):
     """The definition of a select query."""
     fields: list[str] | str
+    join: FIKLJoin | None
+    sample: FIKLSample | None
+    paths: list[str] | None
+    paths_file: str | None
     limit: int | None
     output_type: FIKLOutputType | None
     output: str | None
     order: list[FIKLOrderBy] | None
     group: str | None
     function: str | None
+    sketches: list[FIKLSketch] | None
+    read_time: datetime.datetime | None
+
+
+class FIKLExplainQuery(FIKLQuery):
+    """The definition of an explain query."""
+    query: FIKLQuery
+
+
+class FIKLImportQuery(FIKLQuery):
+    """The definition of an import query."""
+    source: str
+    identifier: str | None
+
+
+class FIKLExportQuery(FIKLQuery):
+    """The definition of an export query."""
+    recursive: bool
+    output: str
+    compress: bool
+    incremental: str | None
+    read_time: datetime.datetime | None
+
+
+class FIKLAnalyzeQuery(FIKLQuery):
+    """The definition of an analyze query."""
+    sample: int | None
+
+
+class FIKLIndexesQuery(FIKLQuery):
+    """The definition of a query that suggests composite indexes."""
+    output: str | None
+
+
+class FIKLLocalIndexQuery(FIKLQuery):
+    """The definition of a query that creates the local indexes of a field."""
+    field: str
+
+
+class FIKLSnapshotQuery(FIKLQuery):
+    """The definition of a query that begins or ends a snapshot of the session."""
+    read_time: datetime.datetime | None
+
+
+class FIKLUseQuery(FIKLQuery):
+    """The definition of a query that switches the databases that the session queries."""
+    databases: list[str]
+
+
+class FIKLCursorQuery(FIKLQuery):
+    """The definition of a query that declares, fetches from or closes a cursor."""
+    cursor: str
+    query: FIKLQuery | None
+    count: int
 
 
 @v_args(inline=True)
@@ -114,6 +220,11 @@ class FIKLTree(Transformer):
         match some_tree.children[0].type:
             case "CNAME":
                 return some_tree.children[0].value
+            case "ESCAPED_STRING":
+                return ast.literal_eval(some_tree.children[0].value)
+            case _ if some_tree.data in {"property", "subject"}:
+                # a keyword that names a field or a collection
+                return some_tree.children[0].value
             case "NULL":
                 return None
             case "DESC":
@@ -174,8 +285,11 @@ class FIKLTree(Transformer):
         if output_format is None:
             return None
 
-        format_value = self._data_value(output_format, "format")
-        return FIKLFormatType.CSV if format_value == "csv" else FIKLFormatType.JSON
+        if self._data_value(output_format, "format") == "csv":
+            return FIKLFormatType.CSV
+
+        is_compact = len(list(output_format.find_data("compact"))) > 0
+        return FIKLFormatType.JSON_COMPACT if is_compact else FIKLFormatType.JSON
 
     def _as_function(self, function: Tree | None) -> str | None:
         """Gets the function value that is specified in the query."""
@@ -207,16 +321,52 @@ class FIKLTree(Transformer):
 
         return self._as_value(list(identifier.find_data("property"))[0])
 
+    def _as_transform(self, prop: str, transform: Tree) -> FIKLUpdateSet:
+        """Gets a setter that is computed by the server from the current value of the field."""
+        match transform.data:
+            case "increment":
+                field, sign, number = transform.children
+                if self._as_value(field) != prop:
+                    raise ValueError(f"Only {prop} can be incremented when setting {prop}")
+                if sign is None and number.value[0] not in "+-":
+                    raise ValueError(f"Expected + or - before {number.value}")
+                text = number.value
+                value = int(text) if text.lstrip("+-").isdigit() else float(text)
+                return {"property": prop, "value": -value if sign == "-" else value,
+                        "transform": "increment"}
+            case "array_union" | "array_remove":
+                operand = Tree("matching", transform.children)
+                return {"property": prop, "value": self._as_fikl_match(operand, "matching"),
+                        "transform": str(transform.data)}
+            case "server_timestamp":
+                return {"property": prop, "value": None, "transform": "server_timestamp"}
+
+        return {"property": prop, "value": None, "transform": "delete"}
+
     def _as_setters(self, setter: Tree) -> list[FIKLUpdateSet]:
         """Gets the setters that are specified in the query."""
         def as_setter(token: Tree):
-            matching = list(token.find_data("property"))[0]
+            prop = self._as_value(token.children[0])
+            if token.children[1].data == "field_transform":
+                return self._as_transform(prop, token.children[1].children[0])
             return {
-                "property": self._as_value(matching),
+                "property": prop,
                 "value": self._as_fikl_match(token, "matching")
             }
         return [as_setter(token) for token in list(setter.find_data("setter"))]
 
+    def _as_rows(self, columns: Tree, rows: Tree) -> list[list[FIKLUpdateSet]]:
+        """Gets the rows of values, as setters of the columns, that are specified in the query."""
+        names = [self._as_value(tree) for tree in columns.find_data("property")]
+
+        def as_row(row: Tree) -> list[FIKLUpdateSet]:
+            values = [self._as_fikl_match(matching, "matching") for matching in row.children]
+            if len(values) != len(names):
+                raise ValueError(f"Expected {len(names)} values but found {len(values)}")
+            return [{"property": name, "value": value} for name, value in zip(names, values)]
+
+        return [as_row(row) for row in rows.children]
+
     def _as_fields(self, select: Tree) -> list[str]:
         """Gets the fields that are specified in the query."""
         if select.children[0].data.value == "fields":
@@ -267,20 +417,88 @@ class FIKLTree(Transformer):
             case "AT":
                 return FIKLSubjectType.DOCUMENT
 
+    def _as_join(self, join: Tree | None) -> FIKLJoin | None:
+        """Gets the join that is specified in the query."""
+        if join is None:
+            return None
+
+        collection, field, key = join.children
+        return {
+            "collection": self._as_value(collection),
+            "field": self._as_value(field),
+            "key": self._as_value(key)
+        }
+
+    def _as_sample(self, sampling: Tree | None) -> FIKLSample | None:
+        """Gets the sample that is specified in the query."""
+        if sampling is None:
+            return None
+
+        size, percent = sampling.children
+        if percent is not None:
+            return {"size": None, "percent": float(size.value)}
+        return {"size": int(size.value), "percent": None}
+
+    def _as_sketches(self, sketches: Tree | None) -> list[FIKLSketch] | None:
+        """Gets the approximate aggregates that are specified in the query."""
+        if sketches is None:
+            return None
+
+        def tree_as_sketch(tree: Tree) -> FIKLSketch:
+            quantile = tree.children[1] if len(tree.children) > 1 else None
+            return {"function": str(tree.data), "property": self._as_value(tree.children[0]),
+                    "quantile": None if quantile is None else float(quantile.value)}
+
+        return [tree_as_sketch(tree) for tree in sketches.children]
+
+    def _as_read_time(self, as_of: Tree | None) -> datetime.datetime | None:
+        """
+        Gets the point in time that the reads of the query are pinned to, in UTC. Times
+        without a timezone are read as UTC.
+        """
+        if as_of is None:
+            return None
+
+        read_time = datetime.datetime.fromisoformat(ast.literal_eval(as_of.children[0].value))
+        if read_time.tzinfo is None:
+            read_time = read_time.replace(tzinfo=datetime.timezone.utc)
+        return read_time.astimezone(datetime.timezone.utc)
+
+    def _as_paths(self, paths: Tree | None) -> list[str] | None:
+        """Gets the list of document paths that is specified in the query."""
+        if paths is None or paths.data != "paths":
+            return None
+        return [self._as_value(subject) for subject in paths.children]
+
+    def _as_paths_file(self, paths: Tree | None) -> str | None:
+        """Gets the file of document paths that is specified in the query."""
+        if paths is None or paths.data != "paths_file":
+            return None
+        return ast.literal_eval(paths.children[0].value)
+
     def _do_select(self, function: Tree | None, subset: Tree, subject_type: Tree,
                    subject: Tree, where: Tree | None, order: Tree | None,
                    limit: Tree | None, page: Tree | None, group: Tree | None,
-                   output: Tree | None, output_format: Tree | None) -> FIKLSelectQuery:
+                   output: Tree | None, output_format: Tree | None,
+                   join: Tree | None = None, paths: Tree | None = None,
+                   sampling: Tree | None = None, sketches: Tree | None = None,
+                   as_of: Tree | None = None) -> FIKLSelectQuery:
         """
         The base method for all select queries.
         Creates the appropate definition of the select query.
         """
+        sketched = self._as_sketches(sketches)
         return {
             "query_type": FIKLQueryType.SELECT,
-            "fields": self._as_fields(subset),
-            "subject": self._as_value(subject),
+            "fields": self._as_fields(subset) if sketched is None
+                      else list(dict.fromkeys(sketch["property"] for sketch in sketched)),
+            "subject": None if subject is None else self._as_value(subject),
             "subject_type": self._as_subject_type(subject_type),
+            "join": self._as_join(join),
+            "paths": self._as_paths(paths),
+            "paths_file": self._as_paths_file(paths),
             "where": self._as_where(where),
+            "sample": self._as_sample(sampling),
             "limit": self._as_limit(limit),
             "page": self._as_page(page),
             "order": self._as_order(order),
@@ -288,31 +506,52 @@ class FIKLTree(Transformer):
             "output": self._as_output(output),
             "output_type": self._as_output_type(output),
             "format": self._as_format(output_format),
-            "function": self._as_function(function)
+            "function": self._as_function(function),
+            "sketches": sketched,
+            "read_time": self._as_read_time(as_of)
         }
 
     def select_paged_collection(self,function: Tree | None, subset: Tree, subject_type: Tree,
-                          subject: Tree, where: Tree | None, order: Tree, page: Tree,
-                          group: Tree | None,output_format: Tree | None, output: Tree | None):
+                          subject: Tree, as_of: Tree | None, join: Tree | None,
+                          where: Tree | None, order: Tree, page: Tree, group: Tree | None,
+                          output_format: Tree | None, output: Tree | None):
         """The method for all select collection queries."""
         return self._do_select(function, subset, subject_type, subject,
-                               where, order, None, page, group, output, output_format)
+                               where, order, None, page, group, output, output_format, join,
+                               as_of=as_of)
 
     def select_collection(self, function: Tree | None, subset: Tree, subject_type: Tree,
-                          subject: Tree, where: Tree | None, order: Tree | None,
-                          limit: Tree | None, group: Tree | None,
-                          output_format: Tree | None, output: Tree | None):
+                          subject: Tree, as_of: Tree | None, join: Tree | None,
+                          where: Tree | None, sampling: Tree | None, order: Tree | None,
+                          limit: Tree | None, group: Tree | None, output_format: Tree | None,
+                          output: Tree | None):
         """The method for all select collection queries."""
         return self._do_select(function, subset, subject_type, subject,
-                               where, order, limit, None, group, output, output_format)
+                               where, order, limit, None, group, output, output_format, join,
+                               sampling=sampling, as_of=as_of)
+
+    def select_sketches(self, sketches: Tree, subject_type: Tree, subject: Tree,
+                        as_of: Tree | None, where: Tree | None, sampling: Tree | None,
+                        output_format: Tree | None, output: Tree | None):
+        """The method for all select queries of approximate aggregates."""
+        return self._do_select(None, None, subject_type, subject, where, order=None, limit=None,
+                               page=None, group=None, output=output, output_format=output_format,
+                               sampling=sampling, sketches=sketches, as_of=as_of)
 
     def select_document(self, subset: Tree, subject_type: Tree,
-                        subject: Tree, output_format: Tree | None,
+                        subject: Tree, as_of: Tree | None, output_format: Tree | None,
                         output: Tree | None):
         """The method for all select document queries."""
         return self._do_select(None, subset, subject_type, subject,
                                where=None, order=None, limit=None, page=None, group=None,
-                               output=output, output_format=output_format)
+                               output=output, output_format=output_format, as_of=as_of)
+
+    def select_documents(self, subset: Tree, subject_type: Tree, paths: Tree,
+                         as_of: Tree | None, output_format: Tree | None, output: Tree | None):
+        """The method for all select queries of a list, or a file, of documents."""
+        return self._do_select(None, subset, subject_type, None, where=None, order=None,
+                               limit=None, page=None, group=None, output=output,
+                               output_format=output_format, paths=paths, as_of=as_of)
 
     def _do_update(self, subject_type: Tree, subject: Tree, setter: Tree, where: Tree | None):
         """
@@ -374,9 +613,147 @@ class FIKLTree(Transformer):
             "subject": self._as_value(subject),
             "subject_type": FIKLSubjectType.COLLECTION,
             "set": self._as_setters(setter),
+            "rows": None,
+            "identifier": self._as_identifier(identifier)
+        }
+
+    def insert_rows(self, subject: Tree, columns: Tree, rows: Tree,
+                    identifier: Tree | None) -> FIKLInsertQuery:
+        """The method for all multi-row insert queries."""
+        return {
+            "query_type": FIKLQueryType.INSERT,
+            "subject": self._as_value(subject),
+            "subject_type": FIKLSubjectType.COLLECTION,
+            "set": [],
+            "rows": self._as_rows(columns, rows),
+            "identifier": self._as_identifier(identifier)
+        }
+
+    def import_documents(self, subject: Tree, source: Token,
+                         identifier: Tree | None) -> FIKLImportQuery:
+        """The method for all import queries."""
+        return {
+            "query_type": FIKLQueryType.IMPORT,
+            "subject": self._as_value(subject),
+            "subject_type": FIKLSubjectType.COLLECTION,
+            "where": None,
+            "source": ast.literal_eval(source.value),
             "identifier": self._as_identifier(identifier)
         }
 
+    def explain_query(self, query: FIKLQuery) -> FIKLExplainQuery:
+        """The method for all explain queries."""
+        return {
+            "query_type": FIKLQueryType.EXPLAIN,
+            "subject": query["subject"],
+            "subject_type": query["subject_type"],
+            "where": None,
+            "query": query
+        }
+
+    def export_collection(self, subject_type: Tree, subject: Tree, as_of: Tree | None,
+                          recursive: Tree | None, incremental: Tree | None, output: Token,
+                          compress: Tree | None) -> FIKLExportQuery:
+        """The method for all export queries."""
+        return {
+            "query_type": FIKLQueryType.EXPORT,
+            "subject": self._as_value(subject),
+            "subject_type": self._as_subject_type(subject_type),
+            "where": None,
+            "recursive": recursive is not None,
+            "output": ast.literal_eval(output.value),
+            "compress": compress is not None,
+            "incremental": None if incremental is None else self._as_value(incremental.children[0]),
+            "read_time": self._as_read_time(as_of)
+        }
+
+    def analyze_collection(self, subject_type: Tree, subject: Tree,
+                           sample: Tree | None) -> FIKLAnalyzeQuery:
+        """The method for all analyze queries."""
+        return {
+            "query_type": FIKLQueryType.ANALYZE,
+            "subject": self._as_value(subject),
+            "subject_type": self._as_subject_type(subject_type),
+            "where": None,
+            "sample": None if sample is None else self._as_value(sample)
+        }
+
+    def suggest_indexes(self, output: Token | None) -> FIKLIndexesQuery:
+        """The method for all queries that suggest composite indexes."""
+        return {
+            "query_type": FIKLQueryType.INDEXES,
+            "subject": None,
+            "subject_type": FIKLSubjectType.DOCUMENT,
+            "where": None,
+            "output": None if output is None else ast.literal_eval(output.value)
+        }
+
+    def create_local_index(self, subject: Tree, field: Tree) -> FIKLLocalIndexQuery:
+        """The method for all queries that create the local indexes of a field."""
+        return {
+            "query_type": FIKLQueryType.CREATE_INDEX,
+            "subject": self._as_value(subject),
+            "subject_type": FIKLSubjectType.COLLECTION,
+            "where": None,
+            "field": self._as_value(field)
+        }
+
+    def declare_cursor(self, name: Token, query: FIKLQuery) -> FIKLCursorQuery:
+        """The method for all queries that declare a cursor."""
+        return self._as_cursor_query(FIKLQueryType.DECLARE, name, query=query)
+
+    def fetch_cursor(self, *tokens: Token | None) -> FIKLCursorQuery:
+        """The method for all queries that fetch from a cursor, a single document by default."""
+        count = tokens[0] if len(tokens) == 2 else None
+        return self._as_cursor_query(FIKLQueryType.FETCH, tokens[-1],
+                                     count=1 if count is None else int(count.value))
+
+    def close_cursor(self, name: Token) -> FIKLCursorQuery:
+        """The method for all queries that close a cursor."""
+        return self._as_cursor_query(FIKLQueryType.CLOSE, name)
+
+    def begin_snapshot(self, as_of: Tree | None) -> FIKLSnapshotQuery:
+        """The method for all queries that pin the reads of the session to a point in time."""
+        return self._as_snapshot_query(FIKLQueryType.BEGIN_SNAPSHOT, self._as_read_time(as_of))
+
+    def end_snapshot(self) -> FIKLSnapshotQuery:
+        """The method for all queries that stop pinning the reads of the session."""
+        return self._as_snapshot_query(FIKLQueryType.END_SNAPSHOT, None)
+
+    def use_databases(self, *subjects: Tree) -> FIKLUseQuery:
+        """The method for all queries that switch the databases of the session."""
+        return {
+            "query_type": FIKLQueryType.USE,
+            "subject": None,
+            "subject_type": FIKLSubjectType.DOCUMENT,
+            "where": None,
+            "databases": [self._as_value(subject) for subject in subjects]
+        }
+
+    def _as_snapshot_query(self, query_type: FIKLQueryType,
+                           read_time: datetime.datetime | None) -> FIKLSnapshotQuery:
+        """Creates the definition of a snapshot query."""
+        return {
+            "query_type": query_type,
+            "subject": None,
+            "subject_type": FIKLSubjectType.DOCUMENT,
+            "where": None,
+            "read_time": read_time
+        }
+
+    def _as_cursor_query(self, query_type: FIKLQueryType, name: Token,
+                         query: FIKLQuery | None = None, count: int = 0) -> FIKLCursorQuery:
+        """Creates the definition of a cursor query."""
+        return {
+            "query_type": query_type,
+            "subject": None,
+            "subject_type": FIKLSubjectType.DOCUMENT,
+            "where": None,
+            "cursor": name.value,
+            "query": query,
+            "count": count
+        }
+
 
 def parse(query: str) -> FIKLQuery:
     """
@@ -400,10 +777,19 @@ def build_parse_tree(query: str):
     Returns:
         The Lark Tree that represents the tokenized query.
     """
-    grammar = read_grammar()
+    return fikl_parser().parse(query)
 
-    parser = Lark(grammar, lexer="basic")
-    return parser.parse(query)
+
+@functools.cache
+def fikl_parser() -> Lark:
+    """
+    Builds the parser of the grammar once, as analyzing the optional clauses of the grammar
+    takes far longer than parsing a query.
+
+    Returns:
+        Lark: The parser for the FIKL language.
+    """
+    return Lark(read_grammar(), lexer="basic")
 
 
 def resource_path(relative_path):
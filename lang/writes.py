@@ -0,0 +1,327 @@
+"""
+This module provides bulk writes: reading the records of files that are imported and
+scheduling the writes of imports, inserts and mass mutations.
+
+The writes of mass updates and deletes are scheduled one document at a time, those of
+imports and inserts in atomic batches of up to WRITE_BATCH_SIZE writes. Only a bounded number
+of batches are in flight at a time, so that records are read from the source no faster than
+they can be written. Against a throttled backend the rate of writes starts at
+WRITE_RATE_START per second and grows by half every five minutes (the 500/50/5 rule), and is
+halved whenever the backend pushes back. Batches that fail with a transient error are retried
+with jittered backoff, and the writes of batches that still fail are recorded in a journal
+that can be replayed later.
+"""
+# lang/writes.py
+import csv
+import datetime
+import gzip
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import count as counter, islice
+from typing import TextIO, TypedDict
+
+from google.api_core import exceptions
+
+from lang import encoding
+from lang.backend import Backend, FieldTransform, FIKLWrite
+
+WRITE_BATCH_SIZE = 500
+WRITE_SETTINGS = {"workers": 8}
+
+WRITE_RATE_START = 500.0
+WRITE_RATE_GROWTH = 1.5
+WRITE_RATE_PERIOD = 300.0
+WRITE_RATE_MINIMUM = 10.0
+WRITE_RATE_MAXIMUM = 10_000.0
+WRITE_RATE_COOLDOWN = 1.0
+WRITE_RETRIES = 5
+WRITE_BACKOFF_BASE = 0.5
+WRITE_BACKOFF_MAX = 30.0
+RETRY_QUEUE_SIZE = 1000
+JOURNAL_DIR = "~/.fikl/failures"
+
+# the backend is overloaded or the write lost a contention, the rate of writes is reduced
+THROTTLING_ERRORS = (exceptions.ResourceExhausted, exceptions.Aborted)
+TRANSIENT_ERRORS = THROTTLING_ERRORS + (exceptions.DeadlineExceeded,
+                                        exceptions.ServiceUnavailable,
+                                        exceptions.InternalServerError)
+
+
+class FIKLWriteResult(TypedDict):
+    """The outcome of scheduled writes."""
+    count: int
+    failed: int
+    journal: str | None
+
+
+def open_source(path: str) -> TextIO:
+    """Opens a file that is imported, decompressing it when it is gzipped."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def csv_value(value: str):
+    """
+    Converts a CSV cell to the value that it represents. Numbers, booleans and null are
+    converted, anything else (including numbers with leading zeros) is kept as a string.
+    """
+    if value == "":
+        return None
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return value
+    return parsed if parsed is None or isinstance(parsed, (bool, int, float)) else value
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Lazily reads the records of an NDJSON or CSV file (optionally gzipped). The format is
+    determined by the extension of the file, CSV files must have a header row.
+
+    Yields:
+        dict: The records of the file.
+    """
+    is_csv = path.removesuffix(".gz").lower().endswith(".csv")
+
+    with open_source(path) as file:
+        if is_csv:
+            for row in csv.DictReader(file):
+                yield {key: csv_value(value) for key, value in row.items()}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Groups the items into lists of up to the provided size.
+
+    Yields:
+        list: The next batch of items.
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class RateLimiter:
+    """
+    Spaces writes out to the current rate. The rate grows by WRITE_RATE_GROWTH every
+    WRITE_RATE_PERIOD seconds, up to WRITE_RATE_MAXIMUM, and is halved (at most once every
+    WRITE_RATE_COOLDOWN seconds) when the backend pushes back. The next period of growth
+    starts from the last back off.
+    """
+
+    def __init__(self, rate: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._changed = self._next = clock()
+        self._backed_off: float | None = None
+
+    def acquire(self, count: int = 1):
+        """Waits until the next writes may be sent."""
+        with self._lock:
+            now = self._clock()
+            while now - self._changed >= WRITE_RATE_PERIOD and self.rate < WRITE_RATE_MAXIMUM:
+                self.rate = min(self.rate * WRITE_RATE_GROWTH, WRITE_RATE_MAXIMUM)
+                self._changed += WRITE_RATE_PERIOD
+            slot = max(now, self._next)
+            self._next = slot + count / self.rate
+        if slot > now:
+            self._sleep(slot - now)
+
+    def back_off(self):
+        """Reduces the rate after the backend pushed back."""
+        with self._lock:
+            now = self._clock()
+            if self._backed_off is not None and now - self._backed_off < WRITE_RATE_COOLDOWN:
+                return
+            self.rate = max(self.rate / 2, WRITE_RATE_MINIMUM)
+            self._changed = self._backed_off = now
+
+
+class FailureJournal:
+    """
+    Records the writes that could not be applied, one JSON line per write. The file is only
+    created once the first failure is recorded.
+    """
+
+    def __init__(self):
+        self.path: str | None = None
+        self.count = 0
+        self._file: TextIO | None = None
+
+    def record(self, writes: list[FIKLWrite], error: BaseException | str):
+        """Appends the failed writes of a batch to the journal."""
+        if self._file is None:
+            directory = os.path.expanduser(JOURNAL_DIR)
+            os.makedirs(directory, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+            self.path = os.path.join(directory, f"{stamp}-{uuid.uuid4().hex[:8]}.ndjson")
+            self._file = open(self.path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+        message = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        for write in writes:
+            entry = {**write, "data": journal_value(write["data"]), "error": message}
+            self._file.write(encoding.dumps(entry, compact=True))
+            self._file.write("\n")
+        self._file.flush()
+        self.count += len(writes)
+
+    def close(self):
+        """Closes the journal file, if one was created."""
+        if self._file is not None:
+            self._file.close()
+
+
+def journal_value(value):
+    """Converts the field transforms of the data of a write into JSON values."""
+    match value:
+        case FieldTransform():
+            return {"__transform__": value.kind, "operand": value.operand}
+        case Mapping():
+            return {key: journal_value(item) for key, item in value.items()}
+        case list():
+            return [journal_value(item) for item in value]
+    return value
+
+
+def replay_value(value):
+    """Restores the field transforms of the data of a journaled write."""
+    match value:
+        case {"__transform__": kind, "operand": operand}:
+            return FieldTransform(kind, operand)
+        case Mapping():
+            return {key: replay_value(item) for key, item in value.items()}
+        case list():
+            return [replay_value(item) for item in value]
+    return value
+
+
+def read_journal(path: str) -> list[FIKLWrite]:
+    """
+    Reads the writes that were recorded in a journal.
+
+    Returns:
+        list: The failed writes.
+    """
+    with open(os.path.expanduser(path), "r", encoding="utf-8") as file:
+        return [{"operation": entry["operation"], "path": entry["path"],
+                 "data": replay_value(entry["data"])}
+                for entry in map(json.loads, filter(str.strip, file))]
+
+
+def apply_writes(backend: Backend, batch: list[FIKLWrite], limiter: RateLimiter | None) -> \
+        Exception | None:
+    """
+    Applies a batch of writes once the rate limiter allows it. A batch of more than one write
+    is committed atomically.
+
+    Returns:
+        Exception: The error that the batch failed with, None when it was applied.
+    """
+    if limiter is not None:
+        limiter.acquire(len(batch))
+    try:
+        match batch:
+            case [{"operation": "update", "path": path, "data": data}]:
+                backend.update(path, data)
+            case [{"operation": "delete", "path": path}]:
+                backend.delete(path)
+            case _:
+                backend.commit(batch)
+    except Exception as exception:  # pylint: disable=broad-exception-caught
+        return exception
+    return None
+
+
+def retry_delay(attempt: int) -> float:
+    """The jittered delay before a write is retried, growing with every attempt."""
+    return random.uniform(0, min(WRITE_BACKOFF_MAX, WRITE_BACKOFF_BASE * 2 ** attempt))
+
+
+def schedule_writes(backend: Backend, writes: Iterable[FIKLWrite],
+                    progress: Callable[[int], object] | None = None,
+                    batch_size: int = 1) -> FIKLWriteResult:
+    """
+    Applies the writes in batches of up to batch_size writes using a pool of workers. The
+    writes are consumed lazily. Batches that fail with a transient error are put on a bounded
+    retry queue and retried after a jittered delay, up to WRITE_RETRIES times. New batches are
+    not started while the retry queue is full. The writes of batches that fail for good, or
+    that are still queued when the writes are interrupted, are recorded in a failure journal.
+
+    Returns:
+        FIKLWriteResult: The number of writes applied and failed, and the journal of failures.
+    """
+    workers = WRITE_SETTINGS["workers"]
+    limiter = RateLimiter(WRITE_RATE_START) if backend.throttled else None
+    journal = FailureJournal()
+    source: Iterator[list[FIKLWrite]] | None = batched(writes, batch_size)
+    written = 0
+    sequence = counter()
+    retries: list[tuple[float, int, int, list[FIKLWrite]]] = []
+    pending: dict[Future, tuple[list[FIKLWrite], int]] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(batch: list[FIKLWrite], attempt: int):
+            pending[executor.submit(apply_writes, backend, batch, limiter)] = (batch, attempt)
+
+        try:
+            while True:
+                while retries and retries[0][0] <= time.monotonic() and len(pending) < workers * 2:
+                    _, _, attempt, batch = heapq.heappop(retries)
+                    submit(batch, attempt)
+
+                while source is not None and len(pending) < workers * 2 \
+                        and len(retries) < max(RETRY_QUEUE_SIZE // batch_size, 1):
+                    if (batch := next(source, None)) is None:
+                        source = None
+                    else:
+                        submit(batch, 0)
+
+                if source is None and not pending and not retries:
+                    break
+
+                timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+
+                for future in wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)[0]:
+                    batch, attempt = pending.pop(future)
+                    if (error := future.result()) is None:
+                        written += len(batch)
+                        if progress is not None:
+                            progress(len(batch))
+                    elif isinstance(error, TRANSIENT_ERRORS) and attempt < WRITE_RETRIES:
+                        if limiter is not None and isinstance(error, THROTTLING_ERRORS):
+                            limiter.back_off()
+                        heapq.heappush(retries, (time.monotonic() + retry_delay(attempt),
+                                                 next(sequence), attempt + 1, batch))
+                    else:
+                        journal.record(batch, error)
+        except BaseException:
+            for future, (batch, _) in pending.items():
+                if future.cancel():
+                    journal.record(batch, "interrupted")
+            for _, _, _, batch in retries:
+                journal.record(batch, "interrupted")
+            raise
+        finally:
+            journal.close()
+
+    return {"count": written, "failed": journal.count, "journal": journal.path}
@@ -1,2 +1,20 @@
 """Top-level test package for FIKL."""
 # tests/__init__.py
+import atexit
+import os
+import shutil
+import tempfile
+
+from lang import checkpoint, export, indexes, planner, stats, writes
+
+# the state that FIKL saves in ~/.fikl is kept in a directory of its own while testing, so that
+# the tests leave the home directory as it was
+STATE_DIRECTORY = tempfile.mkdtemp(prefix="fikl-tests-")
+atexit.register(shutil.rmtree, STATE_DIRECTORY, ignore_errors=True)
+
+checkpoint.CHECKPOINT_DIR = os.path.join(STATE_DIRECTORY, "checkpoints")
+export.WATERMARK_FILE = os.path.join(STATE_DIRECTORY, "watermarks.json")
+indexes.QUERY_LOG_FILE = os.path.join(STATE_DIRECTORY, "queries.ndjson")
+planner.PLACEMENT_FILE = os.path.join(STATE_DIRECTORY, "placements.json")
+stats.STATS_FILE = os.path.join(STATE_DIRECTORY, "stats.json")
+writes.JOURNAL_DIR = os.path.join(STATE_DIRECTORY, "failures")
@@ -0,0 +1,222 @@
+"""Tests the storage backends and the query planner"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long,consider-using-namedtuple-or-dataclass
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import cli, ql, writes
+from lang.backend import SORTED_CACHE_SIZE, Capability, FirestoreBackend, MemoryBackend, MemorySnapshot, matches, use_backend
+from lang.planner import plan_query
+from lang.transformer import FIKLSubjectType, parse
+
+from benchmarks.fake_firestore import FakeClient, _matches as fake_matches
+
+BOOKS = {
+    "a": {"year": 2001, "title": "A", "tags": ["poetry"], "author": {"lastName": "Diamond"}},
+    "b": {"year": 1999, "title": "B", "tags": [], "author": {"lastName": "Leroi"}},
+    "c": {"year": 2005, "title": "C", "tags": ["poetry", "art"], "author": {"lastName": "Diamond"}},
+    "d": {"year": 2005, "title": "D", "author": {"lastName": "Marie"}},
+}
+
+
+class NoOrBackend(MemoryBackend):
+    name = "no-or"
+    capabilities = Capability.PROJECTION
+
+
+class TestBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = MemoryBackend({"books": BOOKS, "books/a/reviews": {"r1": {"stars": 5}}})
+        client = FakeClient()
+        client.load("books", BOOKS)
+        client.load("books/a/reviews", {"r1": {"stars": 5}})
+        self.firestore = FirestoreBackend(client)
+        self.previous = use_backend(self.memory)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str, backend=None):
+        if backend is not None:
+            use_backend(backend)
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_give_the_same_results_on_every_backend(self):
+        queries = [
+            'select title from books where "author.lastName" == "Diamond" order by year desc',
+            'select title from books where year in [1999, 2005] order by title',
+            'select title, year from books where tags array_contains "poetry"',
+            'select * from books order by year page 1',
+            'select count * from books where year >= 2001',
+            'select stars within reviews',
+        ]
+        for query in queries:
+            self.assertEqual(self.run_json(query, self.memory), self.run_json(query, self.firestore), query)
+
+    def test_should_not_reuse_the_id_of_a_deleted_document(self):
+        memory = MemoryBackend({"notes": {}})
+        first = memory.add("notes", {"text": "first"})
+        second = memory.add("notes", {"text": "second"})
+        memory.delete(first)
+        third = memory.add("notes", {"text": "third"})
+
+        self.assertEqual(len({first, second, third}), 3)
+        self.assertEqual(sorted(snapshot.to_dict()["text"] for snapshot in memory.stream({"subject": "notes", "subject_type": FIKLSubjectType.COLLECTION})), ["second", "third"])
+
+    def test_should_page_through_every_document(self):
+        documents = self.run_json('select title from books order by year, title page 3')
+        self.assertEqual([doc["title"] for doc in documents], ["B", "A", "C", "D"])
+
+    def test_should_push_down_projection_and_count(self):
+        plan = plan_query(parse('select title from books where year^ > 2000 order by title^'), self.memory)
+        self.assertEqual(plan["projection"], ["title", "year"])
+        self.assertEqual(plan["local_order"][0]["property"], "title")
+
+        plan = plan_query(parse('select count * from books where year > 2000'), self.memory)
+        self.assertEqual(plan["aggregate"], "count")
+        self.assertEqual(self.run_json('select count * from books where year > 2000'), 3)
+
+    def test_should_only_read_keys_for_deletes(self):
+        plan = plan_query(parse('delete from books where year == 2005'), self.memory)
+        self.assertEqual(plan["projection"], [])
+
+    def test_should_evaluate_disjunctions_locally_without_or_filters(self):
+        backend = NoOrBackend({"books": BOOKS})
+        plan = plan_query(parse('select * from books where year in [1999, 2001]'), backend)
+        self.assertEqual(plan["remote_where"], [])
+        self.assertEqual(len(plan["local_where"]), 1)
+
+        titles = [doc["title"] for doc in self.run_json('select title from books where year in [1999, 2001]', backend)]
+        self.assertEqual(sorted(titles), ["A", "B"])
+
+    def test_should_reject_like_on_firestore(self):
+        use_backend(self.firestore)
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select * from books where title like "A%"')
+
+    def test_should_evaluate_like_in_memory(self):
+        self.assertEqual(self.run_json('select title from books where "author.lastName" like "Dia%" order by title'),
+                         [{"title": "A"}, {"title": "C"}])
+
+    def test_should_write_through_the_backend(self):
+        self.run_json('insert into books set title = "E", "author.lastName" = "Leroi" identified by "e"')
+        self.run_json('update from books set year = 2010 where "author.lastName" == "Leroi"')
+        self.assertEqual(self.run_json('select title from books where year == 2010 order by title'),
+                         [{"title": "B"}, {"title": "E"}])
+        self.assertEqual(self.run_json('delete from books where year == 2010'), {"count": 2})
+        self.assertEqual(self.run_json('show collections'), ["books"])
+
+    def test_should_apply_field_transforms_without_reading_documents(self):
+        update = 'update from books set year = year + 10, tags = array_union(["new", "art"]), "author.lastName" = delete(), edited = server_timestamp() where year == 2005'
+        plan = plan_query(parse(update), self.memory)
+        self.assertEqual(plan["projection"], [])
+
+        for backend in (self.memory, self.firestore):
+            self.assertEqual(self.run_json(update, backend), {"count": 2})
+            self.run_json('update at "books/c" set tags = array_remove(["poetry"]), year = year - 1')
+            documents = self.run_json('select title, year, tags, author, edited from books where year >= 2014 order by title')
+            self.assertEqual([{key: doc[key] for key in ("title", "year", "tags", "author")} for doc in documents],
+                             [{"title": "C", "year": 2014, "tags": ["art", "new"], "author": {}},
+                              {"title": "D", "year": 2015, "tags": ["new", "art"], "author": {}}], backend.name)
+            self.assertTrue(all(doc["edited"].endswith("Z") for doc in documents))
+
+    def test_should_insert_many_rows_in_batches(self):
+        client = FakeClient()
+        use_backend(FirestoreBackend(client))
+        rows = ", ".join(f'("{index}", {index}, "Leroi")' for index in range(501))
+
+        self.assertEqual(self.run_json(f'insert into books (isbn, year, "author.lastName") values {rows} identified by isbn'), {"count": 501})
+        self.assertEqual(client.round_trips, 2)
+        self.assertEqual(client.read("books/7"), {"year": 7, "author": {"lastName": "Leroi"}})
+
+    def test_should_insert_rows_atomically(self):
+        client = FakeClient()
+        client.load("books", BOOKS)
+        for backend in (self.memory, FirestoreBackend(client)):
+            use_backend(backend)
+            with self.subTest(backend=backend.name), tempfile.TemporaryDirectory() as directory, \
+                    mock.patch.object(writes, "JOURNAL_DIR", directory):
+                result = self.run_json('insert into books (id, title) values ("e", "E"), ("a", "Duplicate") identified by id')
+                self.assertEqual((result["count"], result["failed"]), (0, 2))
+                self.assertEqual(self.run_json('select count * from books'), 4)
+
+    def test_should_only_read_pages_as_results_are_consumed(self):
+        client = FakeClient()
+        client.load("books", BOOKS)
+        use_backend(FirestoreBackend(client))
+
+        documents, _ = ql.run_query('select title from books order by title page 2', lazy=True)
+        self.assertEqual(client.round_trips, 0)
+        self.assertEqual(next(documents)["title"], "A")
+        self.assertEqual(next(documents)["title"], "B")
+        self.assertEqual(client.round_trips, 1)
+        self.assertEqual([doc["title"] for doc in documents], ["C", "D"])
+
+    def test_should_keep_the_csv_columns_of_the_first_page(self):
+        use_backend(MemoryBackend({"notes": {"a": {"title": "A"}, "b": {"title": "B", "year": 1}, "c": {"year": 2, "title": "C"}}}))
+        shown = []
+        with mock.patch.dict(cli.RESULTS_HOLDER, {"page_size": 1}), mock.patch.object(cli, "output_content", lambda content, _: shown.append(content)), mock.patch.object(cli, "rprint"):
+            cli.run_query_and_output('select * from notes order by title format csv', lazy=True)
+            cli.output_next_page()
+            cli.output_next_page()
+
+        self.assertEqual("".join(shown), "title,_path\nA,notes/a\nB,notes/b,1\nC,notes/c,2\n")
+
+    def test_should_explain_the_plan(self):
+        plan = self.run_json('explain select title from books where year == 2001 and title^ like "A%"')
+        self.assertEqual(plan["backend"], "memory")
+        self.assertEqual(plan["remote"]["fields"], ["title"])
+        self.assertEqual(plan["local"]["where"][0]["operator"], "like")
+
+    def test_should_decode_each_document_once(self):
+        with mock.patch.object(MemorySnapshot, "to_dict", autospec=True, side_effect=MemorySnapshot.to_dict) as to_dict:
+            titles = self.run_json('select title from books where title^ != "B" order by "author.lastName"^ desc, year^')
+        self.assertEqual(titles, [{"title": "D"}, {"title": "A"}, {"title": "C"}])
+        self.assertEqual(to_dict.call_count, len(BOOKS))
+
+    def test_should_sort_mixed_types_locally(self):
+        backend = MemoryBackend({"things": {"a": {"v": "x"}, "b": {"v": 2}, "c": {}, "d": {"v": True}, "e": {"v": 1.5}}})
+        paths = [doc["_path"] for doc in self.run_json('select * from things order by v^', backend)]
+        self.assertEqual(paths, ["things/c", "things/d", "things/e", "things/b", "things/a"])
+
+
+class TestSortedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = MemoryBackend({"books": BOOKS})
+        self.previous = use_backend(self.memory)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_should_only_cache_the_sorts_of_recent_scans(self):
+        with mock.patch.object(self.memory, "_matching", wraps=self.memory._matching) as matching:
+            for year in range(2000, 2000 + SORTED_CACHE_SIZE + 1):
+                ql.run_query(f'select title from books where year >= {year} order by title')
+            ql.run_query(f'select title from books where year >= {2000 + SORTED_CACHE_SIZE} order by title')
+            self.assertEqual(matching.call_count, SORTED_CACHE_SIZE + 1)
+
+            # the least recently used sort is dropped
+            ql.run_query('select title from books where year >= 2000 order by title')
+            self.assertEqual(matching.call_count, SORTED_CACHE_SIZE + 2)
+        self.assertEqual(len(self.memory._sorted), SORTED_CACHE_SIZE)
+
+
+class TestFilters(unittest.TestCase):
+
+    def test_should_filter_locally_like_firestore(self):
+        wheres = [("year", "!=", None), ("tags", "array_contains_any", ["art", "prose"]), ("year", "not_in", [1999]),
+                  ("year", ">", "2000"), ("title", "like", "%"), ("author.lastName", "==", "Diamond")]
+        for prop, operator, value in wheres:
+            where = {"property": prop, "operator": operator, "value": value, "local": True}
+            for book in (*BOOKS.values(), {"year": None, "title": 1}):
+                with self.subTest(where=where, book=book):
+                    expected = fake_matches(book, prop, "not-in" if operator == "not_in" else operator, value)
+                    self.assertEqual(matches(book, where), expected)
+                    self.assertEqual(ql.includes(ql.local_values(book, [prop]), [where]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
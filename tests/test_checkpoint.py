@@ -0,0 +1,137 @@
+"""Tests resuming checkpointed queries"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import checkpoint, ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+from lang.transformer import FIKLFormatType
+
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = {f"{index:02d}": {"year": 1990 + index, "title": f"Book {index}"} for index in range(10)}
+
+
+class FlakyBackend(MemoryBackend):
+    """Fails after a number of pages have been read, like a dropped connection."""
+
+    def __init__(self, collections, pages: int):
+        super().__init__(collections)
+        self.pages = pages
+        self.scans = []
+
+    def stream(self, scan):
+        self.scans.append(scan)
+        if len(self.scans) > self.pages:
+            raise ConnectionError("connection reset")
+        return super().stream(scan)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        patcher = mock.patch.object(checkpoint, "CHECKPOINT_DIR", os.path.join(self.directory.name, "checkpoints"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.previous = use_backend(MemoryBackend({"books": BOOKS}))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def export(self, format_clause: str) -> tuple[str, str]:
+        dest = os.path.join(self.directory.name, "books.out")
+        query = f'select title from books where year > 1990 order by year page 3 {format_clause} output "{dest}"'
+        return query, dest
+
+    def interrupt_and_resume(self, query: str, pages: int) -> FlakyBackend:
+        progress = checkpoint.create_checkpoint(query)
+        use_backend(FlakyBackend({"books": BOOKS}, pages))
+        with self.assertRaises(ql.QueryError):
+            ql.run_checkpointed_query(progress)
+
+        saved = checkpoint.load_checkpoint(progress["id"])
+        self.assertEqual(saved["count"], pages * 3)
+
+        backend = FlakyBackend({"books": BOOKS}, 100)
+        use_backend(backend)
+        result = json.loads(ql.run_checkpointed_query(saved)[0])
+        self.assertEqual(result["count"], 9)
+        self.assertFalse(checkpoint.checkpoint_exists(progress["id"]))
+        return backend
+
+    def test_should_resume_after_the_saved_cursor(self):
+        for format_clause in ("", "format json compact", "format csv"):
+            query, dest = self.export(format_clause)
+            ql.run_query(query)
+            with open(dest, encoding="utf-8") as file:
+                expected = file.read()
+
+            backend = self.interrupt_and_resume(query, 2)
+            with open(dest, encoding="utf-8") as file:
+                self.assertEqual(file.read(), expected, format_clause)
+            self.assertEqual(backend.scans[0]["start_after"], {"__name__": "books/06", "year": 1996})
+
+    def test_should_resume_after_the_saved_values_when_the_last_document_changed(self):
+        query, dest = self.export("")
+        ql.run_query(query)
+        with open(dest, encoding="utf-8") as file:
+            expected = file.read()
+
+        for changed in ({}, {"year": 1991, "title": "Book 6"}):
+            progress = checkpoint.create_checkpoint(query)
+            use_backend(FlakyBackend({"books": BOOKS}, 2))
+            with self.assertRaises(ql.QueryError):
+                ql.run_checkpointed_query(progress)
+
+            client = FakeClient()
+            client.load("books", {key: book for key, book in BOOKS.items() if key != "06"} | ({"06": changed} if changed else {}))
+            use_backend(FirestoreBackend(client))
+            ql.run_checkpointed_query(checkpoint.load_checkpoint(progress["id"]))
+            with open(dest, encoding="utf-8") as file:
+                self.assertEqual(file.read(), expected, changed)
+
+    def test_should_write_every_page_under_the_csv_columns_of_the_first(self):
+        notes = {"a": {"rank": 1, "title": "A"}, "b": {"rank": 2, "title": "B"}, "c": {"title": "C", "rank": 3, "year": 5}, "d": {"year": 6, "rank": 4, "title": "D"}}
+        dest = os.path.join(self.directory.name, "notes.csv")
+        progress = checkpoint.create_checkpoint(f'select * from notes order by rank page 2 format csv output "{dest}"')
+        use_backend(FlakyBackend({"notes": notes}, 1))
+        with self.assertRaises(ql.QueryError):
+            ql.run_checkpointed_query(progress)
+
+        use_backend(MemoryBackend({"notes": notes}))
+        ql.run_checkpointed_query(checkpoint.load_checkpoint(progress["id"]))
+        with open(dest, encoding="utf-8") as file:
+            self.assertEqual(file.read(), "rank,title,_path\n1,A,notes/a\n2,B,notes/b\n3,C,notes/c,5\n4,D,notes/d,6\n")
+
+    def test_should_write_an_empty_export(self):
+        dest = os.path.join(self.directory.name, "empty.json")
+        progress = checkpoint.create_checkpoint(f'select * from books where year > 3000 order by year page 5 output "{dest}"')
+        ql.run_checkpointed_query(progress)
+        with open(dest, encoding="utf-8") as file:
+            self.assertEqual(json.load(file), [])
+
+    def test_should_reject_queries_that_can_not_be_checkpointed(self):
+        for query in ('select * from books order by year page 5', 'select count * from books order by year page 5 output "x"',
+                      'select * from books order by year^ page 5 output "x"'):
+            with self.assertRaises(ql.QueryError):
+                ql.run_checkpointed_query(checkpoint.create_checkpoint(query))
+
+    def test_should_report_unknown_checkpoints(self):
+        with self.assertRaises(checkpoint.CheckpointError):
+            checkpoint.load_checkpoint("missing")
+
+    def test_should_format_pages_like_a_single_output(self):
+        documents = [{"a": 1}, {"b": [1, 2]}, {"c": "x"}]
+        for file_type in (FIKLFormatType.JSON, FIKLFormatType.JSON_COMPACT):
+            chunks = ql.output_chunk(documents[:2], file_type, True) + ql.output_chunk(documents[2:], file_type, False)
+            content = ql.output_opening(file_type) + chunks + ql.output_closing(file_type, 3)
+            self.assertEqual(content, ql.output_as(documents, file_type))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests declaring cursors and fetching documents from them"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import unittest
+
+from lang import ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(300, 11)
+
+
+class TestCursors(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.reads = 0
+
+        def count_read():
+            self.reads += 1
+        self.client.document_latency = count_read
+        self.previous = use_backend(FirestoreBackend(self.client))
+        self.addCleanup(ql.CURSOR_HOLDER.clear)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_only_read_the_documents_that_are_fetched(self):
+        query = 'select title, year from books where year > 1950 order by year, title'
+        expected = self.run_json(query)
+        self.reads = 0
+
+        self.assertEqual(self.run_json(f'declare books_by_year cursor for {query}'), {"cursor": "books_by_year"})
+        self.assertEqual(self.reads, 0)
+
+        self.assertEqual(self.run_json('fetch 50 from books_by_year'), expected[:50])
+        self.assertEqual(self.reads, 50)
+        self.assertEqual(self.run_json('fetch next from books_by_year'), expected[50:51])
+        self.assertEqual(self.run_json('fetch 20 from books_by_year'), expected[51:71])
+        self.assertEqual(self.reads, 71)
+
+        self.assertEqual(self.run_json('close books_by_year'), {"cursor": "books_by_year", "count": 71})
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('fetch 10 from books_by_year')
+
+    def test_should_evaluate_clauses_locally_and_stop_at_the_limit(self):
+        query = 'select title from books where "author.lastName"^ == "Alford" order by title limit 7'
+        use_backend(MemoryBackend({"books": BOOKS}))
+        expected = self.run_json(query)
+
+        self.run_json(f'declare alfords cursor for {query}')
+        self.assertEqual(self.run_json('fetch 5 from alfords') + self.run_json('fetch 5 from alfords'), expected)
+        self.assertEqual(self.run_json('fetch 5 from alfords'), [])
+
+    def test_should_reject_queries_that_can_not_be_streamed(self):
+        for query in ('select count * from books', 'select * at "books/1"', 'delete from books where year > 1950'):
+            with self.assertRaises(ql.QueryError):
+                ql.run_query(f'declare c cursor for {query}')
+
+
+if __name__ == '__main__':
+    unittest.main()
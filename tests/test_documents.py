@@ -0,0 +1,59 @@
+"""Tests selecting a list, or a file, of documents"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import contextlib
+import io
+import json
+import math
+import os
+import tempfile
+import unittest
+
+from lang import ql
+from lang.backend import FirestoreBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(250, 3)
+
+
+class TestDocuments(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.previous = use_backend(FirestoreBackend(self.client))
+        self.paths = [f"books/{book_id}" for book_id in reversed(BOOKS)]
+        self.paths[10:10] = ["books/missing1", "books/missing2"]
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_query(self, query: str):
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            content = ql.run_query(query)[0]
+        return (content, errors.getvalue())
+
+    def test_should_read_the_documents_in_batches_and_report_those_that_are_missing(self):
+        listed = ", ".join(f'"{path}"' for path in self.paths)
+        content, errors = self.run_query(f'select title, year at [{listed}]')
+
+        self.assertEqual(json.loads(content), [{"title": BOOKS[path[6:]]["title"], "year": BOOKS[path[6:]]["year"]}
+                                               for path in self.paths if "missing" not in path])
+        self.assertEqual(self.client.round_trips, math.ceil(len(self.paths) / ql.DOCUMENTS_BATCH_SIZE))
+        self.assertIn("2 of the documents do not exist: books/missing1, books/missing2", errors)
+
+    def test_should_read_the_paths_from_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ids.txt")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("# the books to check\n" + "\n".join(self.paths[:5]) + "\n\n")
+            content, errors = self.run_query(f'select year at from "{path}" format csv')
+
+        self.assertEqual(content.splitlines(), ["year"] + [str(BOOKS[path[6:]]["year"]) for path in self.paths[:5]])
+        self.assertEqual(errors, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
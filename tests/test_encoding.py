@@ -0,0 +1,85 @@
+"""Tests the JSON encoding of Firestore values"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import datetime
+import json
+import math
+import unittest
+from unittest import mock
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import GeoPoint
+
+from lang import encoding, ql
+from lang.backend import MemoryReference
+from lang.transformer import FIKLFormatType
+
+DOCUMENT = {
+    "created": DatetimeWithNanoseconds(2020, 1, 2, 3, 4, 5, nanosecond=123456789, tzinfo=datetime.timezone.utc),
+    "updated": datetime.datetime(2020, 1, 2, 13, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=10))),
+    "location": GeoPoint(-33.5, 151.25),
+    "author": MemoryReference("authors/armand"),
+    "checksum": b"\x00\x01fikl",
+    "tags": ["poetry"],
+    "title": "Mutants ✓",
+}
+
+EXPECTED = {
+    "created": "2020-01-02T03:04:05.123456789Z",
+    "updated": "2020-01-02T03:04:05Z",
+    "location": {"latitude": -33.5, "longitude": 151.25},
+    "author": "authors/armand",
+    "checksum": "AAFmaWts",
+    "tags": ["poetry"],
+    "title": "Mutants ✓",
+}
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_should_encode_every_firestore_type(self):
+        self.assertEqual(json.loads(encoding.dumps(DOCUMENT)), EXPECTED)
+
+    def test_should_encode_identically_without_orjson(self):
+        with mock.patch.object(encoding, "orjson", None):
+            stdlib = encoding.dumps([DOCUMENT])
+        self.assertEqual(encoding.dumps([DOCUMENT]), stdlib)
+
+    @unittest.skipIf(encoding.orjson is None, "orjson is not installed")
+    def test_should_give_the_same_output_with_and_without_orjson(self):
+        document = {
+            **DOCUMENT,
+            "groups": {DOCUMENT["created"]: 1, DOCUMENT["updated"].date(): 2, 3: "three", 1.5: None, True: [], None: {}},
+            "floats": [1e16, -2.5e-7, 0.0001, 123456.789, math.nan, math.inf, -0.0],
+            "wide": 2 ** 70,
+            "format": FIKLFormatType.CSV,
+            "nested": [{"at": DOCUMENT["updated"], "vector": {"x": 1e300}}],
+        }
+        for compact in (False, True):
+            for value in (document, {"plain": document["floats"][2:4]}, document["nested"]):
+                with self.subTest(compact=compact, value=value):
+                    with_orjson = encoding.dumps(value, compact=compact)
+                    with mock.patch.object(encoding, "orjson", None):
+                        self.assertEqual(encoding.dumps(value, compact=compact), with_orjson)
+
+        self.assertEqual(json.loads(encoding.dumps(document))["groups"], {"2020-01-02T03:04:05.123456789Z": 1, "2020-01-02": 2, "3": "three", "1.5": None, "true": [], "null": {}})
+        self.assertEqual(json.loads(encoding.dumps(document))["floats"][4:], [None, None, -0.0])
+
+    def test_should_output_compact_json(self):
+        content = ql.output_as({"a": [1, 2]}, FIKLFormatType.JSON_COMPACT)
+        self.assertEqual(content, '{"a":[1,2]}')
+        self.assertEqual(ql.output_as({"a": 1}, FIKLFormatType.JSON), '{\n  "a": 1\n}')
+
+    def test_should_encode_grouped_keys(self):
+        grouped = {DOCUMENT["created"]: [{"title": "A"}]}
+        with mock.patch.object(encoding, "orjson", None):
+            self.assertEqual(json.loads(encoding.dumps(grouped)), {"2020-01-02T03:04:05.123456789Z": [{"title": "A"}]})
+
+    def test_should_encode_csv_values(self):
+        content = ql.output_as([DOCUMENT], FIKLFormatType.CSV)
+        self.assertIn("2020-01-02T03:04:05.123456789Z", content)
+        self.assertIn("authors/armand", content)
+        self.assertIn("location.latitude", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Tests the bulk export of collections"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import export, ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.fake_firestore import FakeClient
+
+COLLECTIONS = {
+    "users": {f"u{index}": {"name": f"User {index}"} for index in range(7)},
+    "users/u1/orders": {"o1": {"total": 10}, "o2": {"total": 20}},
+    "users/u1/orders/o1/items": {"i1": {"sku": "a"}},
+    "users/u4/orders": {"o3": {"total": 30}},
+    "products": {"p1": {"name": "Product"}},
+}
+
+
+def firestore_backend() -> FirestoreBackend:
+    client = FakeClient()
+    for path, documents in COLLECTIONS.items():
+        client.load(path, documents)
+    return FirestoreBackend(client)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        self.previous = use_backend(MemoryBackend(COLLECTIONS))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def read_export(self, dest: str) -> tuple[dict, dict]:
+        with open(os.path.join(dest, export.MANIFEST_FILE), encoding="utf-8") as file:
+            manifest = json.load(file)
+
+        documents = {}
+        for shard in manifest["shards"]:
+            path = os.path.join(dest, shard["file"])
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as file:
+                lines = [json.loads(line) for line in file]
+            self.assertEqual(len(lines), shard["documents"])
+            documents.update({line.pop("_path"): line for line in lines})
+        return manifest, documents
+
+    def test_should_export_subcollection_trees(self):
+        for backend in (MemoryBackend(COLLECTIONS), firestore_backend()):
+            dest = os.path.join(self.directory.name, backend.name)
+            use_backend(backend)
+            result = json.loads(ql.run_query(f'export from users recursive to "{dest}"')[0])
+
+            manifest, documents = self.read_export(dest)
+            self.assertEqual(result["count"], 11)
+            self.assertEqual(manifest["collections"], {"users": 7, "users/u1/orders": 2,
+                                                       "users/u1/orders/o1/items": 1, "users/u4/orders": 1})
+            self.assertEqual(documents["users/u1/orders/o1/items/i1"], {"sku": "a"})
+            self.assertNotIn("products/p1", documents)
+
+    def test_should_write_gzip_shards_in_parallel(self):
+        dest = os.path.join(self.directory.name, "users")
+        with mock.patch.object(export, "EXPORT_SHARD_SIZE", 2), mock.patch.object(export, "EXPORT_PAGE_SIZE", 3):
+            ql.run_query(f'export from users to "{dest}" gzip')
+
+        manifest, documents = self.read_export(dest)
+        self.assertEqual(len(documents), 7)
+        self.assertTrue(all(shard["file"].endswith(".ndjson.gz") for shard in manifest["shards"]))
+        self.assertGreater(len(manifest["shards"]), 3)
+
+    def test_should_export_collection_groups(self):
+        use_backend(firestore_backend())
+        dest = os.path.join(self.directory.name, "orders")
+        ql.run_query(f'export within orders to "{dest}"')
+
+        _, documents = self.read_export(dest)
+        self.assertEqual(sorted(documents), ["users/u1/orders/o1", "users/u1/orders/o2", "users/u4/orders/o3"])
+
+    def test_should_only_export_the_documents_that_changed_since_the_last_run(self):
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        events = {f"e{index:02d}": {"index": index, "updated": start + datetime.timedelta(minutes=index // 2)} for index in range(20)}
+        events["draft"] = {"index": -1}
+        client = FakeClient()
+        client.load("events", events)
+        use_backend(FirestoreBackend(client))
+        watermarks = os.path.join(self.directory.name, "watermarks.json")
+        for patcher in (mock.patch.dict(export.WATERMARK_HOLDER, {"saved": None}),
+                        mock.patch.object(export, "WATERMARK_FILE", watermarks),
+                        mock.patch.object(export, "EXPORT_PAGE_SIZE", 3)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        dest = os.path.join(self.directory.name, "events")
+        query = f'export from events incremental on updated to "{dest}"'
+        first = json.loads(ql.run_query(query)[0])
+        self.assertEqual(first["count"], 20)
+        self.assertEqual(first["watermark"], "2024-01-01T00:09:00Z")
+
+        client.write("update", "events/e03", {"updated": start + datetime.timedelta(hours=1)})
+        client.write("create", "events/tie", {"index": 99, "updated": start + datetime.timedelta(minutes=9)})
+        client.round_trips = 0
+        second = json.loads(ql.run_query(query)[0])
+
+        self.assertEqual(second["count"], 2)
+        self.assertEqual(client.round_trips, 2)
+        manifest, documents = self.read_export(dest)
+        self.assertEqual(manifest["documents"], 22)
+        self.assertEqual(len(manifest["shards"]), 2)
+        self.assertEqual(documents["events/e03"]["updated"], "2024-01-01T01:00:00Z")
+        self.assertNotIn("events/draft", documents)
+        with open(watermarks, encoding="utf-8") as file:
+            self.assertEqual([mark["paths"] for mark in json.load(file)["firestore:fake-project"].values()], [["events/e03"]])
+
+        self.assertEqual(json.loads(ql.run_query(query)[0])["count"], 0)
+
+    def test_should_not_export_subcollections_incrementally(self):
+        with self.assertRaises(ql.QueryError):
+            ql.run_query(f'export from users recursive incremental on updated to "{self.directory.name}"')
+
+
+if __name__ == '__main__':
+    unittest.main()
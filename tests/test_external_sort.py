@@ -0,0 +1,94 @@
+"""Tests sorting records that do not fit in memory by spilling sorted runs to files"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import datetime
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from lang import ql, record
+from lang.backend import MemoryBackend, use_backend
+from lang.record import FIKLRecord, sort_records
+
+from benchmarks.data import generate_books
+
+BOOKS = generate_books(600, 17)
+ORDERS = [{"property": "year", "direction": "desc", "local": True},
+          {"property": "rating", "direction": None, "local": True}]
+
+
+class TestExternalSort(unittest.TestCase):
+
+    def setUp(self):
+        self.files = []
+        temporary_file = tempfile.TemporaryFile
+
+        def track():
+            file = temporary_file()
+            self.files.append(file)
+            return file
+        for patcher in (mock.patch.dict(record.SORT_SETTINGS, {"memory": 4000}),
+                        mock.patch.object(record.tempfile, "TemporaryFile", track)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def records(self) -> list[FIKLRecord]:
+        values = [{"year": book["year"], "rating": book["rating"]} for book in BOOKS.values()]
+        values[::7] = [{"rating": 1}] * len(values[::7])
+        values[::11] = [{"year": "unknown", "rating": 2}] * len(values[::11])
+        return [FIKLRecord(f"books/{book_id}", book, value) for (book_id, book), value in zip(BOOKS.items(), values)]
+
+    def test_should_merge_the_spilled_runs_in_the_order_of_an_in_memory_sort(self):
+        with mock.patch.dict(record.SORT_SETTINGS, {"memory": 2**30}):
+            expected = [(item.path, item.document, item.values) for item in sort_records(self.records(), ORDERS)]
+        self.assertEqual(self.files, [])
+
+        spilled = sort_records(self.records(), ORDERS)
+        self.assertGreater(len(self.files), 10)
+        self.assertEqual([(item.path, item.document, item.values) for item in spilled], expected)
+        self.assertTrue(all(file.closed for file in self.files))
+
+    def test_should_keep_the_values_that_pickle_does_not_restore(self):
+        timestamp = DatetimeWithNanoseconds(2024, 1, 2, 3, 4, 5, nanosecond=123456789, tzinfo=datetime.timezone.utc)
+        records = [FIKLRecord(f"events/{index:04d}", {"at": timestamp, "index": index}, {"index": -index}) for index in range(500)]
+
+        spilled = list(sort_records(records, [{"property": "index", "direction": "asc", "local": True}]))
+        self.assertGreater(len(self.files), 1)
+        self.assertEqual([item.document["index"] for item in spilled], list(range(499, -1, -1)))
+        self.assertEqual(spilled[0].document["at"].nanosecond, 123456789)
+
+    def test_should_stream_a_locally_sorted_query(self):
+        query = 'select title, year from books where pages > 300 order by year^ desc, title^'
+        previous = use_backend(MemoryBackend({"books": BOOKS}))
+        self.addCleanup(use_backend, previous)
+        with mock.patch.dict(record.SORT_SETTINGS, {"memory": 2**30}):
+            expected = json.loads(ql.run_query(query)[0])
+
+        self.assertEqual(json.loads(ql.run_query(query)[0]), expected)
+        self.assertGreater(len(self.files), 1)
+
+    def test_should_write_a_locally_sorted_query_to_a_file_as_it_is_merged(self):
+        query = 'select title, year from books where pages > 300 order by year^ desc, title^'
+        previous = use_backend(MemoryBackend({"books": BOOKS}))
+        self.addCleanup(use_backend, previous)
+        with mock.patch.dict(record.SORT_SETTINGS, {"memory": 2**30}):
+            expected = json.loads(ql.run_query(query)[0])
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(ql, "OUTPUT_BATCH_SIZE", 50), \
+                mock.patch.object(ql, "execute_select_query", side_effect=AssertionError("the records were listed")), \
+                mock.patch.object(ql, "output_chunk", wraps=ql.output_chunk) as output_chunk:
+            result = json.loads(ql.run_query(f'{query} output "{directory}/books.json"')[0])
+            with open(f"{directory}/books.json", encoding="utf-8") as file:
+                self.assertEqual(json.load(file), expected)
+
+        self.assertEqual(result["count"], len(expected))
+        self.assertEqual(output_chunk.call_count, -(-len(expected) // 50))
+        self.assertGreater(len(self.files), 1)
+        self.assertTrue(all(file.closed for file in self.files))
+
+
+if __name__ == '__main__':
+    unittest.main()
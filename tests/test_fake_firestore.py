@@ -0,0 +1,94 @@
+"""Tests the in-memory Firestore stand-in that is used by the benchmarks"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import datetime
+import unittest
+from unittest import mock
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from benchmarks import fake_firestore
+from benchmarks.fake_firestore import FakeClient
+from benchmarks.suite import run_suite
+
+
+class TestFakeFirestore(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", {
+            "a": {"year": 2001, "title": "A", "author": {"lastName": "Diamond"}},
+            "b": {"year": 1999, "title": "B", "author": {"lastName": "Leroi"}},
+            "c": {"year": 2005, "title": "C", "author": {"lastName": "Diamond"}},
+        })
+        self.client.load("books/a/reviews", {"r1": {"stars": 5}})
+
+    def test_should_filter_with_field_filters(self):
+        docs = self.client.collection("books").where(filter=FieldFilter("author.lastName", "==", "Diamond")).get()
+        self.assertEqual([doc.id for doc in docs], ["a", "c"])
+
+    def test_should_order_and_page_with_start_after(self):
+        query = self.client.collection("books").order_by("year", direction="DESCENDING").limit(2)
+        first = query.get()
+        second = query.start_after(first[-1]).get()
+        self.assertEqual([doc.id for doc in first], ["c", "a"])
+        self.assertEqual([doc.id for doc in second], ["b"])
+
+    def test_should_project_selected_fields(self):
+        doc = self.client.collection("books").select(["author.lastName"]).get()[0]
+        self.assertEqual(doc.to_dict(), {"author": {"lastName": "Diamond"}})
+
+    def test_should_query_collection_groups(self):
+        docs = self.client.collection_group("reviews").get()
+        self.assertEqual([doc.reference.path for doc in docs], ["books/a/reviews/r1"])
+
+    def test_should_list_collections(self):
+        self.assertEqual([coll.id for coll in self.client.collections()], ["books"])
+        self.assertEqual([coll.id for coll in self.client.document("books/a").collections()], ["reviews"])
+
+    def test_should_apply_batched_writes_in_one_round_trip(self):
+        batch = self.client.batch()
+        batch.update(self.client.document("books/a"), {"author.firstName": "Neil"})
+        batch.delete(self.client.document("books/b"))
+        before = self.client.round_trips
+        batch.commit()
+        self.assertEqual(self.client.round_trips, before + 1)
+        self.assertEqual(self.client.read("books/a")["author"], {"lastName": "Diamond", "firstName": "Neil"})
+        self.assertIsNone(self.client.read("books/b"))
+
+    def test_should_apply_every_write_of_a_batch_or_none(self):
+        batch = self.client.batch()
+        batch.create(self.client.document("books/d"), {"title": "D"})
+        batch.update(self.client.document("books/a"), {"year": 2002})
+        batch.create(self.client.document("books/b"), {"title": "Duplicate"})
+        with self.assertRaises(ValueError):
+            batch.commit()
+        self.assertIsNone(self.client.read("books/d"))
+        self.assertEqual(self.client.read("books/a")["year"], 2001)
+
+        batch = self.client.batch()
+        batch.delete(self.client.document("books/c"))
+        batch.update(self.client.document("books/c"), {"year": 2006})
+        with self.assertRaises(ValueError):
+            batch.commit()
+        self.assertEqual(self.client.read("books/c")["year"], 2005)
+
+    def test_should_only_keep_the_versions_of_documents_that_can_be_read(self):
+        before = datetime.datetime.now(datetime.timezone.utc)
+        self.client.document("books/a").update({"year": 2002, "author.lastName": "Marie"})
+        self.assertEqual(self.client.read("books/a", before), {"year": 2001, "title": "A", "author": {"lastName": "Diamond"}})
+        self.assertEqual(self.client.read("books/a"), {"year": 2002, "title": "A", "author": {"lastName": "Marie"}})
+
+        with mock.patch.object(fake_firestore, "HISTORY_RETENTION", datetime.timedelta(0)):
+            self.client.document("books/b").delete()
+            with self.assertRaises(exceptions.InvalidArgument):
+                self.client.read("books/a", before)
+        self.assertEqual(len(self.client._history), 1)
+
+    def test_should_run_the_benchmark_suite(self):
+        results = run_suite([20], repeat=1, only=["filter_local", "serialize_csv"])
+        self.assertEqual([result["case"] for result in results["results"]], ["filter_local", "serialize_csv"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -214,6 +214,117 @@ class TestTransformer(unittest.TestCase):
         self.assertEqual(query["output"], "~/output.json")
         self.assertEqual(query["format"], FIKLFormatType.JSON)
 
+    def test_should_parse_compact_json_format(self):
+        query = parse('select * from COLLECTION format json compact output "~/output.json"')
+        self.assertEqual(query["format"], FIKLFormatType.JSON_COMPACT)
+
+    def test_should_parse_field_transforms(self):
+        query = parse('update from COLLECTION set views = views + 1, stock = stock -2, tags = array_union(["a", "b"]), old = array_remove([1]), updated = server_timestamp(), legacy = delete() where a == 1')
+
+        self.assertEqual([(setter["property"], setter["transform"], setter["value"]) for setter in query["set"]], [
+            ("views", "increment", 1),
+            ("stock", "increment", -2),
+            ("tags", "array_union", ["a", "b"]),
+            ("old", "array_remove", [1]),
+            ("updated", "server_timestamp", None),
+            ("legacy", "delete", None),
+        ])
+
+        with self.assertRaises(QuerySyntaxError):
+            parse('update at "COLLECTION/DOC" set views = likes + 1')
+
+    def test_should_parse_valid_multi_row_insert(self):
+        query = parse('insert into COLLECTION (isbn, "author.lastName", tags) values ("1", "Leroi", ["a"]), ("2", null, ["b"]) identified by isbn')
+
+        self.assertEqual(query["query_type"], FIKLQueryType.INSERT)
+        self.assertEqual(query["identifier"], "isbn")
+        self.assertEqual(len(query["rows"]), 2)
+        self.assertEqual(query["rows"][0][1], {"property": "author.lastName", "value": "Leroi"})
+        self.assertEqual(query["rows"][0][2]["value"], ["a"])
+        self.assertIsNone(query["rows"][1][1]["value"])
+
+        with self.assertRaises(QuerySyntaxError):
+            parse('insert into COLLECTION (isbn, title) values ("1")')
+
+    def test_should_accept_values_as_a_name(self):
+        query = parse('insert into values (values, title) values (1, "A") identified by values')
+        self.assertEqual((query["subject"], query["identifier"]), ("values", "values"))
+        self.assertEqual(query["rows"][0][1], {"property": "title", "value": "A"})
+
+        query = parse('select values from values where values == 1 order by values')
+        self.assertEqual((query["fields"], query["subject"]), (["values"], "values"))
+        self.assertEqual(query["where"][0]["property"], "values")
+
+    def test_should_accept_analyze_as_a_name(self):
+        query = parse('analyze from analyze sample 10')
+        self.assertEqual((query["query_type"], query["subject"]), (FIKLQueryType.ANALYZE, "analyze"))
+
+        query = parse('select analyze from books where analyze == true')
+        self.assertEqual((query["fields"], query["where"][0]["property"]), (["analyze"], "analyze"))
+
+    def test_should_accept_cursor_and_next_as_names(self):
+        query = parse('declare books cursor for select cursor, next from next order by cursor')
+        self.assertEqual(query["query"]["fields"], ["cursor", "next"])
+        self.assertEqual((query["query"]["subject"], query["query"]["order"][0]["property"]), ("next", "cursor"))
+
+        query = parse('fetch next from books')
+        self.assertEqual((query["cursor"], query["count"]), ("books", 1))
+
+    def test_should_accept_join_as_a_name(self):
+        query = parse('select join from join join authors on join = __name__ where join != null')
+        self.assertEqual((query["fields"], query["subject"]), (["join"], "join"))
+        self.assertEqual((query["join"]["collection"], query["join"]["field"]), ("authors", "join"))
+
+    def test_should_accept_index_as_a_name(self):
+        query = parse('select * from index where index > 1')
+        self.assertEqual((query["subject"], query["where"][0]["property"]), ("index", "index"))
+
+        query = parse('create local index on index (index)')
+        self.assertEqual((query["subject"], query["field"]), ("index", "index"))
+
+    def test_should_accept_sample_and_percent_as_names(self):
+        query = parse('select sample, percent from sample where percent > 1 sample 10 percent')
+        self.assertEqual((query["fields"], query["subject"]), (["sample", "percent"], "sample"))
+        self.assertEqual(query["where"][0]["property"], "percent")
+        self.assertEqual(query["sample"], {"size": None, "percent": 10.0})
+
+    def test_should_accept_snapshot_as_a_name(self):
+        query = parse('select snapshot from snapshot as of "2024-01-01T00:00:00Z" order by snapshot')
+        self.assertEqual((query["fields"], query["subject"]), (["snapshot"], "snapshot"))
+        self.assertEqual(query["order"][0]["property"], "snapshot")
+
+        query = parse('begin snapshot')
+        self.assertEqual(query["query_type"], FIKLQueryType.BEGIN_SNAPSHOT)
+
+    def test_should_accept_use_as_a_name(self):
+        query = parse('select use from use where use == true')
+        self.assertEqual((query["fields"], query["subject"]), (["use"], "use"))
+
+        query = parse('use use, "other/db"')
+        self.assertEqual(query["databases"], ["use", "other/db"])
+
+    def test_should_parse_valid_import(self):
+        query = parse('import into COLLECTION from "~/books.csv" identified by isbn')
+
+        self.assertEqual(query["query_type"], FIKLQueryType.IMPORT)
+        self.assertEqual(query["subject"], "COLLECTION")
+        self.assertEqual(query["source"], "~/books.csv")
+        self.assertEqual(query["identifier"], "isbn")
+
+    def test_should_parse_valid_export(self):
+        query = parse('export from COLLECTION recursive to "~/dumps/collection" gzip')
+
+        self.assertEqual(query["query_type"], FIKLQueryType.EXPORT)
+        self.assertEqual(query["subject_type"], FIKLSubjectType.COLLECTION)
+        self.assertEqual(query["output"], "~/dumps/collection")
+        self.assertTrue(query["recursive"])
+        self.assertTrue(query["compress"])
+
+        query = parse('export within COLLECTION to "~/dumps/collection"')
+        self.assertEqual(query["subject_type"], FIKLSubjectType.COLLECTION_GROUP)
+        self.assertFalse(query["recursive"])
+        self.assertFalse(query["compress"])
+
     def test_should_parse_valid_insert(self):
         query = parse('insert into COLLECTION set some_field = 2000, some_other_field = "ABC", "some.nested.field" = "something" identified by "ABCD"')
 
@@ -236,6 +347,21 @@ class TestTransformer(unittest.TestCase):
 
         self.assertEqual(query["identifier"], None)
 
+    def test_should_parse_valid_explain(self):
+        query = parse('explain select * from COLLECTION where some_field == 2000')
+
+        self.assertEqual(query["query_type"], FIKLQueryType.EXPLAIN)
+        self.assertEqual(query["query"]["query_type"], FIKLQueryType.SELECT)
+        self.assertEqual(query["query"]["where"][0]["value"], 2000)
+
+    def test_should_parse_valid_analyze(self):
+        query = parse('analyze within COLLECTION sample 500')
+
+        self.assertEqual(query["query_type"], FIKLQueryType.ANALYZE)
+        self.assertEqual(query["subject_type"], FIKLSubjectType.COLLECTION_GROUP)
+        self.assertEqual(query["sample"], 500)
+        self.assertIsNone(parse('analyze from COLLECTION')["sample"])
+
     def test_should_not_parse_document_select_that_has_where(self):
         with self.assertRaises(QuerySyntaxError):
             parse("""
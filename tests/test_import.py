@@ -0,0 +1,75 @@
+"""Tests importing documents from files"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from lang import ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.fake_firestore import FakeClient
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        self.memory = MemoryBackend()
+        self.previous = use_backend(self.memory)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def write_file(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_import_csv_with_dotted_columns(self):
+        path = self.write_file("books.csv", 'isbn,title,year,"author.lastName",zip\n001,Mutants,2005,Leroi,0800\n002,Cosmos,,Sagan,2000\n')
+        self.assertEqual(self.run_json(f'import into books from "{path}" identified by isbn'), {"count": 2})
+
+        books = self.run_json('select * from books order by title')
+        self.assertEqual(books[0], {"title": "Cosmos", "year": None, "author": {"lastName": "Sagan"}, "zip": 2000, "_path": "books/002"})
+        self.assertEqual(books[1]["zip"], "0800")
+        self.assertEqual(books[1]["year"], 2005)
+
+    def test_should_import_an_export(self):
+        self.memory.add("books", {"title": "Mutants", "author": {"lastName": "Leroi"}}, "mutants")
+        dest = os.path.join(self.directory.name, "export")
+        ql.run_query(f'export from books to "{dest}" gzip')
+        shard = os.path.join(dest, "books", "000-00000.ndjson.gz")
+
+        self.run_json(f'import into copies from "{shard}" identified by _path')
+        self.assertEqual(self.run_json('select * at "copies/mutants"'), [{"title": "Mutants", "author": {"lastName": "Leroi"}, "_path": "copies/mutants"}])
+
+    def test_should_generate_ids_without_an_identifier(self):
+        path = self.write_file("books.ndjson", '{"title": "A"}\n\n{"title": "B"}\n')
+        self.run_json(f'import into books from "{path}"')
+        self.assertEqual(self.run_json('select count * from books'), 2)
+
+    def test_should_reject_records_without_an_identifier(self):
+        path = self.write_file("books.ndjson", '{"isbn": "1"}\n{"title": "B"}\n')
+        with self.assertRaises(ql.QueryError):
+            ql.run_query(f'import into books from "{path}" identified by isbn')
+
+    def test_should_commit_in_batches(self):
+        client = FakeClient()
+        use_backend(FirestoreBackend(client))
+        path = self.write_file("books.ndjson.gz", "".join(json.dumps({"id": index}) + "\n" for index in range(1201)))
+
+        self.assertEqual(self.run_json(f'import into books from "{path}" identified by id'), {"count": 1201})
+        self.assertEqual(client.round_trips, 3)
+        self.assertEqual(self.run_json('select count * from books'), 1201)
+
+
+if __name__ == '__main__':
+    unittest.main()
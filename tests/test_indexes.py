@@ -0,0 +1,113 @@
+"""Tests suggesting composite indexes from the logged queries"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import indexes, planner, ql, stats
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(200, 7)
+
+RANGE_QUERY = 'select title from books where "author.lastName" == "Alford" and year > 2000 order by year, title limit 5'
+ORDER_QUERY = 'select title from books where "author.lastName" == "Alford" order by year'
+PUBLISHED_QUERY = 'select title from books where published == true order by year'
+MERGED_QUERY = 'select title from books where published == true and "author.lastName" == "Alford" order by year'
+LOCAL_QUERY = 'select title from books where tags array_contains "art" and pages^ > 1000'
+EQUALITY_QUERY = 'select title from books where published == true and "author.lastName" == "Alford"'
+
+
+def entry(where: list[tuple], order: list[tuple] = ()) -> dict:
+    return {"collection": "books", "query_scope": "COLLECTION", "missing_index": True,
+            "where": [{"field": field, "operator": operator, "remote": True} for field, operator in where],
+            "order": [{"field": field, "operator": direction, "remote": True} for field, direction in order]}
+
+
+class TestIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        for patcher in (mock.patch.dict(planner.PLACEMENT_HOLDER, {"saved": None}),
+                        mock.patch.dict(stats.STATS_HOLDER, {"saved": None}),
+                        mock.patch.object(planner, "PLACEMENT_FILE", os.path.join(self.directory.name, "placements.json")),
+                        mock.patch.object(stats, "STATS_FILE", os.path.join(self.directory.name, "stats.json")),
+                        mock.patch.object(indexes, "QUERY_LOG_FILE", os.path.join(self.directory.name, "queries.ndjson")),
+                        mock.patch.dict(planner.PLANNER_SETTINGS, {"placement": "auto"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.path = os.path.join(self.directory.name, "firestore.indexes.json")
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.client.indexes = set()
+        self.previous = use_backend(FirestoreBackend(self.client))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_suggest_the_indexes_that_queries_need(self):
+        remote = (RANGE_QUERY, ORDER_QUERY, PUBLISHED_QUERY, MERGED_QUERY)
+        for query in remote + (LOCAL_QUERY, EQUALITY_QUERY, RANGE_QUERY):
+            self.run_json(query)
+
+        self.assertEqual(self.run_json(f'indexes suggest to "{self.path}"'), {"count": 4, "dest": self.path})
+        with open(self.path, encoding="utf-8") as file:
+            declared = json.load(file)
+        self.assertEqual(declared, {"fieldOverrides": [], "indexes": [
+            {"collectionGroup": "books", "queryScope": "COLLECTION", "fields": [
+                {"fieldPath": "author.lastName", "order": "ASCENDING"},
+                {"fieldPath": "year", "order": "ASCENDING"},
+                {"fieldPath": "title", "order": "ASCENDING"}]},
+            {"collectionGroup": "books", "queryScope": "COLLECTION", "fields": [
+                {"fieldPath": "author.lastName", "order": "ASCENDING"},
+                {"fieldPath": "year", "order": "ASCENDING"}]},
+            {"collectionGroup": "books", "queryScope": "COLLECTION", "fields": [
+                {"fieldPath": "published", "order": "ASCENDING"},
+                {"fieldPath": "year", "order": "ASCENDING"}]},
+            {"collectionGroup": "books", "queryScope": "COLLECTION", "fields": [
+                {"fieldPath": "tags", "arrayConfig": "CONTAINS"},
+                {"fieldPath": "pages", "order": "ASCENDING"}]}]})
+
+        self.client.indexes = {(index["collectionGroup"], index["queryScope"] == "COLLECTION_GROUP",
+                                tuple(field["fieldPath"] for field in index["fields"]))
+                               for index in declared["indexes"]}
+        planner.PLACEMENT_HOLDER["saved"] = {}
+        self.client.round_trips = 0
+        for query in remote:
+            self.run_json(query)
+        self.assertEqual(self.client.round_trips, len(remote))
+
+        self.assertEqual(self.run_json('indexes suggest')["indexes"], declared["indexes"][3:])
+        self.assertEqual(self.run_json(f'indexes suggest to "{self.path}"'), {"count": 0, "dest": self.path})
+
+    def test_should_only_keep_indexes_that_no_other_index_serves(self):
+        wider, equalities = indexes.required_index(entry([("a", "=="), ("b", "=="), ("c", ">")], [("c", "desc")]))
+        self.assertEqual(equalities, 2)
+        self.assertEqual([field.get("order") for field in wider["fields"]], ["ASCENDING", "ASCENDING", "DESCENDING"])
+
+        swapped, _ = indexes.required_index(entry([("b", "=="), ("a", "=="), ("c", ">")], [("c", "desc")]))
+        self.assertTrue(indexes.is_served(swapped, 2, [wider]))
+        narrower, equalities = indexes.required_index(entry([("a", "==")], [("c", "desc")]))
+        self.assertFalse(indexes.is_served(narrower, equalities, [wider]))
+        self.assertFalse(indexes.is_served(wider, 2, [narrower]))
+        other, _ = indexes.required_index(entry([("b", "==")], [("c", "desc")]))
+        self.assertTrue(indexes.is_served(wider, 2, [narrower, other]))
+        self.assertIsNone(indexes.required_index(entry([("a", "=="), ("b", "in")])))
+
+    def test_should_not_suggest_indexes_for_the_memory_backend(self):
+        use_backend(MemoryBackend({"books": BOOKS}))
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('indexes suggest')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests joining the documents of a query with a related collection"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import math
+import unittest
+
+from lang import join, ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.fake_firestore import FakeClient
+
+CUSTOMERS = {f"c{index:02d}": {"name": f"Customer {index}", "tier": index % 3} for index in range(40)}
+ORDERS = {f"o{index:03d}": {"customer": f"c{index % 45:02d}", "total": index} for index in range(250)}
+
+
+class TestJoin(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("customers", CUSTOMERS)
+        self.client.load("orders", ORDERS)
+        self.previous = use_backend(FirestoreBackend(self.client))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_join_on_the_document_id_in_batches(self):
+        orders = self.run_json('select total, "customers.name" from orders join customers on customer = __name__ order by total')
+
+        # the 45 customers are all read with the first batch, later batches are served by the cache
+        self.assertEqual(self.client.round_trips, 2)
+        self.assertEqual(orders[0], {"total": 0, "customers": {"name": "Customer 0"}})
+        self.assertEqual(orders[44], {"total": 44, "customers": None})
+        self.assertEqual(len(orders), len(ORDERS))
+
+    def test_should_join_on_a_field_with_in_queries(self):
+        customers = self.run_json('select name, "orders.total" from customers join orders on __name__ = customer where tier == 1 order by name')
+
+        self.assertEqual(len(customers), 13)
+        for customer in customers:
+            number = int(customer["name"].split()[1])
+            self.assertEqual(sorted(order["total"] for order in customer["orders"]), [total for total in range(250) if total % 45 == number])
+        self.assertEqual(self.client.round_trips, 1 + math.ceil(13 / join.JOIN_IN_SIZE))
+
+    def test_should_join_the_same_way_in_memory(self):
+        query = 'select * from orders join customers on customer = __name__ where total < 5 limit 2'
+        expected = self.run_json(query)
+        use_backend(MemoryBackend({"customers": CUSTOMERS, "orders": ORDERS}))
+
+        self.assertEqual(self.run_json(query), expected)
+        self.assertEqual(expected[1]["customers"], {**CUSTOMERS["c01"], "_path": "customers/c01"})
+        self.assertEqual(self.run_json(f'explain {query}')["join"]["lookup"], "get_all")
+
+    def test_should_not_join_booleans_with_numbers(self):
+        self.client.load("flags", {"yes": {"value": True}, "one": {"value": 1}, "zero": {"value": 0.0}})
+        self.client.load("items", {"a": {"flag": True, "rank": 0}, "b": {"flag": 1, "rank": 1}, "c": {"flag": 0, "rank": 2}, "d": {"flag": False, "rank": 3}})
+
+        items = self.run_json('select rank, flags from items join flags on flag = value order by rank')
+
+        self.assertEqual([[flag["_path"] for flag in item["flags"]] for item in items], [["flags/yes"], ["flags/one"], ["flags/zero"], []])
+
+    def test_should_only_keep_the_joined_documents_of_recent_keys(self):
+        self.client.load("sales", {f"s{index:04d}": {"buyer": f"b{index % 1000:03d}", "total": index} for index in range(2000)})
+        self.client.load("buyers", {f"b{index:03d}": {"name": f"Buyer {index}"} for index in range(1000)})
+
+        totals = self.run_json('select total, "buyers.name" from sales join buyers on buyer = __name__ order by total')
+
+        # the keys of the first 1000 sales are evicted before they come back
+        self.assertEqual(self.client.round_trips, 1 + 2 * 1000 // join.JOIN_BATCH_SIZE)
+        self.assertEqual(totals[1500], {"total": 1500, "buyers": {"name": "Buyer 500"}})
+        self.assertEqual(len(totals), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests the local indexes of the memory backend"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import unittest
+
+from lang import ql
+from lang.backend import FieldIndex, FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(400, 13)
+
+QUERIES = (
+    'select title from books where year > 1950 and year <= 1990 order by title',
+    'select title from books where year in [1950, 1960, 1970] and pages >= 700 order by title',
+    'select title from books where tags array_contains "art" order by year, title',
+    'select title from books where tags array_contains_any ["art", "war"] order by title',
+    'select title, pages from books where pages^ > 1000 and "author.lastName"^ == "Alford" order by title',
+    'select title, year from books where pages^ < 200 order by year^ desc, title^',
+    'select title from books where year >= 2000 order by year, title page 25',
+)
+
+
+class TestLocalIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.backend = MemoryBackend({"books": BOOKS})
+        self.previous = use_backend(self.backend)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_return_the_same_documents_as_firestore(self):
+        for query in QUERIES:
+            use_backend(FirestoreBackend(self.client))
+            expected = self.run_json(query)
+            use_backend(self.backend)
+            with self.subTest(query=query):
+                self.assertEqual(self.run_json(query), expected)
+                self.assertGreater(len(expected), 0)
+
+    def test_should_only_read_the_candidates_of_the_narrowest_index(self):
+        index = FieldIndex("year", BOOKS)
+        for operator in ("<", "<=", ">", ">="):
+            where = {"property": "year", "operator": operator, "value": 1980, "local": False}
+            expected = sorted(book_id for book_id, book in BOOKS.items()
+                              if ql.local_compare(book, "year", where))
+            self.assertEqual(sorted(index.candidates(where)), expected)
+            self.assertEqual(index.size(where), len(expected))
+
+        tags = FieldIndex("tags", BOOKS)
+        where = {"property": "tags", "operator": "array_contains", "value": "art", "local": False}
+        self.assertEqual(sorted(tags.candidates(where)), sorted(book_id for book_id, book in BOOKS.items() if "art" in book["tags"]))
+        self.assertEqual(index.size({"property": "year", "operator": ">", "value": "1980", "local": False}), 0)
+
+    def test_should_keep_the_indexes_up_to_date_as_documents_are_written(self):
+        self.assertEqual(self.run_json('create local index on books(year)'), {"collection": "books", "field": "year", "count": len(BOOKS)})
+        self.assertEqual(self.run_json('create local index on books(tags)')["count"], len(BOOKS))
+        deleted = next(book_id for book_id, book in BOOKS.items() if book["year"] == 1901)
+
+        ql.run_query('update at "books/book00000001" set year = 1800')
+        ql.run_query('update from books set year = 2100 where year == 1900')
+        ql.run_query('insert into books set title = "New", year = 1801, tags = ["art"] identified by "new"')
+        ql.run_query(f'delete at "books/{deleted}"')
+
+        books = {book_id: dict(book) for book_id, book in BOOKS.items() if book_id != deleted}
+        books["book00000001"]["year"] = 1800
+        for book in books.values():
+            book["year"] = 2100 if book["year"] == 1900 else book["year"]
+        books["new"] = {"title": "New", "year": 1801, "tags": ["art"]}
+
+        self.assertEqual(self.run_json('select year from books where year < 1905 order by year'),
+                         [{"year": year} for year in sorted(book["year"] for book in books.values() if book["year"] < 1905)])
+        self.assertEqual(self.run_json('select title from books where year > 2050 order by title'),
+                         [{"title": title} for title in sorted(book["title"] for book in books.values() if book["year"] > 2050)])
+        self.assertIn({"title": "New"}, self.run_json('select title from books where tags array_contains "art"'))
+
+    def test_should_not_create_local_indexes_for_firestore(self):
+        use_backend(FirestoreBackend(self.client))
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('create local index on books(year)')
+
+
+if __name__ == '__main__':
+    unittest.main()
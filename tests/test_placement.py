@@ -0,0 +1,97 @@
+"""Tests the automatic placement of clauses when Firestore is missing an index"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import planner, ql, stats
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+from lang.planner import plan_query, place_on_single_field_indexes, query_shape
+from lang.transformer import parse
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(500, 42)
+
+
+class TestPlacement(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        for patcher in (mock.patch.dict(planner.PLACEMENT_HOLDER, {"saved": None}),
+                        mock.patch.dict(stats.STATS_HOLDER, {"saved": None}),
+                        mock.patch.object(planner, "PLACEMENT_FILE", os.path.join(self.directory.name, "placements.json")),
+                        mock.patch.object(stats, "STATS_FILE", os.path.join(self.directory.name, "stats.json")),
+                        mock.patch.dict(planner.PLANNER_SETTINGS, {"placement": "auto"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.client.indexes = set()
+        self.firestore = FirestoreBackend(self.client)
+        self.memory = MemoryBackend({"books": BOOKS})
+        self.previous = use_backend(self.firestore)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str, backend=None):
+        use_backend(backend or self.firestore)
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_evaluate_clauses_locally_when_an_index_is_missing(self):
+        query = 'select title, year from books where "author.lastName" == "Alford" and year > 2000 order by year, title limit 5'
+        expected = self.run_json(query, self.memory)
+
+        self.assertEqual(self.run_json(query), expected)
+        self.assertEqual(self.client.round_trips, 2)
+        self.assertEqual(self.run_json(query.replace("Alford", "Folvale")), self.run_json(query.replace("Alford", "Folvale"), self.memory))
+        self.assertEqual(self.client.round_trips, 3)
+
+        with open(planner.PLACEMENT_FILE, encoding="utf-8") as file:
+            self.assertEqual(json.load(file), {"firestore:fake-project": [query_shape(parse(query))]})
+
+    def test_should_push_everything_down_when_the_index_exists(self):
+        self.client.indexes.add(("books", False, ("author.lastName", "year")))
+        query = 'select title from books where "author.lastName" == "Alford" and year > 2000 order by year'
+
+        self.assertEqual(self.run_json(query), self.run_json(query, self.memory))
+        self.assertEqual(self.client.round_trips, 1)
+        self.assertEqual(self.run_json(f'explain {query}')["placement"], "auto")
+
+    def test_should_count_when_an_index_is_missing(self):
+        query = 'select count * from books where "author.lastName" == "Alford" and year > 2000'
+        self.assertEqual(self.run_json(query), self.run_json(query, self.memory))
+
+    def test_should_not_place_clauses_in_manual_mode(self):
+        planner.PLANNER_SETTINGS["placement"] = "manual"
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select * from books where "author.lastName" == "Alford" and year > 2000')
+
+    def test_should_push_down_the_most_selective_clauses(self):
+        self.run_json('analyze from books', self.memory)
+        where = parse('select * from books where "author.lastName" == "Alford" and pages > 1480 order by pages')["where"]
+        order = [{"property": "pages", "direction": None, "local": False}]
+
+        remote, local, pushed = place_on_single_field_indexes(where, order, stats.collection_stats(self.memory, "books", parse('select * from books')["subject_type"]))
+        self.assertEqual([clause["property"] for clause in remote], ["pages"])
+        self.assertEqual([clause["property"] for clause in local], ["author.lastName"])
+        self.assertEqual(pushed, order)
+
+        remote, local, pushed = place_on_single_field_indexes(where, order, None)
+        self.assertEqual(([clause["property"] for clause in remote], pushed), (["author.lastName"], []))
+
+    def test_should_limit_after_evaluating_locally(self):
+        titles = self.run_json('select title from books where title^ != "x" order by year^ limit 3', self.memory)
+        self.assertEqual(len(titles), 3)
+        plan = plan_query(parse('select title from books where year^ > 2000 limit 3'), self.memory)
+        self.assertIsNone(plan["limit"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Tests the pool of Firestore backends, switching between and fanning out to databases"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import unittest
+from unittest import mock
+
+from lang import backend, pool, ql
+from lang.backend import FirestoreBackend, MemoryBackend, current_backend, use_backend
+from lang.transformer import parse
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(60, 31)
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connected = []
+        for patcher in (mock.patch.dict(pool.POOL_HOLDER, {"backends": {}}),
+                        mock.patch.object(pool, "connect", self.connect)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.previous = use_backend(MemoryBackend({}))
+
+    def tearDown(self):
+        ql.DATABASES_HOLDER["fan_out"] = None
+        ql.SNAPSHOT_HOLDER["read_time"] = None
+        use_backend(self.previous)
+
+    def connect(self, project, database):
+        self.connected.append((project, database))
+        client = FakeClient()
+        client.project = project or "default-project"
+        books = {key: book for index, (key, book) in enumerate(BOOKS.items()) if index % (len(self.connected) + 1) == 0}
+        client.load("books", books)
+        return client
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_reuse_the_client_of_a_database_when_switching_back(self):
+        self.assertEqual(self.run_json('use staging'), {"databases": ["staging"]})
+        self.assertEqual(self.run_json('select count * from books'), 30)
+        self.assertEqual(self.run_json('use "prod/reports"'), {"databases": ["prod/reports"]})
+        self.assertEqual(self.run_json('select count * from books'), 20)
+        staging = self.run_json('use staging')
+
+        self.assertEqual(staging, {"databases": ["staging"]})
+        self.assertEqual(self.run_json('select count * from books'), 30)
+        self.assertEqual(self.connected, [("staging", "(default)"), ("prod", "reports")])
+        self.assertEqual(current_backend().scope(), "firestore:staging")
+        self.assertEqual(pool.pooled_backend("prod/reports").scope(), "firestore:prod/reports")
+        self.assertIs(pool.pooled_backend("staging"), current_backend())
+
+    def test_should_fan_out_queries_to_several_databases_in_parallel(self):
+        self.assertEqual(self.run_json('use staging, "prod/reports", "/audit"'), {"databases": ["staging", "prod/reports", "/audit"]})
+        self.assertEqual(self.run_json('select count * from books'), {"staging": 30, "prod/reports": 20, "/audit": 15})
+        self.assertEqual(self.run_json('select count * from books where year > 1900'), {name: sum(1 for book in list(BOOKS.values())[::step] if book["year"] > 1900) for name, step in (("staging", 2), ("prod/reports", 3), ("/audit", 4))})
+
+        titles = self.run_json('select title from books order by title limit 2')
+        self.assertEqual(titles["/audit"], [{"title": title} for title in sorted(book["title"] for book in list(BOOKS.values())[::4])[:2]])
+        self.assertEqual(json.loads(ql.run_query('select title from books order by title limit 2', lazy=True)[0]), titles)
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select title from books format csv', lazy=True)
+        self.assertEqual(self.run_json('begin snapshot')["snapshot"], ql.SNAPSHOT_HOLDER["read_time"].isoformat())
+        self.assertEqual(self.run_json('select count * from books'), {"staging": 30, "prod/reports": 20, "/audit": 15})
+
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select title from books format csv')
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('declare pages cursor for select title from books order by title')
+
+        self.run_json('end snapshot')
+        self.run_json('use "prod/reports"')
+        self.assertEqual(self.run_json('select count * from books'), 20)
+        self.assertEqual(len(self.connected), 3)
+
+    def test_should_not_fan_out_writes_and_exports(self):
+        self.run_json('use staging, "prod/reports"')
+        queries = ['delete from books where year > 0', 'update from books set year = 2000 where year > 0',
+                   'insert into books (title) values ("A") identified by title', 'import into books from "books.ndjson"',
+                   'export from books to "dump"']
+        for query in queries:
+            parse(query)
+            with self.subTest(query=query), self.assertRaisesRegex(ql.QueryError, "Only reads fan out"):
+                ql.run_query(query)
+
+        self.assertEqual(self.run_json('select count * from books'), {"staging": 30, "prod/reports": 20})
+
+    def test_should_only_name_a_database_that_is_not_the_default(self):
+        with mock.patch.object(backend.fs, "client") as client:
+            backend.firestore_client("app", "(default)")
+            backend.firestore_client("app", "reports")
+            _ = FirestoreBackend().client
+        self.assertEqual(client.call_args_list, [mock.call("app"), mock.call("app", database_id="reports"), mock.call(None)])
+
+    def test_should_reject_malformed_databases(self):
+        for target in ('"a/b/c"', '"/"'):
+            with self.subTest(target=target), self.assertRaises(ql.QueryError):
+                ql.run_query(f'use {target}')
+        self.assertEqual(pool.parse_target("/audit"), (None, "audit"))
+        self.assertEqual(pool.target_name(None, "(default)"), "(default)")
+
+
+if __name__ == '__main__':
+    unittest.main()
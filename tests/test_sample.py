@@ -0,0 +1,85 @@
+"""Tests sampling the documents of a query for approximate answers"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import contextlib
+import io
+import json
+import random
+import statistics
+import unittest
+import uuid
+
+from lang import ql, sample
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(4000, 19)
+RANDOM_IDS = {uuid.UUID(int=random.Random(index).getrandbits(128)).hex[:20]: book for index, book in enumerate(BOOKS.values())}
+
+
+class TestSample(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.client.load("random", RANDOM_IDS)
+        self.client.indexes = set()
+        self.previous = use_backend(FirestoreBackend(self.client))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_query(self, query: str):
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            content = ql.run_query(query)[0]
+        return (json.loads(content), errors.getvalue())
+
+    def test_should_read_a_sample_with_random_seeks(self):
+        for collection in ("books", "random"):
+            self.client.round_trips = 0
+            books, errors = self.run_query(f'select year from {collection} sample 400')
+
+            self.assertEqual(len(books), 400)
+            self.assertLess(self.client.round_trips, 2 * sample.SAMPLE_SEEKS)
+            self.assertAlmostEqual(statistics.mean(book["year"] for book in books), statistics.mean(book["year"] for book in BOOKS.values()), delta=8)
+            self.assertIn(f"estimates from a sample of 400 of {len(BOOKS)} documents", errors)
+
+    def test_should_evaluate_filters_and_aggregates_over_a_percentage(self):
+        published = sum(1 for book in BOOKS.values() if book["published"])
+        books, errors = self.run_query('select title, year from books where published == true and year > 2000 sample 5 percent order by year desc limit 10')
+
+        self.assertIn(f"estimates from a sample of {-(-published * 5 // 100)} of {published} documents", errors)
+        self.assertEqual(len(books), 10)
+        self.assertEqual([book["year"] for book in books], sorted((book["year"] for book in books), reverse=True))
+        published_titles = {book["title"] for book in BOOKS.values() if book["published"]}
+        self.assertTrue(all(book["title"] in published_titles and book["year"] > 2000 for book in books))
+
+        count, _ = self.run_query('select count * from books sample 250')
+        self.assertEqual(count, 250)
+
+    def test_should_only_sample_as_many_documents_as_the_limit(self):
+        books, errors = self.run_query('select year from books sample 400 limit 10')
+        self.assertEqual(len(books), 10)
+        self.assertIn(f"estimates from a sample of 10 of {len(BOOKS)} documents", errors)
+
+        books, errors = self.run_query('select year from books sample 400 order by year limit 10')
+        self.assertEqual([book["year"] for book in books], sorted(book["year"] for book in books))
+        self.assertIn(f"estimates from a sample of 400 of {len(BOOKS)} documents", errors)
+
+    def test_should_sample_every_document_of_a_small_result(self):
+        use_backend(MemoryBackend({"books": BOOKS}))
+        books, errors = self.run_query('select title from books where "author.lastName" == "Alford" sample 100 percent')
+        self.assertEqual(sorted(book["title"] for book in books), sorted(book["title"] for book in BOOKS.values() if book["author"]["lastName"] == "Alford"))
+        self.assertIn(f"of {len(books)} documents", errors)
+
+    def test_should_pick_ids_evenly_between_two_ids(self):
+        rng = random.Random(3)
+        ids = [sample.id_between("book00000000", "book00003999", rng) for _ in range(2000)]
+        self.assertTrue(all("book00000000" <= key <= "book00003999" for key in ids))
+        self.assertAlmostEqual(sum(key < "book00002000" for key in ids) / len(ids), 0.5, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Tests the schema cache that completes queries in the REPL"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long,consider-using-namedtuple-or-dataclass
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from lang import ql, schema
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+from lang.schema import SchemaCache
+
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = {
+    "a": {"title": "A", "year": 2001, "author": {"lastName": "Diamond"}},
+    "b": {"title": "B", "isbn-13": "0001"},
+}
+
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "schema.json")
+        self.memory = MemoryBackend({"books": BOOKS, "book_reviews": {"r": {"stars": 5}}})
+        self.previous = use_backend(self.memory)
+
+    def tearDown(self):
+        use_backend(self.previous)
+        schema.use_schema_cache(None)
+
+    def warm(self, cache: SchemaCache):
+        cache.refresh("collections", "", wait=True)
+        cache.refresh("fields", "books", wait=True)
+
+    def test_should_complete_keywords_collections_and_fields(self):
+        cache = SchemaCache(self.memory, None)
+        self.assertEqual(cache.completions("select * from ", "bo"), [])
+        self.warm(cache)
+
+        self.assertEqual(cache.completions("select * from ", "bo"), ["book_reviews", "books"])
+        self.assertEqual(cache.completions("", "sel"), ["select"])
+        self.assertEqual(cache.completions("select title from books where ", "au"), ['author', '"author.lastName"'])
+        self.assertEqual(cache.completions("select title from books where ", '"author.'), ['"author.lastName"'])
+        self.assertEqual(cache.completions('update at "books/a" set ', "is"), ['"isbn-13"'])
+        self.assertIn("array_union", cache.completions("update from books set tags = ", "arr"))
+
+    def test_should_keep_the_schema_on_disk(self):
+        client = FakeClient()
+        client.load("books", BOOKS)
+        backend = FirestoreBackend(client)
+        self.warm(SchemaCache(backend, self.path))
+
+        with open(self.path, encoding="utf-8") as file:
+            self.assertEqual(list(json.load(file)), ["firestore:fake-project"])
+
+        client.rpc_latency = 1.0
+        started = time.monotonic()
+        self.assertEqual(SchemaCache(backend, self.path).completions("select * from ", ""), ["books"])
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_should_refresh_expired_entries_in_the_background(self):
+        cache = SchemaCache(self.memory, None)
+        self.warm(cache)
+        self.memory.add("authors", {"name": "Leroi"}, "leroi")
+
+        with mock.patch.object(schema, "SCHEMA_TTL", -1.0), mock.patch.object(cache, "refresh") as refresh:
+            self.assertEqual(cache.collections(), ["book_reviews", "books"])
+        refresh.assert_called_once_with("collections", "")
+
+    def test_should_record_shown_collections(self):
+        cache = SchemaCache(self.memory, None)
+        schema.use_schema_cache(cache)
+        ql.run_query("show collections")
+        with mock.patch.object(cache, "refresh") as refresh:
+            self.assertEqual(cache.collections(), ["book_reviews", "books"])
+        refresh.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
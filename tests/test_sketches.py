@@ -0,0 +1,98 @@
+"""Tests the approximate aggregates, computed with mergeable sketches"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import random
+import unittest
+
+from lang import ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+from lang.sketch import HyperLogLog, QuantileSketch
+from lang.transformer import parse
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = generate_books(3000, 23)
+
+
+def rank_of(numbers: list, number) -> float:
+    return sum(1 for value in numbers if value <= number) / len(numbers)
+
+
+class TestSketches(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = use_backend(MemoryBackend({"books": BOOKS}))
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_estimate_the_number_of_distinct_values(self):
+        for count in (0, 1, 50, 5_000, 200_000):
+            sketch = HyperLogLog()
+            for value in range(count):
+                sketch.add(value)
+                sketch.add(value)
+            with self.subTest(count=count):
+                self.assertAlmostEqual(sketch.estimate(), count, delta=max(1, count * 0.03))
+
+    def test_should_merge_distinct_values_into_the_sketch_of_their_union(self):
+        first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for value in range(60_000):
+            first.add(f"user{value}")
+        for value in range(40_000, 100_000):
+            second.add(f"user{value}")
+        for value in range(100_000):
+            union.add(f"user{value}")
+
+        self.assertEqual(first.merge(second).registers, union.registers)
+
+    def test_should_estimate_quantiles_in_bounded_memory(self):
+        rng = random.Random(5)
+        numbers = [rng.lognormvariate(4, 1) for _ in range(100_000)]
+        halves = (QuantileSketch(rng=random.Random(1)), QuantileSketch(rng=random.Random(2)))
+        for index, number in enumerate(numbers):
+            halves[index % 2].add(number)
+        self.assertLess(sum(len(level) for level in halves[0].levels), 4 * halves[0].size)
+
+        merged = halves[0].merge(halves[1])
+        for quantile in (0.01, 0.5, 0.95, 0.99):
+            with self.subTest(quantile=quantile):
+                self.assertAlmostEqual(rank_of(numbers, merged.quantile(quantile)), quantile, delta=0.02)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        self.assertEqual(QuantileSketch().merge(halves[1]).quantile(1), max(numbers[1::2]))
+
+    def test_should_answer_approximate_aggregates_over_the_partitions_of_a_scan(self):
+        query = 'select approx_count_distinct(title), approx_count_distinct("author.lastName"), approx_quantile(pages, 0.9) from books where rating^ > 3'
+        books = [book for book in BOOKS.values() if book["rating"] > 3]
+        pages = [book["pages"] for book in books]
+        result = self.run_json(query)
+
+        self.assertEqual(list(result[0]), ["approx_count_distinct(title)", "approx_count_distinct(author.lastName)", "approx_quantile(pages, 0.9)"])
+        self.assertAlmostEqual(result[0]["approx_count_distinct(title)"], len({book["title"] for book in books}), delta=len(books) * 0.03)
+        self.assertEqual(result[0]["approx_count_distinct(author.lastName)"], len({book["author"]["lastName"] for book in books}))
+        self.assertAlmostEqual(rank_of(pages, result[0]["approx_quantile(pages, 0.9)"]), 0.9, delta=0.02)
+
+        client = FakeClient()
+        client.load("books", BOOKS)
+        use_backend(FirestoreBackend(client))
+        content = ql.run_query('select approx_quantile(year, 0.5) from books where published == true format csv')[0]
+        years = [book["year"] for book in BOOKS.values() if book["published"]]
+        self.assertEqual(content.splitlines()[0], '"approx_quantile(year, 0.5)"')
+        self.assertAlmostEqual(rank_of(years, int(content.splitlines()[1])), 0.5, delta=0.02)
+
+    def test_should_apply_a_limit_to_the_whole_scan(self):
+        query = parse('select approx_count_distinct(title) from books')
+        result = ql.execute_sketch_query({**query, "limit": 10})
+        self.assertEqual(result[0].document, {"approx_count_distinct(title)": 10})
+
+    def test_should_reject_quantiles_outside_of_zero_and_one(self):
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select approx_quantile(pages, 95) from books')
+
+
+if __name__ == '__main__':
+    unittest.main()
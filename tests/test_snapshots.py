@@ -0,0 +1,96 @@
+"""Tests pinning reads to a point in time, with as of and the snapshot of the session"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import datetime
+import json
+import unittest
+from unittest import mock
+
+from lang import ql
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeAggregationQuery, FakeClient, FakeQuery
+
+BOOKS = generate_books(120, 29)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.client.load("books", BOOKS)
+        self.previous = use_backend(FirestoreBackend(self.client))
+
+    def tearDown(self):
+        ql.SNAPSHOT_HOLDER["read_time"] = None
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_read_the_documents_as_of_a_point_in_time(self):
+        before = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        ql.run_query('update from books set year = 1800 where year > 1950')
+        ql.run_query('delete at "books/book00000001"')
+        ql.run_query('insert into books set title = "New", year = 2020 identified by "new"')
+
+        years = sorted(book["year"] for book in BOOKS.values())
+        self.assertEqual([book["year"] for book in self.run_json(f'select year from books as of "{before}" order by year')], years)
+        self.assertEqual(self.run_json(f'select count * from books as of "{before}"'), len(BOOKS))
+        self.assertEqual(self.run_json(f'select title at "books/book00000001" as of "{before}"'), [{"title": BOOKS["book00000001"]["title"]}])
+        self.assertEqual(self.run_json(f'select year at ["books/new", "books/book00000002"] as of "{before}"'), [{"year": BOOKS["book00000002"]["year"]}])
+        self.assertEqual(self.run_json('select count * from books where year > 1950'), 1)
+
+    def test_should_only_pass_a_read_time_to_pinned_reads(self):
+        before = datetime.datetime.now(datetime.timezone.utc)
+        with mock.patch.object(FakeQuery, "stream", autospec=True, side_effect=FakeQuery.stream) as stream, \
+                mock.patch.object(FakeAggregationQuery, "get", autospec=True, side_effect=FakeAggregationQuery.get) as count:
+            self.run_json('select title from books limit 1')
+            self.assertEqual(stream.call_args.kwargs, {})
+            self.run_json('select count * from books')
+            self.assertEqual(count.call_args.kwargs, {})
+
+            self.run_json(f'select title from books as of "{before.isoformat()}" limit 1')
+            self.assertEqual(stream.call_args.kwargs, {"read_time": before})
+            self.run_json(f'select count * from books as of "{before.isoformat()}"')
+            self.assertEqual(count.call_args.kwargs, {"read_time": before})
+
+    def test_should_page_a_snapshot_of_the_session_that_others_write_to(self):
+        self.run_json('begin snapshot')
+        self.run_json('declare pages cursor for select title from books order by year, title')
+        first = self.run_json('fetch 40 from pages')
+
+        read = {book["title"] for book in first}
+        unread = [book_id for book_id, book in BOOKS.items() if book["title"] not in read]
+        self.client.write("update", f"books/{unread[0]}", {"year": 1000})
+        self.client.write("update", f"books/{unread[1]}", {"year": 3000})
+        self.client.write("delete", f"books/{unread[2]}", None)
+
+        rest = self.run_json('fetch 200 from pages')
+        self.assertEqual(sorted(book["title"] for book in first + rest), sorted(book["title"] for book in BOOKS.values()))
+        self.assertEqual(self.run_json('select count * from books'), len(BOOKS))
+
+        ended = self.run_json('end snapshot')
+        self.assertIsNotNone(ended["snapshot"])
+        self.assertEqual(self.run_json('select count * from books'), len(BOOKS) - 1)
+
+    def test_should_refuse_writes_while_the_session_reads_a_snapshot(self):
+        self.run_json('begin snapshot as of "2026-01-02T03:04:05Z"')
+        self.assertEqual(ql.SNAPSHOT_HOLDER["read_time"], datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc))
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('update at "books/book00000001" set year = 1')
+
+        self.run_json('end snapshot')
+        ql.run_query('update at "books/book00000001" set year = 1')
+        self.assertEqual(self.run_json('select year at "books/book00000001"'), [{"year": 1}])
+
+    def test_should_not_pin_the_reads_of_the_memory_backend(self):
+        use_backend(MemoryBackend({"books": BOOKS}))
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('select title from books as of "2026-01-02T03:04:05Z"')
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('begin snapshot')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Tests analyzing collections and estimating the cost of queries"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long,consider-using-namedtuple-or-dataclass
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lang import ql, stats
+from lang.backend import FirestoreBackend, MemoryBackend, use_backend
+from lang.planner import plan_query
+from lang.transformer import parse
+
+from benchmarks.data import generate_books
+from benchmarks.fake_firestore import FakeClient
+
+BOOKS = {
+    "a": {"year": 2001, "title": "A", "tags": ["poetry"], "author": {"lastName": "Diamond"}},
+    "b": {"year": 1999, "title": "B", "tags": [], "author": {"lastName": "Leroi"}},
+    "c": {"year": 2005, "title": "C", "tags": ["poetry", "art"], "author": {"lastName": "Diamond"}},
+    "d": {"year": 2005, "title": "D", "author": {"lastName": "Marie"}},
+}
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        for patcher in (mock.patch.dict(stats.STATS_HOLDER, {"saved": None}),
+                        mock.patch.object(stats, "STATS_FILE", os.path.join(self.directory.name, "stats.json"))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.memory = MemoryBackend({"books": BOOKS})
+        self.previous = use_backend(self.memory)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_analyze_every_field(self):
+        analyzed = self.run_json('analyze from books')
+        self.assertEqual((analyzed["documents"], analyzed["sampled"]), (4, 4))
+        self.assertEqual(analyzed["fields"]["year"], {"presence": 1.0, "distinct": 3, "min": 1999, "max": 2005, "types": {"number": 1.0}, "elements": None, "length": None})
+        self.assertEqual(analyzed["fields"]["tags"]["presence"], 0.75)
+        self.assertEqual((analyzed["fields"]["tags"]["elements"], analyzed["fields"]["tags"]["length"]), (2, 1.0))
+        self.assertEqual(analyzed["fields"]["author.lastName"]["distinct"], 3)
+        self.assertEqual(analyzed["fields"]["author"]["types"], {"map": 1.0})
+        # the name and fields of "books/a" take 28 and 54 bytes
+        self.assertGreater(analyzed["average_size"], 100)
+
+    def test_should_sample_and_count_large_collections(self):
+        use_backend(MemoryBackend({"books": generate_books(2000, 42)}))
+        analyzed = self.run_json('analyze from books sample 400')
+        self.assertEqual(analyzed["documents"], 2000)
+        self.assertEqual(analyzed["sampled"], 400)
+
+        estimate = self.run_json('explain select * from books where year >= 2000')["estimate"]
+        actual = self.run_json('select count * from books where year >= 2000')
+        self.assertLess(abs(estimate["reads"] - actual) / actual, 0.2)
+
+    def test_should_estimate_and_order_local_clauses(self):
+        self.run_json('analyze from books')
+        plan = plan_query(parse('select * from books where title^ != "A" and year^ == 2005 and isbn^ == "1" limit 1'), self.memory)
+
+        self.assertEqual([where["property"] for where in plan["local_where"]], ["isbn", "year", "title"])
+        self.assertEqual(plan["estimate"]["reads"], 4)
+        self.assertEqual(plan["estimate"]["results"], 0)
+        self.assertIsNone(plan_query(parse('select * from authors'), self.memory)["estimate"])
+
+    def test_should_guess_without_statistics(self):
+        self.assertEqual(stats.selectivity(None, {"property": "year", "operator": "==", "value": 1, "local": False}), 0.005)
+        self.assertIsNone(self.run_json('explain select * from books where year == 2005')["estimate"])
+
+    def test_should_keep_firestore_statistics_on_disk(self):
+        client = FakeClient()
+        client.load("books", BOOKS)
+        backend = FirestoreBackend(client)
+        use_backend(backend)
+        self.run_json('analyze within books sample 2')
+
+        stats.STATS_HOLDER["saved"] = None
+        estimate = self.run_json('explain select * within books where "author.lastName" == "Leroi"')["estimate"]
+        self.assertEqual(estimate["documents"], 4)
+        with open(stats.STATS_FILE, encoding="utf-8") as file:
+            self.assertEqual(list(json.load(file)["firestore:fake-project"]), ["collection_group:books"])
+
+    def test_should_reject_analyzing_a_document(self):
+        with self.assertRaises(ql.QueryError):
+            ql.run_query('analyze at "books/a"')
+
+
+if __name__ == '__main__':
+    unittest.main()
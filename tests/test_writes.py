@@ -0,0 +1,148 @@
+"""Tests scheduling the writes of mass updates and deletes"""
+# pylint: disable=missing-function-docstring,missing-class-docstring,line-too-long
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.api_core import exceptions
+
+from lang import ql, writes
+from lang.backend import MemoryBackend, use_backend
+
+BOOKS = {f"{index:02d}": {"year": 1990 + index, "views": 0} for index in range(20)}
+
+
+class PushBackBackend(MemoryBackend):
+    """Pushes back on the first writes and keeps failing writes to some documents."""
+    throttled = True
+
+    def __init__(self, collections, push_back: int, failing: dict[str, Exception]):
+        super().__init__(collections)
+        self.push_back = push_back
+        self.failing = failing
+        self.attempts: dict[str, int] = {}
+
+    def update(self, path, data):
+        self.attempts[path] = self.attempts.get(path, 0) + 1
+        if path in self.failing:
+            raise self.failing[path]
+        if sum(self.attempts.values()) <= self.push_back:
+            raise exceptions.ResourceExhausted("quota exceeded")
+        super().update(path, data)
+
+
+class FlakyBackend(MemoryBackend):
+    """Pushes back on the first batches that are committed."""
+
+    def __init__(self, push_back: int):
+        super().__init__()
+        self.push_back = push_back
+        self.batches: list[int] = []
+
+    def commit(self, writes):  # pylint: disable=redefined-outer-name
+        self.batches.append(len(writes))
+        if len(self.batches) <= self.push_back:
+            raise exceptions.DeadlineExceeded("deadline exceeded")
+        super().commit(writes)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class TestWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.directory.cleanup)
+        for name, value in {"JOURNAL_DIR": os.path.join(self.directory.name, "failures"),
+                            "WRITE_BACKOFF_BASE": 0.001, "WRITE_RATE_START": 10_000.0}.items():
+            patcher = mock.patch.object(writes, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.previous = use_backend(MemoryBackend())
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def run_json(self, query: str):
+        return json.loads(ql.run_query(query)[0])
+
+    def test_should_retry_writes_that_are_pushed_back(self):
+        backend = PushBackBackend({"books": BOOKS}, push_back=10, failing={})
+        use_backend(backend)
+
+        self.assertEqual(self.run_json('update from books set views = views + 1 where year >= 1990'), {"count": 20})
+        self.assertEqual(self.run_json('select count * from books where views == 1'), 20)
+        self.assertEqual(sum(backend.attempts.values()), 30)
+
+    def test_should_journal_writes_that_keep_failing_and_replay_them(self):
+        backend = PushBackBackend({"books": BOOKS}, push_back=0, failing={
+            "books/03": exceptions.Aborted("contention"),
+            "books/07": ValueError("No document to update: books/07"),
+        })
+        use_backend(backend)
+
+        result = self.run_json('update from books set views = views + 1, tags = array_union(["a"]) where year >= 1990')
+        self.assertEqual((result["count"], result["failed"]), (18, 2))
+        self.assertEqual(backend.attempts["books/03"], writes.WRITE_RETRIES + 1)
+        self.assertEqual(backend.attempts["books/07"], 1)
+
+        backend.failing.pop("books/03")
+        replayed = json.loads(ql.replay_failures(result["journal"])[0])
+        self.assertEqual((replayed["count"], replayed["failed"]), (1, 1))
+        self.assertFalse(os.path.exists(result["journal"]))
+        self.assertEqual(self.run_json('select views, tags at "books/03"'), [{"views": 1, "tags": ["a"]}])
+
+        with open(replayed["journal"], encoding="utf-8") as file:
+            entry = json.loads(file.readline())
+        self.assertEqual((entry["path"], entry["data"]["tags"]), ("books/07", {"__transform__": "array_union", "operand": ["a"]}))
+
+    def test_should_delete_every_document(self):
+        use_backend(MemoryBackend({"books": BOOKS}))
+        self.assertEqual(self.run_json('delete from books where year < 2000'), {"count": 10})
+        self.assertEqual(self.run_json('select count * from books'), 10)
+
+    def test_should_ramp_up_and_back_off(self):
+        clock = FakeClock()
+        limiter = writes.RateLimiter(500.0, clock=clock, sleep=clock.sleep)
+
+        for _ in range(500):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now, 499 / 500)
+
+        clock.now = writes.WRITE_RATE_PERIOD * 2
+        limiter.acquire()
+        self.assertEqual(limiter.rate, 500.0 * writes.WRITE_RATE_GROWTH ** 2)
+
+        limiter.back_off()
+        limiter.back_off()
+        self.assertEqual(limiter.rate, 562.5)
+
+        clock.now += writes.WRITE_RATE_PERIOD - 1
+        limiter.acquire()
+        self.assertEqual(limiter.rate, 562.5)
+
+    def test_should_retry_the_batches_of_an_import(self):
+        backend = FlakyBackend(push_back=2)
+        use_backend(backend)
+        path = os.path.join(self.directory.name, "books.ndjson")
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps({"id": index}) + "\n" for index in range(1001))
+
+        self.assertEqual(self.run_json(f'import into books from "{path}" identified by id'), {"count": 1001})
+        self.assertEqual(len(backend.batches), 5)
+        self.assertEqual(self.run_json('select count * from books'), 1001)
+
+
+if __name__ == '__main__':
+    unittest.main()